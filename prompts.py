@@ -33,6 +33,48 @@ FEATURE_MATCH_PROMPT = """Ты - эксперт по геологическим
 
 Не добавляй никаких объяснений, только "ДА" или "НЕТ"."""
 
+# Тот же промпт проверки, разделенный на системное сообщение (одинаковое для всех
+# признаков, поэтому его префикс переиспользуется моделью) и сообщение пользователя
+FEATURE_MATCH_SYSTEM_PROMPT = """Ты - эксперт по геологическим признакам.
+
+Тебе передают исходный запрос пользователя, название и описание признака.
+Определи, соответствует ли этот признак запросу пользователя.
+
+Верни ТОЛЬКО одно слово:
+- "ДА" - если признак соответствует запросу
+- "НЕТ" - если признак не соответствует запросу
+
+Не добавляй никаких объяснений, только "ДА" или "НЕТ"."""
+
+FEATURE_MATCH_USER_PROMPT = (
+    'Исходный запрос пользователя: "{user_query}"\n\n'
+    'Название признака: "{feature_name}"\n'
+    'Описание признака: "{feature_description}"'
+)
+
+# Пакетная проверка: все найденные признаки оцениваются одним запросом к GigaChat
+FEATURE_MATCH_BATCH_SYSTEM_PROMPT = """Ты - эксперт по геологическим признакам.
+
+Тебе передают исходный запрос пользователя и пронумерованный список признаков с описаниями.
+Для каждого признака определи, соответствует ли он запросу пользователя.
+
+Верни ТОЛЬКО JSON массив из чисел 1 и 0 в порядке номеров признаков:
+- 1 - если признак соответствует запросу
+- 0 - если признак не соответствует запросу
+
+Длина массива должна совпадать с количеством признаков. Не добавляй никаких объяснений.
+Пример ответа для трех признаков: [1, 0, 0]"""
+
+FEATURE_MATCH_BATCH_USER_PROMPT = (
+    'Исходный запрос пользователя: "{user_query}"\n\n'
+    'Признаки ({count}):\n{features}'
+)
+
+FEATURE_MATCH_BATCH_ITEM = (
+    '{number}. Название признака: "{feature_name}"\n'
+    '   Описание признака: "{feature_description}"'
+)
+
 # Промпт для генерации SQL запроса на основе найденного признака
 SQL_GENERATION_PROMPT = """Ты - эксперт по написанию SQL запросов для работы с CSV файлами через DuckDB.
 
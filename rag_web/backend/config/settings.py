@@ -78,6 +78,29 @@ DATABASES = {
     }
 }
 
+# Кэш (используется для ответов на повторяющиеся запросы пользователей)
+# Если задан REDIS_URL, используется Redis (общий для всех воркеров gunicorn,
+# требуется пакет redis), иначе - кэш в памяти процесса
+REDIS_URL = os.environ.get('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'rag-api',
+            'OPTIONS': {'MAX_ENTRIES': 1000},
+        }
+    }
+
+# Время жизни закэшированного ответа на запрос (в секундах)
+RAG_QUERY_CACHE_TIMEOUT = int(os.environ.get('RAG_QUERY_CACHE_TIMEOUT', 3600))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -104,6 +127,33 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Логирование: один обработчик на процесс вместо logging.basicConfig при импорте модулей
+LOG_LEVEL = os.environ.get('DJANGO_LOG_LEVEL', 'INFO').upper()
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': 'INFO',
+    },
+    'loggers': {
+        'rag_api': {
+            'level': LOG_LEVEL,
+        },
+    },
+}
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
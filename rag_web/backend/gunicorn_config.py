@@ -10,7 +10,10 @@ bind = "127.0.0.1:8000"
 workers = 3
 
 # Класс воркера
-worker_class = "sync"
+# gthread: запросы обслуживаются потоками, поэтому ожидание внешних API
+# (опрос статуса HeyGen, SSE поток прогресса) не занимает весь воркер
+worker_class = "gthread"
+threads = 16
 
 # Таймауты
 timeout = 120  # Время ожидания ответа (важно для долгих запросов RAG)
@@ -31,3 +34,10 @@ preload_app = True
 max_requests = 1000
 max_requests_jitter = 50
 
+
+def post_worker_init(worker):
+    """Прогрев RAG системы в каждом воркере сразу после его запуска."""
+    import os
+    if os.environ.get('RAG_WARMUP', 'True').lower() == 'true':
+        from rag_api.views import warm_up_rag_system
+        warm_up_rag_system()
@@ -1,3 +1,6 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
 
@@ -5,3 +8,23 @@ class RagApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rag_api'
 
+    def ready(self):
+        """
+        Предварительная инициализация RAG системы при запуске dev-сервера.
+
+        Под gunicorn прогрев выполняется в каждом воркере (post_worker_init
+        в gunicorn_config.py): при preload_app ready() вызывается в мастер-процессе,
+        где загружать модель не нужно. Для остальных команд manage.py
+        (migrate, collectstatic и т.д.) прогрев не выполняется.
+        Отключается переменной окружения RAG_WARMUP=False.
+        """
+        if os.environ.get('RAG_WARMUP', 'True').lower() != 'true':
+            return
+        if len(sys.argv) < 2 or sys.argv[1] != 'runserver':
+            return
+        # В родительском процессе автоперезагрузчика runserver запросы не обрабатываются
+        if os.environ.get('RUN_MAIN') != 'true' and '--noreload' not in sys.argv:
+            return
+
+        from .views import warm_up_rag_system
+        warm_up_rag_system()
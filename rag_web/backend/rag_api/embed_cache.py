@@ -0,0 +1,45 @@
+"""
+LRU кэш эмбеддингов текстов.
+
+Один и тот же текст векторизуется несколько раз за запрос (поиск и запись
+в семантическом кэше) и повторяется между запросами. Результат encode
+кэшируется по ключу (модель, текст); векторы возвращаются только для чтения,
+чтобы вызывающий код не мог изменить закэшированное значение.
+"""
+
+from functools import lru_cache
+from typing import Dict
+
+import numpy as np
+
+# Количество закэшированных эмбеддингов (1024 float32 = 4 КБ на запись)
+EMBEDDING_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=EMBEDDING_CACHE_SIZE)
+def encode_cached(model, text: str) -> np.ndarray:
+    """
+    Эмбеддинг текста с кэшированием.
+
+    Args:
+        model: Модель SentenceTransformer
+        text: Текст для векторизации
+
+    Returns:
+        Вектор float32 (только для чтения)
+    """
+    embedding = np.asarray(model.encode(text), dtype=np.float32)
+    embedding.flags.writeable = False
+    return embedding
+
+
+def embedding_cache_stats() -> Dict[str, float]:
+    """Статистика попаданий в кэш эмбеддингов."""
+    info = encode_cached.cache_info()
+    total = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'hit_rate': info.hits / total if total else 0.0
+    }
@@ -0,0 +1,128 @@
+"""
+Быстрые агрегаты по группам для сводки результатов SQL в промпте.
+
+Если установлен numba, ядро агрегации компилируется JIT (один проход по
+данным без промежуточных объектов pandas). Без numba используется
+векторизованная реализация на numpy с тем же результатом.
+"""
+
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _groupby_stats_kernel(group_ids, values, n_groups):
+        mins = np.full(n_groups, np.inf)
+        maxs = np.full(n_groups, -np.inf)
+        sums = np.zeros(n_groups)
+        counts = np.zeros(n_groups, dtype=np.int64)
+        for i in range(values.shape[0]):
+            value = values[i]
+            group = group_ids[i]
+            if group < 0 or np.isnan(value):
+                continue
+            if value < mins[group]:
+                mins[group] = value
+            if value > maxs[group]:
+                maxs[group] = value
+            sums[group] += value
+            counts[group] += 1
+        return mins, maxs, sums, counts
+else:
+    def _groupby_stats_kernel(group_ids, values, n_groups):
+        valid = (group_ids >= 0) & ~np.isnan(values)
+        groups = group_ids[valid]
+        valid_values = values[valid]
+
+        mins = np.full(n_groups, np.inf)
+        maxs = np.full(n_groups, -np.inf)
+        np.minimum.at(mins, groups, valid_values)
+        np.maximum.at(maxs, groups, valid_values)
+        sums = np.bincount(groups, weights=valid_values, minlength=n_groups)
+        counts = np.bincount(groups, minlength=n_groups)
+        return mins, maxs, sums, counts
+
+
+def groupby_min_max_mean(
+    group_ids: np.ndarray,
+    values: np.ndarray,
+    n_groups: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Минимум, максимум, среднее и количество значений по группам.
+
+    Args:
+        group_ids: Номера групп (int64, -1 - строка без группы)
+        values: Значения (float64, NaN пропускаются)
+        n_groups: Количество групп
+
+    Returns:
+        Tuple[минимумы, максимумы, средние, количества] длины n_groups
+    """
+    mins, maxs, sums, counts = _groupby_stats_kernel(
+        np.ascontiguousarray(group_ids, dtype=np.int64),
+        np.ascontiguousarray(values, dtype=np.float64),
+        n_groups
+    )
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    return mins, maxs, means, counts
+
+
+def summarize_numeric_by_group(
+    df: pd.DataFrame,
+    group_column: str,
+    exclude: Optional[Iterable[str]] = None
+) -> pd.DataFrame:
+    """
+    Сводка числовых колонок по группам (min/max/среднее).
+
+    Args:
+        df: DataFrame с результатами
+        group_column: Колонка группировки (например, layer_name)
+        exclude: Колонки, которые не нужно агрегировать
+
+    Returns:
+        DataFrame с колонками: группа, признак, n, min, max, среднее
+    """
+    excluded = set(exclude or ()) | {group_column}
+    numeric_columns = [
+        col for col in df.select_dtypes(include='number').columns
+        if col not in excluded
+    ]
+    if not numeric_columns or group_column not in df.columns:
+        return pd.DataFrame()
+
+    group_ids, groups = pd.factorize(df[group_column])
+    n_groups = len(groups)
+    if n_groups == 0:
+        return pd.DataFrame()
+
+    frames = []
+    for col in numeric_columns:
+        values = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        mins, maxs, means, counts = groupby_min_max_mean(group_ids, values, n_groups)
+        present = counts > 0
+        if not present.any():
+            continue
+        frames.append(pd.DataFrame({
+            group_column: groups[present],
+            'признак': col,
+            'n': counts[present],
+            'min': mins[present],
+            'max': maxs[present],
+            'среднее': means[present]
+        }))
+
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
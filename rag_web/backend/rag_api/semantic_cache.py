@@ -0,0 +1,303 @@
+"""
+Семантический кэш ответов RAG системы (LRU + TTL).
+
+Запрос пользователя векторизуется той же моделью эмбеддингов, что и поиск
+в OpenSearch, и сравнивается с ранее закэшированными запросами по косинусной
+близости. При совпадении выше порога возвращается сохраненный результат без
+обращений к GigaChat и OpenSearch. Числа и операторы сравнения в запросах
+при этом должны совпадать.
+
+Ответы для запросов без данных хранятся отдельно (только точное совпадение
+нормализованного запроса) с более коротким сроком жизни, чтобы после загрузки
+новых данных запрос быстро начал возвращать результаты.
+
+Кэш привязан к версии данных (например, uuid и количеству документов индексов
+OpenSearch): при смене версии все записи сбрасываются.
+"""
+
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .embed_cache import encode_cached
+
+
+# Числа и операторы/слова сравнения в запросе. Запросы, различающиеся только
+# порогом или направлением сравнения ("R0 больше 1%" и "R0 меньше 2%"), близки
+# по эмбеддингу, но требуют разных данных, поэтому семантическое попадание
+# принимается только при совпадении этих токенов
+_CONSTRAINT_PATTERN = re.compile(
+    r"\d+(?:[.,]\d+)?"
+    r"|[<>]=?|[!=]=|="
+    r"|\b(?:больш\w*|меньш\w*|выше|ниже|более|менее|свыше|превыш\w*"
+    r"|не|равн\w*|от|до|между|максим\w*|миним\w*|макс|мин)\b"
+)
+
+
+def normalize_query(user_query: str) -> str:
+    """Нормализация запроса для использования в качестве ключа кэша."""
+    return " ".join(user_query.lower().split())
+
+
+def query_constraints(key: str) -> Tuple[str, ...]:
+    """
+    Числа и операторы сравнения нормализованного запроса в порядке появления.
+
+    Args:
+        key: Нормализованный запрос
+
+    Returns:
+        Кортеж токенов (десятичная запятая приводится к точке)
+    """
+    return tuple(token.replace(',', '.') for token in _CONSTRAINT_PATTERN.findall(key))
+
+
+class SemanticCache:
+    """
+    Потокобезопасный семантический кэш с вытеснением по LRU и сроку жизни.
+    """
+
+    def __init__(
+        self,
+        embedding_model,
+        max_size: int = 1000,
+        ttl_seconds: float = 600,
+        tau: float = 0.92,
+        negative_ttl_seconds: float = 120
+    ):
+        """
+        Инициализация кэша.
+
+        Args:
+            embedding_model: Модель SentenceTransformer (переиспользуется, новая не загружается)
+            max_size: Максимальное количество записей
+            ttl_seconds: Время жизни записи в секундах
+            tau: Минимальная косинусная близость для попадания в кэш
+            negative_ttl_seconds: Время жизни ответа для запроса без данных
+        """
+        self.embedding_model = embedding_model
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.tau = tau
+        self.negative_ttl_seconds = negative_ttl_seconds
+
+        self._lock = threading.RLock()
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        # Ответы для запросов без данных: ключ -> (ответ, время записи)
+        self._negative: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+        # Матрица нормализованных эмбеддингов (N, d) и ключи в том же порядке
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys = []
+        self._matrix_dirty = True
+
+        # Версия данных, для которой действительны записи кэша
+        self.version: Optional[str] = None
+
+        self.hits = 0
+        self.misses = 0
+        # Отдельные счетчики ответов для запросов без данных, чтобы не
+        # искажать долю попаданий основного кэша
+        self.negative_hits = 0
+        self.negative_misses = 0
+
+    def _embed(self, key: str) -> np.ndarray:
+        """
+        Векторизация нормализованного запроса в единичный вектор float32.
+        Эмбеддинг кэшируется: при промахе get() и последующем put() того же
+        запроса модель вызывается один раз.
+        """
+        embedding = encode_cached(self.embedding_model, key)
+        norm = np.linalg.norm(embedding)
+        if norm > 0:
+            return embedding / norm
+        return embedding.copy()
+
+    def _evict_expired(self, now: float):
+        """Удаление устаревших записей (вызывается под блокировкой)."""
+        expired = [key for key, entry in self._entries.items() if now - entry['ts'] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix_dirty = True
+
+    def _rebuild_matrix(self):
+        """Пересборка матрицы эмбеддингов (вызывается под блокировкой)."""
+        if self._entries:
+            self._matrix_keys = list(self._entries.keys())
+            self._matrix = np.vstack([self._entries[key]['embedding'] for key in self._matrix_keys])
+        else:
+            self._matrix_keys = []
+            self._matrix = None
+        self._matrix_dirty = False
+
+    def _hit(self, key: str) -> Tuple[pd.DataFrame, str]:
+        """Возврат записи с обновлением порядка LRU (вызывается под блокировкой)."""
+        self._entries.move_to_end(key)
+        entry = self._entries[key]
+        self.hits += 1
+        return pickle.loads(entry['df_pickle']), entry['response']
+
+    def get(self, user_query: str) -> Optional[Tuple[pd.DataFrame, str]]:
+        """
+        Поиск ответа для запроса в кэше.
+
+        Args:
+            user_query: Запрос пользователя
+
+        Returns:
+            Tuple[DataFrame с результатами, Ответ] или None, если совпадения нет
+        """
+        key = normalize_query(user_query)
+        now = time.time()
+
+        with self._lock:
+            self._evict_expired(now)
+            if not self._entries:
+                self.misses += 1
+                return None
+            # Быстрый путь: точное совпадение нормализованного запроса
+            if key in self._entries:
+                return self._hit(key)
+
+        query_vec = self._embed(key)
+
+        with self._lock:
+            if self._matrix_dirty:
+                self._rebuild_matrix()
+            if self._matrix is None:
+                self.misses += 1
+                return None
+
+            scores = self._matrix @ query_vec
+            best = int(np.argmax(scores))
+            best_key = self._matrix_keys[best]
+            if (
+                scores[best] >= self.tau
+                and best_key in self._entries
+                and self._entries[best_key]['constraints'] == query_constraints(key)
+            ):
+                return self._hit(best_key)
+
+            self.misses += 1
+            return None
+
+    def put(self, user_query: str, results_df: pd.DataFrame, response: str):
+        """
+        Сохранение результата запроса в кэш.
+
+        Args:
+            user_query: Запрос пользователя
+            results_df: DataFrame с результатами
+            response: Финальный ответ
+        """
+        key = normalize_query(user_query)
+        embedding = self._embed(key)
+        entry = {
+            'embedding': embedding,
+            'df_pickle': pickle.dumps(results_df, protocol=pickle.HIGHEST_PROTOCOL),
+            'response': response,
+            'constraints': query_constraints(key),
+            'ts': time.time()
+        }
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrix_dirty = True
+
+    def get_empty(self, user_query: str) -> Optional[str]:
+        """
+        Поиск ответа для запроса, по которому ранее не было найдено данных.
+
+        Args:
+            user_query: Запрос пользователя
+
+        Returns:
+            Сохраненный ответ или None
+        """
+        key = normalize_query(user_query)
+
+        with self._lock:
+            item = self._negative.get(key)
+            if item is None:
+                self.negative_misses += 1
+                return None
+            response, ts = item
+            if time.time() - ts > self.negative_ttl_seconds:
+                del self._negative[key]
+                self.negative_misses += 1
+                return None
+            self._negative.move_to_end(key)
+            self.negative_hits += 1
+            return response
+
+    def put_empty(self, user_query: str, response: str):
+        """
+        Сохранение ответа для запроса, по которому не найдено данных.
+
+        Args:
+            user_query: Запрос пользователя
+            response: Ответ об отсутствии данных
+        """
+        key = normalize_query(user_query)
+
+        with self._lock:
+            self._negative[key] = (response, time.time())
+            self._negative.move_to_end(key)
+            while len(self._negative) > self.max_size:
+                self._negative.popitem(last=False)
+
+    def set_version(self, version: str) -> bool:
+        """
+        Привязка кэша к версии данных.
+
+        Args:
+            version: Текущая версия данных
+
+        Returns:
+            True, если версия изменилась и записи были сброшены
+        """
+        with self._lock:
+            if version == self.version:
+                return False
+            previous = self.version
+            self.version = version
+            if previous is None:
+                return False
+            self.clear()
+            return True
+
+    def clear(self):
+        """Очистка кэша (например, после перезагрузки данных)."""
+        with self._lock:
+            self._entries.clear()
+            self._negative.clear()
+            self._matrix = None
+            self._matrix_keys = []
+            self._matrix_dirty = True
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика попаданий в кэш."""
+        with self._lock:
+            total = self.hits + self.misses
+            negative_total = self.negative_hits + self.negative_misses
+            return {
+                'size': len(self._entries),
+                'negative_size': len(self._negative),
+                'version': self.version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'negative_hits': self.negative_hits,
+                'negative_misses': self.negative_misses,
+                'negative_hit_rate': self.negative_hits / negative_total if negative_total else 0.0
+            }
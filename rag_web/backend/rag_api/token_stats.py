@@ -1,26 +1,30 @@
 """
 Модуль для сбора и сохранения статистики использования токенов GigaChat API.
+
+Статистика накапливается в памяти, а отчет в текстовом файле
+перезаписывается редко: фоновым потоком раз в FLUSH_INTERVAL_SECONDS секунд
+(start_periodic_flush) или явным вызовом save_stats_to_file.
 """
 
+import atexit
 import json
 import os
 from datetime import datetime
 from typing import Dict, Optional
-from collections import defaultdict
 import threading
+import time
 
-# Блокировка для потокобезопасности
+# Блокировка для добавления новых моделей и снимков статистики
 _stats_lock = threading.Lock()
 
 # Хранилище статистики в памяти
-_token_stats: Dict[str, Dict] = defaultdict(lambda: {
-    'model': '',
-    'price_per_1k': 0.0,
-    'requests_count': 0,
-    'total_tokens': 0,
-    'prompt_tokens': 0,
-    'completion_tokens': 0
-})
+_token_stats: Dict[str, Dict] = {}
+
+# Блокировки отдельных моделей: запись по разным моделям не сериализуется
+_model_locks: Dict[str, threading.Lock] = {}
+
+# Момент последней записи файла (time.monotonic) для save_stats_to_file(min_interval)
+_last_flush = 0.0
 
 # Цены за 1K токенов для разных моделей (в рублях)
 MODEL_PRICES = {
@@ -37,6 +41,13 @@ STATS_FILE_PATH = os.path.join(
     'gigachat_token_stats.txt'
 )
 
+# Интервал фонового сохранения отчета (в секундах)
+FLUSH_INTERVAL_SECONDS = 60
+
+# Фоновый поток сохранения отчета
+_flush_stop = threading.Event()
+_flush_thread: Optional[threading.Thread] = None
+
 
 def record_token_usage(
     model: str,
@@ -53,22 +64,25 @@ def record_token_usage(
         completion_tokens: Количество выходных токенов
         total_tokens: Общее количество токенов (если не указано, вычисляется)
     """
-    with _stats_lock:
-        model_key = model
-        
-        if model_key not in _token_stats:
-            _token_stats[model_key] = {
-                'model': model,
-                'price_per_1k': MODEL_PRICES.get(model, MODEL_PRICES['GigaChat']),
-                'requests_count': 0,
-                'total_tokens': 0,
-                'prompt_tokens': 0,
-                'completion_tokens': 0
-            }
-        
+    model_key = model
+    price = MODEL_PRICES.get(model, MODEL_PRICES['GigaChat'])
+    model_lock = _model_locks.get(model_key)
+    
+    if model_lock is None:
+        with _stats_lock:
+            if model_key not in _token_stats:
+                _token_stats[model_key] = {
+                    'model': model,
+                    'price_per_1k': price,
+                    'requests_count': 0,
+                    'total_tokens': 0,
+                    'prompt_tokens': 0,
+                    'completion_tokens': 0
+                }
+            model_lock = _model_locks.setdefault(model_key, threading.Lock())
+    
+    with model_lock:
         stats = _token_stats[model_key]
-        stats['model'] = model
-        stats['price_per_1k'] = MODEL_PRICES.get(model, MODEL_PRICES['GigaChat'])
         stats['requests_count'] += 1
         stats['prompt_tokens'] += prompt_tokens
         stats['completion_tokens'] += completion_tokens
@@ -119,91 +133,189 @@ def format_number(num: int) -> str:
     return f"{num:,}".replace(',', ' ')
 
 
-def save_stats_to_file():
-    """Сохранение статистики в текстовый файл."""
+def _snapshot_stats() -> Dict[str, Dict]:
+    """Согласованная копия статистики по моделям, к которым были запросы после сброса."""
     with _stats_lock:
-        if not _token_stats:
-            # Если статистики нет, создаем пустой файл
-            with open(STATS_FILE_PATH, 'w', encoding='utf-8') as f:
-                f.write("📈 Статистика использования токенов GigaChat API\n")
-                f.write(f"Обновлено: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write("=" * 53 + "\n\n")
-                f.write("Статистика пока отсутствует.\n")
-            return
+        items = [(key, _model_locks[key]) for key in _token_stats]
+        snapshot = {}
+        for model_key, model_lock in items:
+            with model_lock:
+                stats = _token_stats[model_key]
+                if stats['requests_count'] > 0:
+                    snapshot[model_key] = dict(stats)
+    return snapshot
+
+
+def _header() -> str:
+    """Заголовок файла статистики."""
+    return (
+        "📈 Статистика использования токенов GigaChat API\n"
+        f"Обновлено: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+        + "=" * 53 + "\n\n"
+    )
+
+
+def _write_stats_file(text: str):
+    """Запись подготовленного текста в файл статистики одним вызовом."""
+    with open(STATS_FILE_PATH, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def save_stats_to_file(min_interval: float = 0.0) -> bool:
+    """
+    Сохранение статистики в текстовый файл.
+    
+    Args:
+        min_interval: Минимальный интервал между записями в секундах.
+            Если с предыдущей записи прошло меньше, файл не перезаписывается
+    
+    Returns:
+        True, если файл был записан
+    """
+    global _last_flush
+    
+    now = time.monotonic()
+    if min_interval > 0 and now - _last_flush < min_interval:
+        return False
+    _last_flush = now
+    
+    # Форматирование и запись в файл выполняются вне блокировок,
+    # чтобы не задерживать запись статистики из других потоков
+    token_stats = _snapshot_stats()
+    
+    if not token_stats:
+        # Если статистики нет, создаем пустой файл
+        _write_stats_file(_header() + "Статистика пока отсутствует.\n")
+        return True
+    
+    # Текст файла собирается целиком в памяти и записывается одним вызовом
+    parts = [_header()]
+    total_requests = 0
+    total_tokens_all = 0
+    total_cost_all = 0.0
+    
+    # Статистика по каждой модели (сортировка по названию)
+    for model_key, stats in sorted(token_stats.items()):
+        model_name = stats['model']
+        price = stats['price_per_1k']
+        requests = stats['requests_count']
+        total_tokens = stats['total_tokens']
+        prompt_tokens = stats['prompt_tokens']
+        completion_tokens = stats['completion_tokens']
         
-        # Сортируем модели по названию
-        sorted_models = sorted(_token_stats.items())
+        total_cost = (total_tokens / 1000) * price
+        total_requests += requests
+        total_tokens_all += total_tokens
+        total_cost_all += total_cost
         
-        # Вычисляем общую статистику
-        total_requests = sum(stats['requests_count'] for stats in _token_stats.values())
-        total_tokens_all = sum(stats['total_tokens'] for stats in _token_stats.values())
-        total_cost_all = sum(
-            (stats['total_tokens'] / 1000) * stats['price_per_1k']
-            for stats in _token_stats.values()
-        )
+        if requests > 0:
+            avg_tokens = total_tokens / requests
+            avg_prompt = prompt_tokens / requests
+            avg_completion = completion_tokens / requests
+            avg_cost = total_cost / requests
+        else:
+            avg_tokens = avg_prompt = avg_completion = avg_cost = 0
         
-        with open(STATS_FILE_PATH, 'w', encoding='utf-8') as f:
-            f.write("📈 Статистика использования токенов GigaChat API\n")
-            f.write(f"Обновлено: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write("=" * 53 + "\n\n")
-            
-            # Статистика по каждой модели
-            for model_key, stats in sorted_models:
-                model_name = stats['model']
-                price = stats['price_per_1k']
-                requests = stats['requests_count']
-                total_tokens = stats['total_tokens']
-                prompt_tokens = stats['prompt_tokens']
-                completion_tokens = stats['completion_tokens']
-                
-                avg_tokens = total_tokens / requests if requests > 0 else 0
-                avg_prompt = prompt_tokens / requests if requests > 0 else 0
-                avg_completion = completion_tokens / requests if requests > 0 else 0
-                
-                total_cost = (total_tokens / 1000) * price
-                avg_cost = total_cost / requests if requests > 0 else 0
-                
-                f.write(f"🤖 Модель: {model_name}\n")
-                f.write(f"   Цена за 1K токенов: {price:.2f} ₽\n")
-                f.write(f"   Количество запросов: {requests}\n")
-                f.write(f"   Всего токенов: {format_number(total_tokens)}\n")
-                f.write(f"     - Входных (prompt): {format_number(prompt_tokens)}\n")
-                f.write(f"     - Выходных (completion): {format_number(completion_tokens)}\n")
-                f.write(f"   Среднее токенов на запрос: {avg_tokens:.1f}\n")
-                f.write(f"     - Входных: {avg_prompt:.1f}\n")
-                f.write(f"     - Выходных: {avg_completion:.1f}\n")
-                f.write(f"   💰 Общая стоимость: {total_cost:.4f} ₽\n")
-                f.write(f"   💰 Средняя стоимость запроса: {avg_cost:.4f} ₽\n")
-                f.write("\n")
-            
-            # Общая статистика
-            f.write("=" * 53 + "\n")
-            f.write("📊 ОБЩАЯ СТАТИСТИКА\n")
-            f.write("=" * 53 + "\n")
-            f.write(f"Всего запросов: {total_requests}\n")
-            f.write(f"Всего токенов: {format_number(total_tokens_all)}\n")
-            f.write(f"💰 Общая стоимость всех тестов: {total_cost_all:.4f} ₽\n")
-            f.write("=" * 53 + "\n")
+        parts.append(
+            f"🤖 Модель: {model_name}\n"
+            f"   Цена за 1K токенов: {price:.2f} ₽\n"
+            f"   Количество запросов: {requests}\n"
+            f"   Всего токенов: {format_number(total_tokens)}\n"
+            f"     - Входных (prompt): {format_number(prompt_tokens)}\n"
+            f"     - Выходных (completion): {format_number(completion_tokens)}\n"
+            f"   Среднее токенов на запрос: {avg_tokens:.1f}\n"
+            f"     - Входных: {avg_prompt:.1f}\n"
+            f"     - Выходных: {avg_completion:.1f}\n"
+            f"   💰 Общая стоимость: {total_cost:.4f} ₽\n"
+            f"   💰 Средняя стоимость запроса: {avg_cost:.4f} ₽\n"
+            "\n"
+        )
+    
+    # Общая статистика
+    separator = "=" * 53 + "\n"
+    parts.append(
+        separator
+        + "📊 ОБЩАЯ СТАТИСТИКА\n"
+        + separator
+        + f"Всего запросов: {total_requests}\n"
+        f"Всего токенов: {format_number(total_tokens_all)}\n"
+        f"💰 Общая стоимость всех тестов: {total_cost_all:.4f} ₽\n"
+        + separator
+    )
+    
+    _write_stats_file(''.join(parts))
+    return True
+
+
+def _flush_loop(interval: float):
+    """Цикл фонового сохранения отчета."""
+    while not _flush_stop.wait(interval):
+        try:
+            save_stats_to_file()
+        except OSError:
+            pass
+
+
+def start_periodic_flush(interval: float = FLUSH_INTERVAL_SECONDS):
+    """
+    Запуск фонового сохранения отчета раз в interval секунд.
+    Повторный вызов при работающем потоке ничего не делает.
+    
+    Args:
+        interval: Интервал сохранения в секундах
+    """
+    global _flush_thread
+    
+    with _stats_lock:
+        if _flush_thread is not None and _flush_thread.is_alive():
+            return
+        first_start = _flush_thread is None
+        _flush_stop.clear()
+        _flush_thread = threading.Thread(
+            target=_flush_loop,
+            args=(interval,),
+            name='token-stats-flush',
+            daemon=True
+        )
+        _flush_thread.start()
+    
+    if first_start:
+        atexit.register(stop_periodic_flush)
+
+
+def stop_periodic_flush():
+    """Остановка фонового сохранения с финальной записью отчета."""
+    _flush_stop.set()
+    try:
+        save_stats_to_file()
+    except OSError:
+        pass
 
 
 def get_stats() -> Dict[str, Dict]:
     """Получение текущей статистики."""
-    with _stats_lock:
-        return dict(_token_stats)
+    return _snapshot_stats()
 
 
 def reset_stats():
-    """Сброс статистики."""
+    """
+    Сброс статистики.
+    
+    Счетчики обнуляются на месте под блокировкой модели: словари и блокировки
+    моделей не заменяются, поэтому запись, начатая до сброса, не гонится
+    с записью, начатой после него.
+    """
     with _stats_lock:
-        _token_stats.clear()
+        for model_key, model_lock in _model_locks.items():
+            with model_lock:
+                stats = _token_stats[model_key]
+                stats['requests_count'] = 0
+                stats['total_tokens'] = 0
+                stats['prompt_tokens'] = 0
+                stats['completion_tokens'] = 0
 
 
 def clear_stats_file():
     """Очистка файла статистики и сброс в памяти."""
     reset_stats()
-    with open(STATS_FILE_PATH, 'w', encoding='utf-8') as f:
-        f.write("📈 Статистика использования токенов GigaChat API\n")
-        f.write(f"Обновлено: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write("=" * 53 + "\n\n")
-        f.write("Статистика обнулена.\n")
-
+    _write_stats_file(_header() + "Статистика обнулена.\n")
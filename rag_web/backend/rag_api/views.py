@@ -2,11 +2,19 @@
 Django API views для RAG системы.
 """
 
+import hashlib
 import logging
-import json
-import requests
+import re
+import msgpack
+import numpy as np
+import orjson
+import urllib3
+from urllib3.util.retry import Retry
 import pandas as pd
-from django.http import JsonResponse, StreamingHttpResponse
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils.decorators import method_decorator
@@ -15,7 +23,10 @@ import sys
 import os
 import threading
 import queue
-import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from typing import Optional
 
 # Добавляем путь к корневому каталогу проекта
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
@@ -24,71 +35,471 @@ sys.path.insert(0, BASE_DIR)
 try:
     from test_final_v2 import RAGSystemLangChain
     from gigachat import GigaChat
-    from .token_stats import record_from_response, save_stats_to_file
+    from gigachat.exceptions import AuthenticationError
+    from .token_stats import record_from_response, start_periodic_flush
+    from .semantic_cache import normalize_query
 except ImportError as e:
     logging.error(f"Ошибка импорта: {e}")
     logging.error(f"BASE_DIR: {BASE_DIR}")
     logging.error(f"sys.path: {sys.path}")
     raise
 
-logging.basicConfig(level=logging.INFO)
+# Обработчики и уровень логов задаются в settings.LOGGING, а не при импорте модуля.
+# Полные трассировки стека на путях ошибок пишутся только при уровне DEBUG
 logger = logging.getLogger(__name__)
 
-# Учетные данные GigaChat
-GIGACHAT_CREDENTIALS = "MDE5OWUyNTAtNGNhZS03ZDdjLTg2ZmMtZjM5NDE0ZGFhNjUzOmYzMTk3ZWUyLTBlNTYtNDUzNy04ZWViLTUyZWU4ZjAyZGMzZA=="
+# Учетные данные и адреса внешних сервисов читаются из окружения один раз при импорте
+# (переменные из .env загружаются в settings до импорта views)
+GIGACHAT_CREDENTIALS = os.environ.get('GIGACHAT_CREDENTIALS', '')
+if not GIGACHAT_CREDENTIALS:
+    logger.warning("GIGACHAT_CREDENTIALS не задан в переменных окружения")
+
+HEYGEN_API_KEY = os.environ.get('HEYGEN_API_KEY', '')
+# Используем v1 API endpoint для статуса (как в heygen_test)
+HEYGEN_STATUS_URL = os.environ.get('HEYGEN_STATUS_URL', 'https://api.heygen.com/v1/video_status.get')
+HEYGEN_AVATAR_ID = os.environ.get('HEYGEN_AVATAR_ID')
+
+# Строка, похожая на координаты: короткая, с запятой и цифрами
+_DIGIT_RE = re.compile(r'\d')
+
+# Строка с координатами (пропускается в fallback подготовке текста для видео)
+_COORD_LINE_RE = re.compile(r'📍|координат|lon:|lat:|долгота|широта', re.IGNORECASE)
+
+# Упоминание карты или координат в тексте для видео
+_MAP_MENTION_RE = re.compile(r'карт|координат', re.IGNORECASE)
+
+# Фразы, которые указывают на отсутствие данных в ответе
+NO_DATA_PHRASES = (
+    'не найдено',
+    'не найдены',
+    'данных нет',
+    'данные не найдены',
+    'результатов не найдено',
+    'ничего не найдено',
+    'к сожалению, по вашему запросу не найдено',
+    'не удалось найти',
+    'не обнаружено',
+    'отсутствуют данные',
+    'нет данных',
+    'релевантных признаков в базе',
+    'ошибка'
+)
+
+# Для ответа "есть/нет совпадения" фраза, содержащая другую фразу списка
+# ("ничего не найдено" -> "не найдено"), избыточна: в автомат попадают только минимальные
+_NO_DATA_PATTERNS = tuple(
+    phrase for phrase in NO_DATA_PHRASES
+    if not any(other != phrase and other in phrase for other in NO_DATA_PHRASES)
+)
+
+# Одно выражение вместо проверки каждой фразы отдельно (длинные фразы первыми)
+_NO_DATA_RE = re.compile(
+    '|'.join(re.escape(phrase) for phrase in sorted(_NO_DATA_PATTERNS, key=len, reverse=True)),
+    re.IGNORECASE
+)
+
+# Ответы без данных короткие, и фраза об этом стоит в первом предложении:
+# длинные ответы проверяются только по началу, без копирования всего текста
+NO_DATA_SCAN_HEAD = 512
+NO_DATA_FULL_SCAN_MAX = 4096
+
+# Hyperscan (если установлен) компилирует все фразы в один DFA с SIMD сканированием.
+# Фразы и текст приводятся к нижнему регистру заранее: регистронезависимый режим
+# Hyperscan не покрывает кириллицу
+try:
+    import hyperscan
+    _NO_DATA_HS_DB = hyperscan.Database()
+    _NO_DATA_HS_DB.compile(
+        expressions=[re.escape(phrase).encode('utf-8') for phrase in _NO_DATA_PATTERNS],
+        ids=list(range(len(_NO_DATA_PATTERNS))),
+        flags=[hyperscan.HS_FLAG_SINGLEMATCH | hyperscan.HS_FLAG_UTF8] * len(_NO_DATA_PATTERNS)
+    )
+    HYPERSCAN_AVAILABLE = True
+except Exception:
+    # Нет модуля или платформа без поддержки SIMD - используется регулярное выражение
+    HYPERSCAN_AVAILABLE = False
+
+# Scratch-память Hyperscan нельзя делить между потоками
+_hs_local = threading.local()
+
+# Общий пул соединений urllib3 для HeyGen API: keep-alive соединения переиспользуются
+# между запросами статуса и получения токена (без нового TLS рукопожатия и без
+# накладных расходов requests на подготовку запроса, cookies и hooks).
+# Заголовки с ключом API задаются пулу один раз, а не передаются в каждый вызов
+_HEYGEN_POOL = urllib3.PoolManager(
+    num_pools=4,
+    maxsize=64,
+    headers={"X-Api-Key": HEYGEN_API_KEY, "Content-Type": "application/json"},
+    retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504], raise_on_status=False)
+)
+
+# Ограничение HeyGen API на длину текста для аватара (обычно ~2000-2500 символов)
+MAX_TEXT_LENGTH = 2000
+
+# Обрезка по концу предложения, только если он в последних 30% текста
+_MIN_SENTENCE_CUTOFF = MAX_TEXT_LENGTH * 0.7
+
+# Конец предложения: точка, восклицательный или вопросительный знак перед пробелом/переводом строки
+_SENTENCE_END_RE = re.compile(r'[.!?][ \n]')
+
+# Таймауты запроса статуса видео HeyGen (подключение, чтение) в секундах:
+# опрос выполняется часто, поэтому зависший запрос не должен держать поток долго
+_HEYGEN_STATUS_TIMEOUT = urllib3.Timeout(connect=5, read=10)
+
+# Таймауты получения streaming токена HeyGen: отдельный таймаут подключения,
+# чтобы недоступный API не держал поток gunicorn все время чтения
+_HEYGEN_TOKEN_TIMEOUT = urllib3.Timeout(connect=5, read=20)
+
+# Параллельные SQL запросы (генерация через GigaChat + DuckDB) для одного запроса
+SQL_WORKERS = 4
+
+# Пул для подготовки текста видео-аватара в фоне (вызовы GigaChat)
+_GIGA_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix='video-text')
+
+# Подготовленные (или готовящиеся) тексты для видео по ключу ответа
+_VIDEO_TEXT_FUTURES_MAX = 256
+_video_text_futures: "OrderedDict[str, Future]" = OrderedDict()
+_video_text_lock = threading.Lock()
+
+# Модель GigaChat для подготовки текста видео-аватара
+VIDEO_TEXT_MODEL = 'GigaChat:light'
+
+# Долгоживущий клиент GigaChat: OAuth токен и HTTPS соединение переиспользуются
+# между запросами (создается при первом обращении)
+_GIGA_CLIENT = None
+_giga_lock = threading.Lock()
 
 # Глобальный экземпляр RAG системы (инициализируется при первом запросе)
 _rag_system = None
+_rag_lock = threading.Lock()
+
+# Глобальное хранилище прогресса для каждого запроса: ограничено по размеру,
+# записи (в том числе брошенных клиентом запросов) удаляются через PROGRESS_TTL_SECONDS.
+# TTLCache не потокобезопасен, все обращения выполняются под _progress_lock
+PROGRESS_MAX_ENTRIES = 10_000
+PROGRESS_TTL_SECONDS = 600
+_progress_storage = TTLCache(maxsize=PROGRESS_MAX_ENTRIES, ttl=PROGRESS_TTL_SECONDS)
+_progress_lock = threading.RLock()
+_FINISHED_STATUSES = frozenset(('completed', 'error'))
 
-# Глобальное хранилище прогресса для каждого запроса
-_progress_storage = {}
+# Выполняющиеся запросы по ключу кэша: одинаковый запрос, пришедший до завершения
+# первого, получает свой request_id с тем же словарем прогресса, а не запускает
+# второй конвейер. Доступ под _progress_lock
+_inflight_queries = {}
+
+# Размер очереди событий SSE и время ожидания места в ней: при медленном
+# клиенте конвейер ждет, а при отключившемся клиенте события отбрасываются
+SSE_QUEUE_MAXSIZE = 64
+_SSE_PUT_TIMEOUT = 1.0
+
+# Признак окончания конвейера в очереди SSE и интервал keep-alive комментариев,
+# пока конвейер работает без новых событий
+_SSE_DONE = object()
+_SSE_DONE_PUT_TIMEOUT = 10.0
+SSE_KEEPALIVE_SECONDS = 15.0
 
 
 def get_rag_system():
     """Получение или создание экземпляра RAG системы."""
     global _rag_system
+    # Двойная проверка: экземпляр создается один раз даже при одновременных первых запросах
     if _rag_system is None:
-        logger.info("Инициализация RAG системы...")
-        
-        # Получаем настройки OpenSearch из переменных окружения
-        opensearch_host = os.environ.get('OPENSEARCH_HOST', 'localhost')
-        opensearch_port = int(os.environ.get('OPENSEARCH_PORT', 9200))
-        opensearch_use_ssl = os.environ.get('OPENSEARCH_USE_SSL', 'False').lower() == 'true'
-        opensearch_verify_certs = os.environ.get('OPENSEARCH_VERIFY_CERTS', 'False').lower() == 'true'
-        
-        # Настройка аутентификации (если указана)
-        opensearch_auth = None
-        opensearch_username = os.environ.get('OPENSEARCH_AUTH_USERNAME')
-        opensearch_password = os.environ.get('OPENSEARCH_AUTH_PASSWORD')
-        if opensearch_username and opensearch_password:
-            opensearch_auth = (opensearch_username, opensearch_password)
-        
-        logger.info(f"Подключение к OpenSearch: {opensearch_host}:{opensearch_port} (SSL: {opensearch_use_ssl})")
-        
-        _rag_system = RAGSystemLangChain(
-            opensearch_host=opensearch_host,
-            opensearch_port=opensearch_port,
-            opensearch_use_ssl=opensearch_use_ssl,
-            opensearch_verify_certs=opensearch_verify_certs,
-            opensearch_auth=opensearch_auth,
-            opensearch_index_descriptions="feature_descriptions",
-            opensearch_index_layers="rag_layers",
-            credentials=GIGACHAT_CREDENTIALS
-        )
-        logger.info("RAG система инициализирована")
+        with _rag_lock:
+            if _rag_system is not None:
+                return _rag_system
+            
+            logger.info("Инициализация RAG системы...")
+            
+            # Получаем настройки OpenSearch из переменных окружения
+            opensearch_host = os.environ.get('OPENSEARCH_HOST', 'localhost')
+            opensearch_port = int(os.environ.get('OPENSEARCH_PORT', 9200))
+            opensearch_use_ssl = os.environ.get('OPENSEARCH_USE_SSL', 'False').lower() == 'true'
+            opensearch_verify_certs = os.environ.get('OPENSEARCH_VERIFY_CERTS', 'False').lower() == 'true'
+            
+            # Настройка аутентификации (если указана)
+            opensearch_auth = None
+            opensearch_username = os.environ.get('OPENSEARCH_AUTH_USERNAME')
+            opensearch_password = os.environ.get('OPENSEARCH_AUTH_PASSWORD')
+            if opensearch_username and opensearch_password:
+                opensearch_auth = (opensearch_username, opensearch_password)
+            
+            logger.info(f"Подключение к OpenSearch: {opensearch_host}:{opensearch_port} (SSL: {opensearch_use_ssl})")
+            
+            # Семантический кэш ответов можно отключить переменной окружения
+            use_semantic_cache = os.environ.get('RAG_SEMANTIC_CACHE', 'True').lower() == 'true'
+            semantic_cache_ttl = float(os.environ.get('RAG_SEMANTIC_CACHE_TTL', 3600))
+            
+            _rag_system = RAGSystemLangChain(
+                opensearch_host=opensearch_host,
+                opensearch_port=opensearch_port,
+                opensearch_use_ssl=opensearch_use_ssl,
+                opensearch_verify_certs=opensearch_verify_certs,
+                opensearch_auth=opensearch_auth,
+                opensearch_index_descriptions="feature_descriptions",
+                opensearch_index_layers="rag_layers",
+                credentials=GIGACHAT_CREDENTIALS,
+                use_semantic_cache=use_semantic_cache,
+                semantic_cache_ttl=semantic_cache_ttl
+            )
+            logger.info("RAG система инициализирована")
+            
+            # Отчет о токенах сохраняется фоновым потоком, а не после каждого запроса
+            start_periodic_flush()
     return _rag_system
 
 
+def warm_up_rag_system():
+    """
+    Инициализация RAG системы в фоновом потоке при старте сервера,
+    чтобы первый запрос пользователя не ждал загрузки модели и данных.
+    """
+    def _warm_up():
+        try:
+            get_rag_system()
+        except Exception as e:
+            logger.error("Ошибка предварительной инициализации RAG системы: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+    
+    threading.Thread(target=_warm_up, name='rag-warm-up', daemon=True).start()
+
+
+def _create_giga_client() -> GigaChat:
+    """Создание клиента GigaChat для подготовки текста видео."""
+    return GigaChat(
+        credentials=GIGACHAT_CREDENTIALS,
+        verify_ssl_certs=False,
+        scope='GIGACHAT_API_B2B',
+        model=VIDEO_TEXT_MODEL
+    )
+
+
+def _giga_chat(prompt):
+    """
+    Запрос к GigaChat через общий клиент модуля.
+    При ошибке авторизации (истекший токен) клиент пересоздается один раз.
+    
+    Args:
+        prompt: Текст запроса или словарь с сообщениями
+        
+    Returns:
+        Ответ GigaChat
+    """
+    global _GIGA_CLIENT
+    giga = _GIGA_CLIENT
+    if giga is None:
+        with _giga_lock:
+            if _GIGA_CLIENT is None:
+                _GIGA_CLIENT = _create_giga_client()
+            giga = _GIGA_CLIENT
+    try:
+        return giga.chat(prompt)
+    except AuthenticationError:
+        logger.warning("Ошибка авторизации GigaChat, пересоздаем клиент")
+        with _giga_lock:
+            # Другой поток мог уже пересоздать клиент
+            if _GIGA_CLIENT is giga:
+                _GIGA_CLIENT = _create_giga_client()
+            giga = _GIGA_CLIENT
+        return giga.chat(prompt)
+
+
+def _dumps(data) -> str:
+    """Сериализация в JSON строку через orjson (numpy типы поддерживаются)."""
+    return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+
+
+def orjson_response(data, status: int = 200) -> HttpResponse:
+    """
+    JSON ответ, сериализованный через orjson (замена JsonResponse).
+    
+    Args:
+        data: Данные ответа
+        status: HTTP статус
+        
+    Returns:
+        HttpResponse с content-type application/json
+    """
+    return HttpResponse(
+        orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY),
+        status=status,
+        content_type='application/json'
+    )
+
+
+def static_response(body: bytes, status: int = 200) -> HttpResponse:
+    """
+    Ответ с заранее сериализованным JSON телом (для неизменяемых ответов).
+    
+    Args:
+        body: JSON в bytes
+        status: HTTP статус
+        
+    Returns:
+        HttpResponse с content-type application/json
+    """
+    return HttpResponse(body, status=status, content_type='application/json')
+
+
+# Максимальный размер тела запроса к QueryView (проверяется до разбора JSON)
+MAX_QUERY_BODY_BYTES = 64_000
+
+# Неизменяемые ответы сериализуются один раз при импорте
+_EMPTY_QUERY_BODY = orjson.dumps({'error': 'Запрос не может быть пустым'})
+_REQUEST_ID_REQUIRED_BODY = orjson.dumps({'error': 'request_id обязателен'})
+_REQUEST_NOT_FOUND_BODY = orjson.dumps({'error': 'Запрос не найден'})
+_EMPTY_ANSWER_BODY = orjson.dumps({'error': 'Ответ не может быть пустым'})
+_SKIP_VIDEO_BODY = orjson.dumps({
+    'error': 'Видео не генерируется, так как данные не найдены',
+    'skip_video': True
+})
+_INVALID_JSON_BODY = orjson.dumps({'error': 'Неверный формат JSON'})
+_QUERY_TOO_LARGE_BODY = orjson.dumps({'error': 'Слишком большой запрос'})
+_VIDEO_ID_REQUIRED_BODY = orjson.dumps({"error": "video_id обязателен"})
+_HEYGEN_STATUS_NO_KEY_BODY = orjson.dumps({"error": "HEYGEN_API_KEY не задан. Установите переменную окружения."})
+_HEYGEN_TOKEN_NO_KEY_BODY = orjson.dumps({"error": "HEYGEN_API_KEY не задан"})
+
+
+# Списки длиннее порога отдаются в потоковом ответе пачками
+STREAM_LIST_THRESHOLD = 500
+_STREAM_BATCH_SIZE = 200
+
+
+def _iter_json(data):
+    """
+    Потоковая сериализация в JSON: словари обходятся по ключам, длинные
+    списки (координаты) отдаются пачками, остальное - целиком через orjson.
+    
+    Args:
+        data: Данные ответа
+        
+    Yields:
+        Фрагменты JSON в bytes
+    """
+    if isinstance(data, dict):
+        yield b'{'
+        for i, (key, value) in enumerate(data.items()):
+            yield (b',' if i else b'') + orjson.dumps(str(key)) + b':'
+            yield from _iter_json(value)
+        yield b'}'
+    elif isinstance(data, list) and len(data) > STREAM_LIST_THRESHOLD:
+        yield b'['
+        for start in range(0, len(data), _STREAM_BATCH_SIZE):
+            batch = orjson.dumps(data[start:start + _STREAM_BATCH_SIZE], option=orjson.OPT_SERIALIZE_NUMPY)
+            # Снимаем скобки пачки и склеиваем элементы через запятую
+            yield (b',' if start else b'') + batch[1:-1]
+        yield b']'
+    else:
+        yield orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def streaming_orjson_response(data, status: int = 200) -> StreamingHttpResponse:
+    """
+    Потоковый JSON ответ: клиент начинает получать данные до окончания сериализации.
+    
+    Args:
+        data: Данные ответа
+        status: HTTP статус
+        
+    Returns:
+        StreamingHttpResponse с content-type application/json
+    """
+    return StreamingHttpResponse(
+        _iter_json(data),
+        status=status,
+        content_type='application/json'
+    )
+
+
+def _pack_coordinates(coordinates) -> dict:
+    """
+    Упаковка координат для msgpack: lon/lat подряд как float64 (little-endian),
+    подписи точек отдельным списком.
+    
+    Args:
+        coordinates: Список словарей с ключами lon, lat, info
+        
+    Returns:
+        Словарь с ключами coordinates_bin, coordinates_info, n_coords
+    """
+    lon_lat = np.fromiter(
+        (value for coord in coordinates for value in (coord['lon'], coord['lat'])),
+        dtype='<f8',
+        count=2 * len(coordinates)
+    )
+    return {
+        'coordinates_bin': lon_lat.tobytes(),
+        'coordinates_info': [coord['info'] for coord in coordinates],
+        'n_coords': len(coordinates)
+    }
+
+
+def _msgpack_default(obj):
+    """Приведение numpy скаляров к типам Python для msgpack."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Тип {type(obj).__name__} не поддерживается msgpack")
+
+
+def msgpack_response(data, status: int = 200) -> HttpResponse:
+    """
+    Ответ в формате msgpack (по заголовку Accept: application/msgpack).
+    Координаты результата передаются бинарным массивом float64 вместо JSON чисел.
+    
+    Args:
+        data: Данные ответа
+        status: HTTP статус
+        
+    Returns:
+        HttpResponse с content-type application/msgpack
+    """
+    result = data.get('result')
+    if result and 'coordinates' in result:
+        packed_result = {key: value for key, value in result.items() if key != 'coordinates'}
+        packed_result.update(_pack_coordinates(result['coordinates']))
+        data = {**data, 'result': packed_result}
+    return HttpResponse(
+        msgpack.packb(data, use_bin_type=True, default=_msgpack_default),
+        status=status,
+        content_type='application/msgpack'
+    )
+
+
+def _accepts_msgpack(request) -> bool:
+    """Клиент запросил ответ в формате msgpack."""
+    return 'application/msgpack' in request.headers.get('Accept', '')
+
+
+def _query_cache_key(user_query: str, top_k: int, index_version: Optional[str]) -> str:
+    """
+    Ключ кэша ответа на запрос пользователя. Версия индексов OpenSearch входит
+    в ключ, поэтому после переимпорта данных старые ответы не возвращаются.
+    """
+    digest = hashlib.blake2b(normalize_query(user_query).encode('utf-8'), digest_size=16).hexdigest()
+    version = hashlib.blake2b((index_version or '').encode('utf-8'), digest_size=8).hexdigest()
+    return f"ragq:{digest}:{top_k}:{version}"
 
 
 def _send_progress_event(progress_storage, step, progress, message, details=None):
-    """Обновление прогресса в хранилище."""
-    if progress_storage:
-        progress_storage['step'] = step
-        progress_storage['progress'] = progress
-        progress_storage['message'] = message
-        progress_storage['details'] = details or {}
-        logger.info(f"Обновление прогресса: step={step}, progress={progress}%, message={message[:50] if message else ''}")
+    """
+    Обновление прогресса: запись прогресса запроса в хранилище или
+    событие в очередь SSE.
+    """
+    if progress_storage is None:
+        return
+    event = {
+        'step': step,
+        'progress': progress,
+        'message': message,
+        'details': details or {}
+    }
+    if isinstance(progress_storage, queue.Queue):
+        try:
+            progress_storage.put(event, timeout=_SSE_PUT_TIMEOUT)
+        except queue.Full:
+            logger.warning("Очередь событий SSE переполнена, событие прогресса пропущено")
+    else:
+        with _progress_lock:
+            progress_storage.update(event)
+    logger.info(f"Обновление прогресса: step={step}, progress={progress}%, message={message[:50] if message else ''}")
 
 
 def _rag_query_with_progress(rag_system, user_query, progress_storage, top_k=20):
@@ -101,8 +512,20 @@ def _rag_query_with_progress(rag_system, user_query, progress_storage, top_k=20)
     3. Проверка признаков (40-60%)
     4. Генерация и выполнение SQL запросов (60-85%)
     5. Генерация финального ответа (85-100%)
+    
+    Похожий запрос, на который уже был дан ответ, возвращается из
+    семантического кэша RAG системы без выполнения шагов.
     """
+    semantic_cache = rag_system.semantic_cache
     try:
+        if semantic_cache is not None:
+            # Записи, полученные до изменения индексов OpenSearch, сбрасываются
+            rag_system.check_index_version()
+            cached = semantic_cache.get(user_query)
+            if cached is not None:
+                _send_progress_event(progress_storage, 5, 100, "Ответ найден в кэше", {'cached': True})
+                return cached
+        
         # Шаг 1: Генерация описания признака/запроса (0-20%)
         _send_progress_event(progress_storage, 1, 5, "ШАГ 1: Генерация описания признака/запроса...")
         feature_description = rag_system.generate_feature_description(user_query)
@@ -117,42 +540,16 @@ def _rag_query_with_progress(rag_system, user_query, progress_storage, top_k=20)
             return pd.DataFrame(), "К сожалению, по вашему запросу не найдено релевантных признаков в базе."
         
         _send_progress_event(progress_storage, 2, 40, f"Найдено {len(search_results)} результатов в OpenSearch", {'found': len(search_results)})
+        search_results = rag_system.filter_by_score(search_results)
         
         # Шаг 3: Проверка признаков (40-60%)
         _send_progress_event(progress_storage, 3, 45, f"ШАГ 3: Проверка {len(search_results)} признаков...")
-        matched_features = []
-        
-        for idx, doc in enumerate(search_results):
-            feature_name = doc.metadata.get('feature_name', '')
-            if not feature_name:
-                feature_name = doc.metadata.get('name', '')
-            if not feature_name:
-                text = doc.page_content or ""
-                parts = text.split('\n')
-                for part in parts[:3]:
-                    part = part.strip()
-                    if part and len(part) < 100:
-                        feature_name = part
-                        break
-            
-            feature_desc = doc.page_content if doc.page_content else ""
-            if not feature_desc:
-                feature_desc = doc.metadata.get('description', '')
-            feature_desc = feature_desc[:1000] if feature_desc else ""
-            
-            if not feature_name:
-                continue
-            
-            # Прогресс проверки каждого признака
-            check_progress = 45 + int((idx + 1) / len(search_results) * 15)
-            _send_progress_event(progress_storage, 3, check_progress, f"Проверка признака {idx + 1}/{len(search_results)}: {feature_name[:30]}...")
-            
-            if rag_system.check_feature_match(user_query, feature_name, feature_desc):
-                matched_features.append({
-                    'feature_name': feature_name,
-                    'description': feature_desc,
-                    'doc': doc
-                })
+        # Признаки проверяются параллельно, прогресс обновляется по мере завершения проверок
+        def on_feature_checked(checked, total, feature_name):
+            check_progress = 45 + int(checked / total * 15)
+            _send_progress_event(progress_storage, 3, check_progress, f"Проверен признак {checked}/{total}: {feature_name[:30]}...")
+        
+        matched_features = rag_system.match_features(user_query, search_results, on_checked=on_feature_checked)
         
         if not matched_features:
             _send_progress_event(progress_storage, 3, 60, "Не найдено признаков, соответствующих запросу")
@@ -162,28 +559,42 @@ def _rag_query_with_progress(rag_system, user_query, progress_storage, top_k=20)
         
         # Шаг 4: Генерация и выполнение SQL запросов (60-85%)
         _send_progress_event(progress_storage, 4, 65, "ШАГ 4: Генерация и выполнение SQL запросов...")
-        all_results = []
-        
-        for idx, feature_info in enumerate(matched_features):
-            feature_name = feature_info['feature_name']
-            feature_desc = feature_info['description']
-            
-            sql_progress = 65 + int((idx + 1) / len(matched_features) * 20)
-            _send_progress_event(progress_storage, 4, sql_progress, f"Генерация SQL для признака {idx + 1}/{len(matched_features)}: {feature_name[:30]}...")
-            
-            sql_query = rag_system.generate_sql_query(user_query, feature_name, feature_desc)
-            
-            if sql_query:
-                _send_progress_event(progress_storage, 4, sql_progress + 2, f"Выполнение SQL запроса для {feature_name[:30]}...")
-                result_df = rag_system.execute_sql_query(sql_query)
+        # SQL для разных признаков генерируется и выполняется параллельно;
+        # результаты собираются в порядке matched_features
+        results_by_idx = {}
+        with ThreadPoolExecutor(max_workers=min(SQL_WORKERS, len(matched_features))) as executor:
+            futures = {
+                executor.submit(
+                    rag_system._run_sql_for_feature,
+                    user_query,
+                    feature_info['feature_name'],
+                    feature_info['description']
+                ): idx
+                for idx, feature_info in enumerate(matched_features)
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                idx = futures[future]
+                feature_name = matched_features[idx]['feature_name']
+                sql_progress = 65 + int(done / len(matched_features) * 20)
+                try:
+                    result_df = future.result()
+                except Exception as e:
+                    logger.error("Ошибка SQL для признака '%s': %s", feature_name, e)
+                    continue
                 
-                if not result_df.empty:
-                    result_df['matched_feature'] = feature_name
-                    all_results.append(result_df)
-                    _send_progress_event(progress_storage, 4, sql_progress + 4, f"Для признака '{feature_name}' найдено {len(result_df)} записей", {'records': len(result_df)})
+                if result_df is not None and not result_df.empty:
+                    # Колонка matched_feature добавляется один раз при объединении
+                    results_by_idx[idx] = result_df
+                    _send_progress_event(progress_storage, 4, sql_progress, f"Для признака '{feature_name}' найдено {len(result_df)} записей", {'records': len(result_df)})
+                else:
+                    _send_progress_event(progress_storage, 4, sql_progress, f"SQL для признака {done}/{len(matched_features)} выполнен: {feature_name[:30]}...")
+        
+        result_indices = sorted(results_by_idx)
+        all_results = [results_by_idx[idx] for idx in result_indices]
+        result_features = [matched_features[idx]['feature_name'] for idx in result_indices]
         
         if all_results:
-            combined_results = pd.concat(all_results, ignore_index=True)
+            combined_results = rag_system.combine_results(all_results, result_features)
             _send_progress_event(progress_storage, 4, 85, f"Всего найдено {len(combined_results)} записей", {'total_records': len(combined_results)})
         else:
             combined_results = pd.DataFrame()
@@ -194,16 +605,13 @@ def _rag_query_with_progress(rag_system, user_query, progress_storage, top_k=20)
         final_answer = rag_system.generate_final_summary(user_query, combined_results)
         _send_progress_event(progress_storage, 5, 100, "Ответ сгенерирован", {'answer_length': len(final_answer)})
         
-        # Сохраняем статистику токенов после завершения запроса
-        try:
-            save_stats_to_file()
-        except Exception as e:
-            logger.warning(f"Не удалось сохранить статистику токенов: {e}")
+        if semantic_cache is not None and not combined_results.empty:
+            semantic_cache.put(user_query, combined_results, final_answer)
         
         return combined_results, final_answer
         
     except Exception as e:
-        logger.error(f"Ошибка в _rag_query_with_progress: {e}", exc_info=True)
+        logger.error("Ошибка в _rag_query_with_progress: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
         if progress_storage:
             _send_progress_event(progress_storage, 0, 0, f"Ошибка: {str(e)}", {'error': str(e)})
         raise
@@ -218,42 +626,90 @@ class QueryView(View):
         import uuid
         import threading
         
+        # Пустое или слишком большое тело отклоняется без чтения и разбора JSON
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if content_length == 0:
+            return static_response(_EMPTY_QUERY_BODY, status=400)
+        if content_length > MAX_QUERY_BODY_BYTES:
+            return static_response(_QUERY_TOO_LARGE_BODY, status=413)
+        
         try:
-            data = json.loads(request.body)
+            data = orjson.loads(request.body)
             user_query = data.get('query', '').strip()
             
             if not user_query:
-                return JsonResponse({
-                    'error': 'Запрос не может быть пустым'
-                }, status=400)
+                return static_response(_EMPTY_QUERY_BODY, status=400)
             
             logger.info(f"Получен запрос: {user_query}")
             
             # Создаем уникальный ID для этого запроса
             request_id = str(uuid.uuid4())
             
-            # Инициализируем прогресс
-            _progress_storage[request_id] = {
-                'step': 0,
-                'progress': 0,
-                'message': 'Инициализация...',
-                'details': {},
-                'status': 'processing',
-                'result': None,
-                'error': None
-            }
-            
             # Получаем RAG систему
             rag_system = get_rag_system()
             
+            top_k = 20
+            cache_key = _query_cache_key(user_query, top_k, rag_system.check_index_version())
+            
+            # Повторный запрос: результат уже есть в кэше (хранится как JSON bytes)
+            cached_result = cache.get(cache_key)
+            if cached_result is not None:
+                logger.info("Ответ на запрос найден в кэше")
+                cached_answer = orjson.loads(cached_result)
+                with _progress_lock:
+                    _progress_storage[request_id] = {
+                        'step': 6,
+                        'progress': 100,
+                        'message': 'Запрос выполнен успешно',
+                        'details': {'cached': True},
+                        'status': 'completed',
+                        'result': cached_answer,
+                        'error': None
+                    }
+                if should_generate_video(cached_answer['answer']):
+                    prefetch_video_text(cached_answer['answer'], cached_answer['has_coordinates'], user_query)
+                return orjson_response({
+                    'request_id': request_id,
+                    'status': 'started'
+                })
+            
+            # Инициализируем прогресс (запрос продолжает обновлять этот же словарь,
+            # даже если запись будет вытеснена из хранилища)
+            with _progress_lock:
+                progress = _inflight_queries.get(cache_key)
+                joined = progress is not None
+                if not joined:
+                    progress = {
+                        'step': 0,
+                        'progress': 0,
+                        'message': 'Инициализация...',
+                        'details': {},
+                        'status': 'processing',
+                        'result': None,
+                        'error': None
+                    }
+                    _inflight_queries[cache_key] = progress
+                _progress_storage[request_id] = progress
+            
+            if joined:
+                # Такой же запрос уже выполняется: клиент следит за его прогрессом
+                logger.info("Такой же запрос уже выполняется, ожидаем его результат")
+                return orjson_response({
+                    'request_id': request_id,
+                    'status': 'started'
+                })
+            
             # Запускаем запрос в отдельном потоке
             def run_query():
                 try:
                     results_df, answer = _rag_query_with_progress(
                         rag_system, 
                         user_query, 
-                        _progress_storage[request_id], 
-                        top_k=20
+                        progress, 
+                        top_k=top_k
                     )
                     
                     # Извлекаем координаты
@@ -261,34 +717,56 @@ class QueryView(View):
                     has_coordinates = len(coordinates) > 0
                     
                     # Сохраняем результат
-                    _progress_storage[request_id]['result'] = {
+                    result = {
                         'answer': answer,
                         'coordinates': coordinates,
-                        'results_count': len(results_df) if not results_df.empty else 0,
+                        'results_count': len(results_df.index),
                         'has_coordinates': has_coordinates
                     }
-                    _progress_storage[request_id]['status'] = 'completed'
-                    _progress_storage[request_id]['progress'] = 100
-                    _progress_storage[request_id]['step'] = 6
-                    _progress_storage[request_id]['message'] = 'Запрос выполнен успешно'
+                    # Результат публикуется вместе со статусом: пока запрос
+                    # выполняется, опросы прогресса отдают только небольшие поля
+                    with _progress_lock:
+                        progress.update({
+                            'status': 'completed',
+                            'progress': 100,
+                            'step': 6,
+                            'message': 'Запрос выполнен успешно',
+                            'result': result
+                        })
+                    
+                    # Текст для видео-аватара готовится в фоне, пока фронтенд получает ответ
+                    if should_generate_video(answer):
+                        prefetch_video_text(answer, has_coordinates, user_query)
+                    
+                    # Кэшируем только ответы с найденными данными
+                    if result['results_count'] > 0:
+                        cache.set(
+                            cache_key,
+                            orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY),
+                            timeout=settings.RAG_QUERY_CACHE_TIMEOUT
+                        )
                     
                 except Exception as e:
-                    logger.error(f"Ошибка выполнения запроса: {e}", exc_info=True)
-                    _progress_storage[request_id]['status'] = 'error'
-                    _progress_storage[request_id]['error'] = str(e)
+                    logger.error("Ошибка выполнения запроса: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+                    with _progress_lock:
+                        progress.update({'status': 'error', 'error': str(e)})
+                finally:
+                    with _progress_lock:
+                        if _inflight_queries.get(cache_key) is progress:
+                            del _inflight_queries[cache_key]
             
             thread = threading.Thread(target=run_query)
             thread.start()
             
             # Возвращаем ID запроса для отслеживания прогресса
-            return JsonResponse({
+            return orjson_response({
                 'request_id': request_id,
                 'status': 'started'
             })
             
         except Exception as e:
-            logger.error(f"Ошибка обработки запроса: {e}", exc_info=True)
-            return JsonResponse({
+            logger.error("Ошибка обработки запроса: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+            return orjson_response({
                 'error': f'Ошибка обработки запроса: {str(e)}'
             }, status=500)
 
@@ -302,29 +780,31 @@ class QueryProgressView(View):
         request_id = request.GET.get('request_id')
         
         if not request_id:
-            return JsonResponse({
-                'error': 'request_id обязателен'
-            }, status=400)
+            return static_response(_REQUEST_ID_REQUIRED_BODY, status=400)
         
-        if request_id not in _progress_storage:
-            return JsonResponse({
-                'error': 'Запрос не найден'
-            }, status=404)
+        # Завершенный запрос (результат или ошибка) отдается один раз и сразу
+        # удаляется из хранилища; брошенные клиентом запросы удаляются
+        # по истечении PROGRESS_TTL_SECONDS
+        with _progress_lock:
+            progress = _progress_storage.get(request_id)
+            if progress is None:
+                progress_data = None
+            elif progress['status'] in _FINISHED_STATUSES:
+                progress_data = _progress_storage.pop(request_id)
+            else:
+                progress_data = progress.copy()
         
-        progress_data = _progress_storage[request_id].copy()
+        if progress_data is None:
+            return static_response(_REQUEST_NOT_FOUND_BODY, status=404)
         
-        # Если запрос завершен, удаляем его из хранилища через некоторое время
-        if progress_data['status'] in ['completed', 'error']:
-            # Удаляем через 30 секунд после завершения
-            import threading
-            def cleanup():
-                import time
-                time.sleep(30)
-                if request_id in _progress_storage:
-                    del _progress_storage[request_id]
-            threading.Thread(target=cleanup, daemon=True).start()
+        if _accepts_msgpack(request):
+            return msgpack_response(progress_data)
         
-        return JsonResponse(progress_data)
+        # Большой результат (много координат) отдаем потоком
+        result = progress_data.get('result')
+        if result and len(result.get('coordinates', ())) > STREAM_LIST_THRESHOLD:
+            return streaming_orjson_response(progress_data)
+        return orjson_response(progress_data)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -333,19 +813,31 @@ class QueryStreamView(View):
     
     def post(self, request):
         """Обработка POST запроса с отправкой прогресса через SSE."""
+        # Тело запроса разбирается и проверяется до начала потока: ошибки
+        # возвращаются HTTP статусом, а генератор получает только текст запроса
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if content_length == 0:
+            return static_response(_EMPTY_QUERY_BODY, status=400)
+        if content_length > MAX_QUERY_BODY_BYTES:
+            return static_response(_QUERY_TOO_LARGE_BODY, status=413)
+        
+        try:
+            data = orjson.loads(request.body)
+        except orjson.JSONDecodeError:
+            return static_response(_INVALID_JSON_BODY, status=400)
+        user_query = data.get('query', '').strip() if isinstance(data, dict) else ''
+        if not user_query:
+            return static_response(_EMPTY_QUERY_BODY, status=400)
+        
         def event_stream():
             try:
-                data = json.loads(request.body)
-                user_query = data.get('query', '').strip()
-                
-                if not user_query:
-                    yield f"data: {json.dumps({'error': 'Запрос не может быть пустым'})}\n\n"
-                    return
-                
                 logger.info(f"Получен запрос (SSE): {user_query}")
                 
                 # Создаем очередь для прогресса
-                progress_queue = queue.Queue()
+                progress_queue = queue.Queue(maxsize=SSE_QUEUE_MAXSIZE)
                 
                 # Получаем RAG систему
                 rag_system = get_rag_system()
@@ -361,31 +853,34 @@ class QueryStreamView(View):
                         results_df, answer = _rag_query_with_progress(rag_system, user_query, progress_queue, top_k=20)
                     except Exception as e:
                         error = str(e)
-                        logger.error(f"Ошибка выполнения запроса: {e}", exc_info=True)
+                        logger.error("Ошибка выполнения запроса: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+                    finally:
+                        # Генератор событий ждет этот признак вместо опроса очереди
+                        try:
+                            progress_queue.put(_SSE_DONE, timeout=_SSE_DONE_PUT_TIMEOUT)
+                        except queue.Full:
+                            pass
                 
                 query_thread = threading.Thread(target=run_query)
                 query_thread.start()
                 
-                # Отправляем события прогресса
+                # Отправляем события прогресса сразу по мере поступления (блокирующее ожидание)
                 logger.info("Начало отправки событий прогресса...")
                 events_sent = 0
-                while query_thread.is_alive() or not progress_queue.empty():
+                while True:
                     try:
-                        # Получаем событие из очереди с таймаутом
-                        event = progress_queue.get(timeout=0.1)
-                        events_sent += 1
-                        event_str = f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
-                        logger.info(f"[{events_sent}] Отправка события прогресса: step={event.get('step')}, progress={event.get('progress')}%, message={event.get('message')[:50] if event.get('message') else ''}")
-                        yield event_str
-                        # Принудительно отправляем данные (для некоторых серверов)
-                        import sys
-                        sys.stdout.flush()
+                        event = progress_queue.get(timeout=SSE_KEEPALIVE_SECONDS)
                     except queue.Empty:
-                        # Проверяем, жив ли поток
                         if not query_thread.is_alive():
-                            logger.info(f"Поток завершен. Всего отправлено событий: {events_sent}")
                             break
+                        # Комментарий SSE не дает прокси закрыть долгое соединение
+                        yield ": keep-alive\n\n"
                         continue
+                    if event is _SSE_DONE:
+                        break
+                    events_sent += 1
+                    logger.info(f"[{events_sent}] Отправка события прогресса: step={event.get('step')}, progress={event.get('progress')}%, message={event.get('message')[:50] if event.get('message') else ''}")
+                    yield f"data: {_dumps(event)}\n\n"
                 
                 logger.info(f"Завершение отправки событий. Всего отправлено: {events_sent}")
                 
@@ -394,7 +889,7 @@ class QueryStreamView(View):
                 
                 # Отправляем финальный результат
                 if error:
-                    yield f"data: {json.dumps({'error': error, 'step': 0, 'progress': 0})}\n\n"
+                    yield f"data: {_dumps({'error': error, 'step': 0, 'progress': 0})}\n\n"
                 else:
                     # Извлекаем координаты
                     coordinates = rag_system.extract_coordinates(results_df)
@@ -407,15 +902,15 @@ class QueryStreamView(View):
                         'result': {
                             'answer': answer,
                             'coordinates': coordinates,
-                            'results_count': len(results_df) if not results_df.empty else 0,
+                            'results_count': len(results_df.index),
                             'has_coordinates': has_coordinates
                         }
                     }
-                    yield f"data: {json.dumps(final_result)}\n\n"
+                    yield f"data: {_dumps(final_result)}\n\n"
                     
             except Exception as e:
-                logger.error(f"Ошибка в event_stream: {e}", exc_info=True)
-                yield f"data: {json.dumps({'error': str(e), 'step': 0, 'progress': 0})}\n\n"
+                logger.error("Ошибка в event_stream: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+                yield f"data: {_dumps({'error': str(e), 'step': 0, 'progress': 0})}\n\n"
         
         response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
         response['Cache-Control'] = 'no-cache'
@@ -425,6 +920,98 @@ class QueryStreamView(View):
         return response
 
 
+# Промпт для генерации текста видео: неизменные требования передаются системным
+# сообщением (одинаковый префикс у всех вызовов), запрос и ответ - сообщением пользователя
+_VIDEO_SYSTEM_PROMPT = """Ты - помощник, который готовит текст для озвучивания видео-аватаром.
+
+Тебе передают исходный вопрос пользователя и полный ответ системы.
+Твоя задача - создать краткий, понятный текст для озвучивания видео-аватаром на основе этого ответа.
+
+ТРЕБОВАНИЯ:
+1. Текст должен быть кратким (до 1000 символов) и легко восприниматься на слух
+2. Убери все технические детали, координаты и форматирование
+3. Сохрани основную суть ответа и ключевые факты
+4. Используй простой, разговорный стиль, подходящий для устного изложения
+5. Если в ответе есть координаты или упоминание местоположения, обязательно скажи: "Координаты места можно увидеть на карте"
+6. Текст должен быть естественным для произношения вслух
+7. Не используй markdown, эмодзи или специальные символы
+8. Используй короткие предложения
+
+Верни ТОЛЬКО текст для озвучивания, без дополнительных комментариев или форматирования."""
+
+_VIDEO_USER_TEMPLATE = """Исходный вопрос пользователя: "{user_query}"
+
+Полный ответ системы:
+{full_answer}
+
+{coord_note}"""
+
+_COORD_NOTES = {
+    True: "ВАЖНО: В тексте обязательно упомяни, что координаты можно увидеть на карте.",
+    False: ""
+}
+
+
+def _generate_video_text(full_answer: str, has_coordinates: bool, user_query: str) -> str:
+    """
+    Генерация текста для видео-аватара через GigaChat (без fallback).
+    Ошибки GigaChat пробрасываются вызывающему коду.
+    """
+    video_prompt = {
+        "messages": [
+            {"role": "system", "content": _VIDEO_SYSTEM_PROMPT},
+            {"role": "user", "content": _VIDEO_USER_TEMPLATE.format_map({
+                'user_query': user_query,
+                'full_answer': full_answer,
+                'coord_note': _COORD_NOTES[bool(has_coordinates)]
+            }).rstrip()}
+        ]
+    }
+
+    logger.info("Генерация текста для видео-аватара через GigaChat...")
+    response = _giga_chat(video_prompt)
+    record_from_response(VIDEO_TEXT_MODEL, response)
+    video_text = response.choices[0].message.content.strip()
+    
+    # Очистка от возможных markdown блоков
+    if video_text.startswith("```"):
+        lines = video_text.split('\n')
+        video_text = '\n'.join([line for line in lines if not line.strip().startswith('```')])
+        video_text = video_text.strip()
+    
+    # Убеждаемся, что упоминание о карте есть, если есть координаты
+    if has_coordinates and not _MAP_MENTION_RE.search(video_text):
+        video_text += " Координаты места можно увидеть на карте."
+    
+    logger.info(f"Сгенерирован текст для видео: {len(video_text)} символов")
+    return video_text
+
+
+def _fallback_video_text(full_answer: str, has_coordinates: bool) -> str:
+    """Простая очистка ответа от координат, когда GigaChat недоступен."""
+    logger.warning("Используем fallback метод подготовки текста")
+    lines = full_answer.split('\n')
+    cleaned_lines = []
+    
+    for line in lines:
+        # Пропускаем строки с координатами
+        if _COORD_LINE_RE.search(line):
+            continue
+        # Пропускаем строки, которые выглядят как координаты
+        if ',' in line and len(line.strip()) < 50 and _DIGIT_RE.search(line):
+            continue
+        cleaned_lines.append(line)
+    
+    video_text = '\n'.join(cleaned_lines).strip()
+    
+    # Добавляем информацию о координатах на карте, если они есть
+    if has_coordinates and not _MAP_MENTION_RE.search(video_text):
+        video_text += " Координаты места можно увидеть на карте."
+    
+    logger.info(f"Подготовлен текст для видео (fallback): {len(video_text)} символов")
+    return video_text
+
+
 def prepare_video_text(full_answer: str, has_coordinates: bool = False, user_query: str = '') -> str:
     """
     Генерация текста для видео-аватара на основе полного ответа через GigaChat.
@@ -438,81 +1025,73 @@ def prepare_video_text(full_answer: str, has_coordinates: bool = False, user_que
     Returns:
         Краткий текст для видео-аватара
     """
-    # Промпт для генерации текста видео
-    video_prompt = f"""Ты - помощник, который готовит текст для озвучивания видео-аватаром.
-        
-Исходный вопрос пользователя: "{user_query}"
+    try:
+        return _generate_video_text(full_answer, has_coordinates, user_query)
+    except Exception as e: 
+        logger.error("Ошибка генерации текста для видео через GigaChat: %s", e)
+        return _fallback_video_text(full_answer, has_coordinates)
 
-Полный ответ системы:
-{full_answer}
 
-Твоя задача - создать краткий, понятный текст для озвучивания видео-аватаром на основе этого ответа.
+def _video_text_key(full_answer: str, has_coordinates: bool, user_query: str) -> str:
+    """Ключ кэша текста для видео: хэши ответа и запроса плюс флаг координат."""
+    answer_hash = hashlib.blake2b(full_answer.encode('utf-8'), digest_size=16).hexdigest()
+    query_hash = hashlib.blake2b(user_query.encode('utf-8'), digest_size=16).hexdigest()
+    return f"{answer_hash}:{int(bool(has_coordinates))}:{query_hash}"
 
-ТРЕБОВАНИЯ:
-1. Текст должен быть кратким (до 1000 символов) и легко восприниматься на слух
-2. Убери все технические детали, координаты и форматирование
-3. Сохрани основную суть ответа и ключевые факты
-4. Используй простой, разговорный стиль, подходящий для устного изложения
-5. Если в ответе есть координаты или упоминание местоположения, обязательно скажи: "Координаты места можно увидеть на карте"
-6. Текст должен быть естественным для произношения вслух
-7. Не используй markdown, эмодзи или специальные символы
-8. Используй короткие предложения
 
-{"ВАЖНО: В тексте обязательно упомяни, что координаты можно увидеть на карте." if has_coordinates else ""}
+def _prepare_video_text_task(key: str, full_answer: str, has_coordinates: bool, user_query: str) -> str:
+    """
+    Задача фонового пула для prefetch_video_text.
+    Fallback текст не кэшируется: при следующем открытии видео
+    GigaChat будет вызван повторно.
+    """
+    try:
+        return _generate_video_text(full_answer, has_coordinates, user_query)
+    except Exception as e:
+        logger.error("Ошибка генерации текста для видео через GigaChat: %s", e)
+        with _video_text_lock:
+            _video_text_futures.pop(key, None)
+        return _fallback_video_text(full_answer, has_coordinates)
 
-Верни ТОЛЬКО текст для озвучивания, без дополнительных комментариев или форматирования."""
 
-    try:
-        model_name = 'GigaChat:light'
-        logger.info("Генерация текста для видео-аватара через GigaChat...")
-        with GigaChat(
-            credentials=GIGACHAT_CREDENTIALS,
-            verify_ssl_certs=False,
-            scope='GIGACHAT_API_B2B',
-            model=model_name
-        ) as giga:
-            response = giga.chat(video_prompt)
-            record_from_response(model_name, response)
-            video_text = response.choices[0].message.content.strip()
-            
-            # Очистка от возможных markdown блоков
-            if video_text.startswith("```"):
-                lines = video_text.split('\n')
-                video_text = '\n'.join([line for line in lines if not line.strip().startswith('```')])
-                video_text = video_text.strip()
-            
-            # Убеждаемся, что упоминание о карте есть, если есть координаты
-            if has_coordinates and 'карт' not in video_text.lower() and 'координат' not in video_text.lower():
-                video_text += " Координаты места можно увидеть на карте."
-            
-            logger.info(f"Сгенерирован текст для видео: {len(video_text)} символов")
-            return video_text
-            
-    except Exception as e: 
-        logger.error(f"Ошибка генерации текста для видео через GigaChat: {e}")
-        # Fallback: простая очистка текста
-        logger.warning("Используем fallback метод подготовки текста")
-        lines = full_answer.split('\n')
-        cleaned_lines = []
-        
-        for line in lines:
-            # Пропускаем строки с координатами
-            if any(keyword in line.lower() for keyword in ['📍', 'координат', 'lon:', 'lat:', 'долгота', 'широта']):
-                continue
-            # Пропускаем строки, которые выглядят как координаты
-            if ',' in line and any(char.isdigit() for char in line) and len(line.strip()) < 50:
-                continue
-            cleaned_lines.append(line)
-        
-        video_text = '\n'.join(cleaned_lines).strip()
-        
-        # Добавляем информацию о координатах на карте, если они есть
-        if has_coordinates:
-            if 'карт' not in video_text.lower() and 'координат' not in video_text.lower():
-                video_text += " Координаты места можно увидеть на карте."
+@lru_cache(maxsize=1024)
+def _find_no_data_phrase(answer: str) -> Optional[str]:
+    """
+    Поиск фразы об отсутствии данных в ответе.
+    Результат кэшируется: один и тот же ответ проверяется и при подготовке
+    результата, и при запросе текста для видео.
+    
+    Args:
+        answer: Ответ системы
         
-        logger.info(f"Подготовлен текст для видео (fallback): {len(video_text)} символов")
-        return video_text
+    Returns:
+        Найденная фраза (в нижнем регистре) или None
+    """
+    if len(answer) > NO_DATA_FULL_SCAN_MAX:
+        answer = answer[:NO_DATA_SCAN_HEAD]
+    
+    if not HYPERSCAN_AVAILABLE:
+        match = _NO_DATA_RE.search(answer)
+        return match.group(0).lower() if match else None
+    
+    scratch = getattr(_hs_local, 'scratch', None)
+    if scratch is None:
+        scratch = _hs_local.scratch = hyperscan.Scratch(_NO_DATA_HS_DB)
+    
+    found = []
+    
+    def on_match(phrase_id, start, end, flags, context):
+        found.append(_NO_DATA_PATTERNS[phrase_id])
+        # Достаточно первого совпадения - останавливаем сканирование
+        return True
+    
+    try:
+        _NO_DATA_HS_DB.scan(answer.lower().encode('utf-8'), match_event_handler=on_match, scratch=scratch)
+    except hyperscan.error:
+        # Остановка сканирования из обработчика сообщается исключением
+        if not found:
+            raise
+    return found[0] if found else None
 
 
 def should_generate_video(answer: str) -> bool:
@@ -526,34 +1105,49 @@ def should_generate_video(answer: str) -> bool:
     Returns:
         True если нужно генерировать видео, False если нет
     """
-    answer_lower = answer.lower()
-    
-    # Фразы, которые указывают на отсутствие данных
-    no_data_phrases = [
-        'не найдено',
-        'не найдены',
-        'данных нет',
-        'данные не найдены',
-        'результатов не найдено',
-        'ничего не найдено',
-        'к сожалению, по вашему запросу не найдено',
-        'не удалось найти',
-        'не обнаружено',
-        'отсутствуют данные',
-        'нет данных',
-        'релевантных признаков в базе',
-        'ошибка'
-    ]
-    
-    # Проверяем наличие фраз об отсутствии данных
-    for phrase in no_data_phrases:
-        if phrase in answer_lower:
-            logger.info(f"Видео не будет сгенерировано: обнаружена фраза '{phrase}'")
-            return False
+    # Все фразы проверяются одним проходом (Hyperscan или скомпилированное выражение)
+    phrase = _find_no_data_phrase(answer)
+    if phrase:
+        logger.info(f"Видео не будет сгенерировано: обнаружена фраза '{phrase}'")
+        return False
     
     return True
 
 
+def prefetch_video_text(full_answer: str, has_coordinates: bool = False, user_query: str = '') -> Future:
+    """
+    Запуск подготовки текста для видео в фоновом пуле.
+    
+    Вызывается сразу после получения ответа, поэтому к моменту запроса
+    фронтенда к HeyGenPrepareTextView текст обычно уже готов. Повторный
+    вызов с теми же аргументами возвращает уже запущенную задачу или готовый
+    текст (повторное открытие видео не вызывает GigaChat заново).
+    
+    Args:
+        full_answer: Полный ответ системы
+        has_coordinates: Есть ли координаты в ответе
+        user_query: Исходный запрос пользователя
+        
+    Returns:
+        Future с текстом для видео-аватара
+    """
+    # Те же нормализации, что и в HeyGenPrepareTextView, чтобы ключи совпадали
+    full_answer = full_answer.strip()
+    user_query = user_query.strip()
+    key = _video_text_key(full_answer, has_coordinates, user_query)
+    
+    with _video_text_lock:
+        future = _video_text_futures.get(key)
+        if future is None:
+            future = _GIGA_EXECUTOR.submit(_prepare_video_text_task, key, full_answer, has_coordinates, user_query)
+            _video_text_futures[key] = future
+            while len(_video_text_futures) > _VIDEO_TEXT_FUTURES_MAX:
+                _video_text_futures.popitem(last=False)
+        else:
+            _video_text_futures.move_to_end(key)
+    return future
+
+
 @method_decorator(csrf_exempt, name='dispatch') 
 class HeyGenPrepareTextView(View):
     """API endpoint для подготовки текста для streaming аватара через GigaChat."""
@@ -561,45 +1155,35 @@ class HeyGenPrepareTextView(View):
     def post(self, request):
         """Подготовка текста для streaming аватара."""
         try:
-            data = json.loads(request.body)
+            data = orjson.loads(request.body)
             full_answer = data.get('answer', '').strip()
             user_query = data.get('user_query', '').strip()
             has_coordinates = data.get('has_coordinates', False)
             
             if not full_answer:
-                return JsonResponse({
-                    'error': 'Ответ не может быть пустым'
-                }, status=400)
+                return static_response(_EMPTY_ANSWER_BODY, status=400)
             
             # Проверяем, нужно ли генерировать видео
             if not should_generate_video(full_answer):
                 logger.info("Видео не будет сгенерировано: данные не найдены")
-                return JsonResponse({
-                    'error': 'Видео не генерируется, так как данные не найдены',
-                    'skip_video': True
-                }, status=200)
+                return static_response(_SKIP_VIDEO_BODY, status=200)
             
-            # Генерируем текст для видео через GigaChat
+            # Текст для видео обычно уже подготовлен в фоне после ответа на запрос
             logger.info("Генерация текста для streaming аватара")
-            video_text = prepare_video_text(full_answer, has_coordinates, user_query)
+            video_text = prefetch_video_text(full_answer, has_coordinates, user_query).result()
             
-            # HeyGen API имеет ограничение на длину текста (обычно ~2000-2500 символов)
+            # HeyGen API имеет ограничение на длину текста
             # Обрезаем текст до разумного лимита, сохраняя целостность предложений
-            MAX_TEXT_LENGTH = 2000  # Максимальная длина текста для HeyGen API
             if len(video_text) > MAX_TEXT_LENGTH:
-                logger.warning(f"Текст для видео слишком длинный ({len(video_text)} символов), обрезаем до {MAX_TEXT_LENGTH}")
+                logger.warning("Текст для видео слишком длинный (%d символов), обрезаем до %d", len(video_text), MAX_TEXT_LENGTH)
                 # Обрезаем до последнего полного предложения перед лимитом
                 truncated = video_text[:MAX_TEXT_LENGTH]
-                # Ищем последнюю точку, восклицательный или вопросительный знак
-                last_sentence_end = max(
-                    truncated.rfind('. '),
-                    truncated.rfind('! '),
-                    truncated.rfind('? '),
-                    truncated.rfind('.\n'),
-                    truncated.rfind('!\n'),
-                    truncated.rfind('?\n')
-                )
-                if last_sentence_end > MAX_TEXT_LENGTH * 0.7:  # Если нашли предложение в последних 30%
+                # Ищем последнюю точку, восклицательный или вопросительный знак (один проход)
+                match = None
+                for match in _SENTENCE_END_RE.finditer(truncated):
+                    pass
+                last_sentence_end = match.start() if match else -1
+                if last_sentence_end > _MIN_SENTENCE_CUTOFF:  # Если нашли предложение в последних 30%
                     video_text = truncated[:last_sentence_end + 1] + " [текст обрезан из-за ограничений API]"
                 else:
                     # Если не нашли подходящее место, просто обрезаем
@@ -607,22 +1191,36 @@ class HeyGenPrepareTextView(View):
                 logger.info(f"Текст обрезан до {len(video_text)} символов")
             
             # Возвращаем подготовленный текст для streaming
-            return JsonResponse({
+            return orjson_response({
                 'video_text': video_text,
                 'skip_video': False
             }, status=200)
                 
-        except json.JSONDecodeError:
-            return JsonResponse({
-                'error': 'Неверный формат JSON'
-            }, status=400)
+        except orjson.JSONDecodeError:
+            return static_response(_INVALID_JSON_BODY, status=400)
         except Exception as e:
-            logger.error(f"Ошибка генерации HeyGen видео: {e}", exc_info=True)
-            return JsonResponse({
+            logger.error("Ошибка генерации HeyGen видео: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+            return orjson_response({
                 'error': f'Ошибка обработки запроса: {str(e)}'
             }, status=500)
 
 
+def _heygen_json(response) -> dict:
+    """
+    Разбор JSON ответа HeyGen (при невалидном JSON - исходный текст).
+    
+    Args:
+        response: Ответ urllib3
+        
+    Returns:
+        Словарь с данными ответа
+    """
+    try:
+        return orjson.loads(response.data)
+    except orjson.JSONDecodeError:
+        return {"text": response.data.decode('utf-8', errors='replace')}
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class HeyGenStatusView(View):
     """API endpoint для проверки статуса видео HeyGen."""
@@ -631,53 +1229,35 @@ class HeyGenStatusView(View):
         """Проверка статуса видео по video_id."""
         video_id = request.GET.get("video_id")
         if not video_id:
-            return JsonResponse({"error": "video_id обязателен"}, status=400)
+            return static_response(_VIDEO_ID_REQUIRED_BODY, status=400)
 
-        heygen_api_key = os.environ.get('HEYGEN_API_KEY', 'sk_V2_hgu_k1upmcGvBz3_QufVJuSjUjtPgAwTNhCwSKRGTzWqy9Hk')
-        # Используем v1 API endpoint для статуса (как в heygen_test)
-        heygen_status_url = os.environ.get('HEYGEN_STATUS_URL', 'https://api.heygen.com/v1/video_status.get')
-        
-        if not heygen_api_key:
-            return JsonResponse(
-                {"error": "HEYGEN_API_KEY не задан. Установите переменную окружения."},
-                status=500,
-            )
+        if not HEYGEN_API_KEY:
+            return static_response(_HEYGEN_STATUS_NO_KEY_BODY, status=500)
 
         try:
-            response = requests.get(
-                heygen_status_url,
-                headers={
-                    "X-Api-Key": heygen_api_key,
-                    "Content-Type": "application/json",
-                },
-                params={"video_id": video_id},
-                timeout=30,
+            response = _HEYGEN_POOL.request(
+                "GET",
+                HEYGEN_STATUS_URL,
+                fields={"video_id": video_id},
+                timeout=_HEYGEN_STATUS_TIMEOUT,
             )
-        except requests.exceptions.RequestException as e:
-            logger.error(f"HeyGen status network error: {e}")
-            return JsonResponse({"error": f"Сеть/HTTP ошибка: {e}"}, status=502)
+        except urllib3.exceptions.HTTPError as e:
+            logger.error("HeyGen status network error: %s", e)
+            return orjson_response({"error": f"Сеть/HTTP ошибка: {e}"}, status=502)
 
-        if response.status_code >= 300:
-            try:
-                details = response.json()
-            except:
-                details = {"text": response.text}
+        data = _heygen_json(response)
+        if response.status >= 300:
             logger.error(
-                "HeyGen status error: status=%s details=%s", response.status_code, details
+                "HeyGen status error: status=%s details=%s", response.status, data
             )
-            return JsonResponse(
+            return orjson_response(
                 {
                     "error": "HeyGen вернул ошибку статуса",
-                    "status_code": response.status_code,
-                    "details": details,
+                    "status_code": response.status,
+                    "details": data,
                 },
                 status=502,
             )
-
-        try:
-            data = response.json()
-        except ValueError:
-            data = {"text": response.text}
         
         logger.info(f"HeyGen status data: {data}")
         # v2 API returns {"data": {"status": "...", "video_url": "..."}}
@@ -685,7 +1265,7 @@ class HeyGenStatusView(View):
         status_value = inner.get("status") or inner.get("state")
         video_url = inner.get("video_url") or inner.get("url")
 
-        return JsonResponse(
+        return orjson_response(
             {
                 "status": status_value or "pending",
                 "video_url": video_url,
@@ -700,38 +1280,29 @@ class HeyGenStreamingTokenView(View):
     
     def post(self, request):
         """Получение streaming токена от HeyGen API."""
-        heygen_api_key = os.environ.get('HEYGEN_API_KEY', 'sk_V2_hgu_k1upmcGvBz3_QufVJuSjUjtPgAwTNhCwSKRGTzWqy9Hk')
-        
-        if not heygen_api_key:
-            return JsonResponse({"error": "HEYGEN_API_KEY не задан"}, status=500)
+        if not HEYGEN_API_KEY:
+            return static_response(_HEYGEN_TOKEN_NO_KEY_BODY, status=500)
 
         try:
-            response = requests.post(
+            response = _HEYGEN_POOL.request(
+                "POST",
                 "https://api.heygen.com/v1/streaming.create_token",
-                headers={
-                    "X-Api-Key": heygen_api_key,
-                    "Content-Type": "application/json",
-                },
-                timeout=30,
+                timeout=_HEYGEN_TOKEN_TIMEOUT,
             )
-        except requests.exceptions.RequestException as e:
-            logger.error(f"HeyGen streaming token network error: {e}")
-            return JsonResponse({"error": f"Сеть/HTTP ошибка: {e}"}, status=502)
+        except urllib3.exceptions.HTTPError as e:
+            logger.error("HeyGen streaming token network error: %s", e)
+            return orjson_response({"error": f"Сеть/HTTP ошибка: {e}"}, status=502)
 
-        try:
-            data = response.json()
-        except ValueError:
-            data = {"text": response.text}
-        
-        if response.status_code >= 300:
-            logger.error(f"HeyGen streaming token error: status={response.status_code} details={data}")
-            return JsonResponse({"error": "HeyGen error", "details": data}, status=502)
+        data = _heygen_json(response)
+        if response.status >= 300:
+            logger.error("HeyGen streaming token error: status=%s details=%s", response.status, data)
+            return orjson_response({"error": "HeyGen error", "details": data}, status=502)
 
         logger.info("HeyGen streaming token получен успешно")
         
         # Добавляем avatar_id в ответ для использования на frontend
         # Получаем avatar_id из переменных окружения (без дефолтного значения, чтобы избежать использования несуществующего аватара)
-        heygen_avatar_id = os.environ.get('HEYGEN_AVATAR_ID')
+        heygen_avatar_id = HEYGEN_AVATAR_ID
         if not heygen_avatar_id:
             logger.warning("HEYGEN_AVATAR_ID не задан в переменных окружения. Используйте доступный Interactive Avatar ID из https://labs.heygen.com/interactive-avatar")
             # Не используем дефолтное значение, так как старый аватар больше не доступен
@@ -744,5 +1315,5 @@ class HeyGenStreamingTokenView(View):
             else:
                 data['avatar_id'] = heygen_avatar_id
         
-        return JsonResponse(data)
+        return orjson_response(data)
 
@@ -4,9 +4,12 @@
 Проверяет существование, количество документов и структуру.
 """
 
+import logging
 import os
 import sys
+from typing import Optional
 from opensearchpy import OpenSearch
+from opensearchpy.exceptions import NotFoundError
 
 # Конфигурация OpenSearch (та же, что в import_opensearch.py)
 OPENSEARCH_HOST = os.environ.get('OPENSEARCH_HOST', '155.212.186.244')
@@ -15,111 +18,132 @@ OPENSEARCH_USE_SSL = os.environ.get('OPENSEARCH_USE_SSL', 'False').lower() == 't
 OPENSEARCH_VERIFY_CERTS = os.environ.get('OPENSEARCH_VERIFY_CERTS', 'False').lower() == 'true'
 OPENSEARCH_USERNAME = os.environ.get('OPENSEARCH_USERNAME', None)
 OPENSEARCH_PASSWORD = os.environ.get('OPENSEARCH_PASSWORD', None)
+# Размер пула соединений urllib3 (по умолчанию в opensearch-py - 10)
+OPENSEARCH_POOL_MAXSIZE = int(os.environ.get('OPENSEARCH_POOL_MAXSIZE', 32))
 
 INDEX_NAME = 'feature_descriptions'
+# Размерность эмбеддингов sbert_large_nlu_ru (если в mapping она не указана)
+DEFAULT_EMBEDDING_DIM = 1024
 
-def main():
-    print("="*60)
-    print(f"ПРОВЕРКА ИНДЕКСА: {INDEX_NAME}")
-    print("="*60)
-    
-    # Подключение к OpenSearch
-    print(f"\n🔌 Подключение к OpenSearch...")
-    print(f"   Host: {OPENSEARCH_HOST}:{OPENSEARCH_PORT}")
-    
-    auth = None
-    if OPENSEARCH_USERNAME and OPENSEARCH_PASSWORD:
-        auth = (OPENSEARCH_USERNAME, OPENSEARCH_PASSWORD)
-    
-    try:
-        client = OpenSearch(
+# Вывод через logging (stderr); уровень задается LOG_LEVEL, DEBUG включает traceback
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    format='%(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Один клиент (и пул соединений) на процесс: все вызовы используют общие соединения
+_CLIENT: Optional[OpenSearch] = None
+
+
+def get_opensearch_client() -> OpenSearch:
+    """Возвращает общий клиент OpenSearch (создается при первом вызове)."""
+    global _CLIENT
+    if _CLIENT is None:
+        auth = None
+        if OPENSEARCH_USERNAME and OPENSEARCH_PASSWORD:
+            auth = (OPENSEARCH_USERNAME, OPENSEARCH_PASSWORD)
+        _CLIENT = OpenSearch(
             hosts=[{'host': OPENSEARCH_HOST, 'port': OPENSEARCH_PORT}],
             http_auth=auth,
             use_ssl=OPENSEARCH_USE_SSL,
             verify_certs=OPENSEARCH_VERIFY_CERTS,
-            timeout=60
+            timeout=60,
+            pool_maxsize=OPENSEARCH_POOL_MAXSIZE,
+            max_retries=3,
+            retry_on_timeout=True,
+            # gzip тел запросов и ответов: JSON с векторами float хорошо сжимается
+            http_compress=True
         )
-        
-        if not client.ping():
-            print("❌ Не удалось подключиться к OpenSearch")
-            sys.exit(1)
-        
-        print("✓ Подключение установлено\n")
-        
-    except Exception as e:
-        print(f"❌ Ошибка подключения: {e}")
-        sys.exit(1)
+    return _CLIENT
+
+
+def main():
+    logger.info("="*60)
+    logger.info("ПРОВЕРКА ИНДЕКСА: %s", INDEX_NAME)
+    logger.info("="*60)
+    
+    # Подключение к OpenSearch: отдельный ping не нужен, ошибку соединения
+    # вернет первый же запрос информации об индексе
+    logger.info("\n🔌 Подключение к OpenSearch...")
+    logger.info("   Host: %s:%s", OPENSEARCH_HOST, OPENSEARCH_PORT)
+    client = get_opensearch_client()
     
-    # Проверка существования индекса
-    print(f"📋 Проверка существования индекса...")
+    # Существование, mapping и settings индекса - одним запросом
+    logger.info("📋 Проверка существования индекса...")
     try:
-        exists = client.indices.exists(index=INDEX_NAME)
-        if not exists:
-            print(f"❌ Индекс '{INDEX_NAME}' не существует!")
-            print(f"\n💡 Решение: Выполните импорт индекса:")
-            print(f"   python rag_web/import_opensearch.py")
-            sys.exit(1)
-        print(f"✓ Индекс существует\n")
+        info = client.indices.get(index=INDEX_NAME)
+    except NotFoundError:
+        logger.error("❌ Индекс '%s' не существует!", INDEX_NAME)
+        logger.info("\n💡 Решение: Выполните импорт индекса:")
+        logger.info("   python rag_web/import_opensearch.py")
+        sys.exit(1)
     except Exception as e:
-        print(f"❌ Ошибка проверки индекса: {e}")
+        logger.error("❌ Ошибка подключения: %s", e)
         sys.exit(1)
+    logger.info("✓ Подключение установлено")
+    logger.info("✓ Индекс существует\n")
     
     # Проверка количества документов
-    print(f"📊 Проверка количества документов...")
+    logger.info("📊 Проверка количества документов...")
     try:
-        count_response = client.count(index=INDEX_NAME)
-        doc_count = count_response['count']
-        print(f"✓ Документов в индексе: {doc_count}")
+        stats = client.indices.stats(index=INDEX_NAME, metric='docs')
+        doc_count = stats['_all']['primaries']['docs']['count']
+        logger.info("✓ Документов в индексе: %s", doc_count)
         if doc_count == 0:
-            print(f"\n⚠️  ВНИМАНИЕ: Индекс пуст!")
-            print(f"💡 Решение: Выполните импорт индекса:")
-            print(f"   python rag_web/import_opensearch.py")
+            logger.warning("\n⚠️  ВНИМАНИЕ: Индекс пуст!")
+            logger.info("💡 Решение: Выполните импорт индекса:")
+            logger.info("   python rag_web/import_opensearch.py")
             sys.exit(1)
-        print()
+        logger.info("")
     except Exception as e:
-        print(f"❌ Ошибка подсчета документов: {e}")
+        logger.error("❌ Ошибка подсчета документов: %s", e)
         sys.exit(1)
     
-    # Проверка mapping
-    print(f"🔍 Проверка структуры индекса (mapping)...")
+    # Проверка mapping (уже получен вместе с индексом; если INDEX_NAME -
+    # алиас, ключ ответа - имя реального индекса)
+    logger.info("🔍 Проверка структуры индекса (mapping)...")
     try:
-        mapping = client.indices.get_mapping(index=INDEX_NAME)
-        index_mapping = mapping.get(INDEX_NAME, {}).get('mappings', {}).get('properties', {})
+        index_info = info.get(INDEX_NAME) or next(iter(info.values()))
+        index_mapping = index_info.get('mappings', {}).get('properties', {})
         
-        print(f"✓ Найдено полей: {len(index_mapping)}")
-        print(f"\nПоля индекса:")
+        logger.info("✓ Найдено полей: %s", len(index_mapping))
+        logger.info("\nПоля индекса:")
         for field_name, field_props in sorted(index_mapping.items()):
             field_type = field_props.get('type', 'unknown')
-            print(f"  - {field_name}: {field_type}")
+            logger.info("  - %s: %s", field_name, field_type)
             
             # Проверяем, есть ли поле embedding типа knn_vector
             if field_name == 'embedding' and field_type == 'knn_vector':
-                print(f"    ✓ Поле embedding типа knn_vector найдено")
+                logger.info("    ✓ Поле embedding типа knn_vector найдено")
                 dim = field_props.get('dimension', 'не указана')
-                print(f"      Размерность: {dim}")
+                logger.info("      Размерность: %s", dim)
         
         # Проверяем наличие необходимых полей
         has_embedding = 'embedding' in index_mapping
         has_text = 'text' in index_mapping
         
-        print(f"\nПроверка необходимых полей:")
-        print(f"  - embedding (knn_vector): {'✓' if has_embedding else '❌'}")
-        print(f"  - text (text): {'✓' if has_text else '❌'}")
+        logger.info("\nПроверка необходимых полей:")
+        logger.info("  - embedding (knn_vector): %s", '✓' if has_embedding else '❌')
+        logger.info("  - text (text): %s", '✓' if has_text else '❌')
         
         if not has_embedding or not has_text:
-            print(f"\n❌ Отсутствуют необходимые поля!")
+            logger.error("\n❌ Отсутствуют необходимые поля!")
             sys.exit(1)
-        print()
+        logger.info("")
         
     except Exception as e:
-        print(f"❌ Ошибка получения mapping: {e}")
+        logger.error("❌ Ошибка получения mapping: %s", e)
         sys.exit(1)
     
     # Тестовый поиск
-    print(f"🔎 Тестовый поиск (KNN)...")
+    logger.info("🔎 Тестовый поиск (KNN)...")
     try:
-        # Простой тестовый вектор (нулевой вектор для проверки)
-        test_vector = [0.0] * 1024  # Обычная размерность для sbert_large_nlu_ru
+        # Простой тестовый вектор (нулевой вектор для проверки) размерности из mapping.
+        # Целые нули сериализуются как "0" вместо "0.0": тело запроса вдвое меньше,
+        # OpenSearch разбирает их как float
+        dimension = index_mapping.get('embedding', {}).get('dimension', DEFAULT_EMBEDDING_DIM)
+        test_vector = [0] * int(dimension)
         
         # Формируем KNN запрос
         knn_query = {
@@ -136,28 +160,29 @@ def main():
         
         response = client.search(index=INDEX_NAME, body=knn_query)
         hits_count = len(response['hits']['hits'])
-        print(f"✓ Тестовый поиск выполнен")
-        print(f"  Найдено документов: {hits_count}")
+        logger.info("✓ Тестовый поиск выполнен")
+        logger.info("  Найдено документов: %s", hits_count)
         
         if hits_count > 0:
-            print(f"  Первый результат:")
+            logger.info("  Первый результат:")
             first_hit = response['hits']['hits'][0]
-            print(f"    ID: {first_hit['_id']}")
-            print(f"    Score: {first_hit['_score']}")
+            logger.info("    ID: %s", first_hit['_id'])
+            logger.info("    Score: %s", first_hit['_score'])
             source = first_hit['_source']
             text_preview = source.get('text', '')[:100] if source.get('text') else 'N/A'
-            print(f"    Text (preview): {text_preview}...")
+            logger.info("    Text (preview): %s...", text_preview)
         else:
-            print(f"  ⚠️  Поиск вернул 0 результатов (возможно, проблема с запросом)")
+            logger.warning("  ⚠️  Поиск вернул 0 результатов (возможно, проблема с запросом)")
         
     except Exception as e:
-        print(f"❌ Ошибка тестового поиска: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error("❌ Ошибка тестового поиска: %s", e)
+        # Полный traceback только в режиме отладки
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.exception("Traceback тестового поиска")
     
-    print(f"\n{'='*60}")
-    print(f"ПРОВЕРКА ЗАВЕРШЕНА")
-    print(f"{'='*60}")
+    logger.info("\n" + "="*60)
+    logger.info("ПРОВЕРКА ЗАВЕРШЕНА")
+    logger.info("="*60)
 
 if __name__ == "__main__":
     main()
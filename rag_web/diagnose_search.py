@@ -4,9 +4,16 @@
 Проверяет структуру индекса, наличие документов и тестирует поиск.
 """
 
+import hashlib
 import json
+import logging
 import os
 import sys
+import time
+from functools import lru_cache
+from typing import Optional
+import numpy as np
+import torch
 from opensearchpy import OpenSearch
 from sentence_transformers import SentenceTransformer
 
@@ -17,90 +24,210 @@ OPENSEARCH_USE_SSL = os.environ.get('OPENSEARCH_USE_SSL', 'False').lower() == 't
 OPENSEARCH_VERIFY_CERTS = os.environ.get('OPENSEARCH_VERIFY_CERTS', 'False').lower() == 'true'
 OPENSEARCH_USERNAME = os.environ.get('OPENSEARCH_USERNAME', None)
 OPENSEARCH_PASSWORD = os.environ.get('OPENSEARCH_PASSWORD', None)
+# Размер пула соединений urllib3 (по умолчанию в opensearch-py - 10)
+OPENSEARCH_POOL_MAXSIZE = int(os.environ.get('OPENSEARCH_POOL_MAXSIZE', 32))
 
 INDEX_NAME = 'feature_descriptions'
 EMBEDDING_MODEL = "ai-forever/sbert_large_nlu_ru"
 
+# Эмбеддинги тестовых запросов сохраняются на диск: повторный запуск
+# диагностики не загружает модель (~700 МБ), если запрос уже кодировался
+EMBEDDING_CACHE_DIR = os.environ.get(
+    'DIAGNOSE_EMBEDDING_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.diagnose_cache')
+)
+
+# FORCEMERGE=1: слить сегменты индекса в один перед тестовым поиском
+# (меньше HNSW графов на запрос; операция тяжелая, поэтому только по флагу)
+FORCEMERGE = os.environ.get('FORCEMERGE') == '1'
+# Сколько секунд ждать загрузки k-NN графов в память после warmup
+KNN_WARMUP_TIMEOUT = float(os.environ.get('KNN_WARMUP_TIMEOUT', 60))
+
+# Вывод через logging (stderr); уровень задается LOG_LEVEL, DEBUG включает traceback
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    format='%(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Один клиент (и пул соединений) на процесс: все вызовы используют общие соединения
+_CLIENT: Optional[OpenSearch] = None
+
+
+def get_opensearch_client() -> OpenSearch:
+    """Возвращает общий клиент OpenSearch (создается при первом вызове)."""
+    global _CLIENT
+    if _CLIENT is None:
+        auth = None
+        if OPENSEARCH_USERNAME and OPENSEARCH_PASSWORD:
+            auth = (OPENSEARCH_USERNAME, OPENSEARCH_PASSWORD)
+        _CLIENT = OpenSearch(
+            hosts=[{'host': OPENSEARCH_HOST, 'port': OPENSEARCH_PORT}],
+            http_auth=auth,
+            use_ssl=OPENSEARCH_USE_SSL,
+            verify_certs=OPENSEARCH_VERIFY_CERTS,
+            timeout=60,
+            pool_maxsize=OPENSEARCH_POOL_MAXSIZE,
+            max_retries=3,
+            retry_on_timeout=True,
+            # gzip тел запросов и ответов: JSON с векторами float хорошо сжимается
+            http_compress=True
+        )
+    return _CLIENT
+
+
+
+@lru_cache(maxsize=1)
+def get_encoder() -> SentenceTransformer:
+    """
+    Загружает модель эмбеддингов один раз за процесс.
+    При наличии GPU модель работает на нем в FP16, иначе на CPU в FP32
+    (FP16 на CPU медленнее).
+    """
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    logger.info("Загрузка модели: %s (%s)...", EMBEDDING_MODEL, device)
+    model = SentenceTransformer(EMBEDDING_MODEL, device=device)
+    if device == 'cuda':
+        model.half()
+    return model
+
+
+def encode_query(query: str) -> np.ndarray:
+    """
+    Эмбеддинг запроса с кэшем на диске по ключу (модель, запрос).
+    
+    Args:
+        query: Текст запроса
+        
+    Returns:
+        Вектор запроса
+    """
+    key = hashlib.blake2b(f"{EMBEDDING_MODEL}\0{query}".encode('utf-8'), digest_size=16).hexdigest()
+    path = os.path.join(EMBEDDING_CACHE_DIR, f'{key}.npy')
+    if os.path.exists(path):
+        logger.info("Эмбеддинг запроса загружен из кэша")
+        return np.load(path)
+    
+    # В FP16 эмбеддинг приводится к float32, как и при кодировании на CPU
+    embedding = get_encoder().encode([query], convert_to_numpy=True)[0].astype(np.float32)
+    os.makedirs(EMBEDDING_CACHE_DIR, exist_ok=True)
+    np.save(path, embedding)
+    return embedding
+
+
+def prepare_index_for_search(client: OpenSearch) -> None:
+    """
+    Готовит k-NN индекс к замеру поиска: при FORCEMERGE=1 сливает сегменты,
+    затем загружает графы в память (warmup), чтобы первый запрос не платил
+    за их холодную загрузку.
+    
+    Args:
+        client: Клиент OpenSearch
+    """
+    if FORCEMERGE:
+        logger.info("Force merge до одного сегмента...")
+        start = time.perf_counter()
+        client.indices.forcemerge(index=INDEX_NAME, max_num_segments=1,
+                                  wait_for_completion=True, request_timeout=600)
+        logger.info("✓ Force merge завершен за %.1f с", time.perf_counter() - start)
+    
+    logger.info("Загрузка k-NN графов в память (warmup)...")
+    start = time.perf_counter()
+    try:
+        response = client.transport.perform_request(
+            'GET', f'/_plugins/_knn/warmup/{INDEX_NAME}', params={'request_timeout': KNN_WARMUP_TIMEOUT}
+        )
+    except Exception as e:
+        logger.warning("⚠️  Warmup не выполнен: %s", e)
+        return
+    
+    # Warmup может вернуться раньше, чем графы всех шардов окажутся в кэше:
+    # ждем появления индекса в статистике k-NN плагина на узлах
+    shards = response.get('_shards', {})
+    if shards.get('failed'):
+        while time.perf_counter() - start < KNN_WARMUP_TIMEOUT:
+            stats = client.transport.perform_request('GET', '/_plugins/_knn/stats')
+            if any(INDEX_NAME in node.get('indices_in_cache', {})
+                   for node in stats.get('nodes', {}).values()):
+                break
+            time.sleep(1)
+        else:
+            logger.warning("⚠️  Графы не загружены за %.0f с", KNN_WARMUP_TIMEOUT)
+            return
+    logger.info("✓ Warmup завершен за %.1f с\n", time.perf_counter() - start)
+
+
 def main():
-    print("="*80)
-    print("ДИАГНОСТИКА ПОИСКА В OPENSEARCH")
-    print("="*80)
+    logger.info("="*80)
+    logger.info("ДИАГНОСТИКА ПОИСКА В OPENSEARCH")
+    logger.info("="*80)
     
     # Подключение
-    auth = None
-    if OPENSEARCH_USERNAME and OPENSEARCH_PASSWORD:
-        auth = (OPENSEARCH_USERNAME, OPENSEARCH_PASSWORD)
-    
-    client = OpenSearch(
-        hosts=[{'host': OPENSEARCH_HOST, 'port': OPENSEARCH_PORT}],
-        http_auth=auth,
-        use_ssl=OPENSEARCH_USE_SSL,
-        verify_certs=OPENSEARCH_VERIFY_CERTS,
-        timeout=60
-    )
+    client = get_opensearch_client()
     
     if not client.ping():
-        print("❌ Не удалось подключиться")
+        logger.error("❌ Не удалось подключиться")
         sys.exit(1)
     
-    print("✓ Подключение установлено\n")
+    logger.info("✓ Подключение установлено\n")
     
     # 1. Проверка существования индекса
-    print("1. ПРОВЕРКА ИНДЕКСА")
-    print("-" * 80)
+    logger.info("1. ПРОВЕРКА ИНДЕКСА")
+    logger.info("-" * 80)
     if not client.indices.exists(index=INDEX_NAME):
-        print(f"❌ Индекс '{INDEX_NAME}' не существует!")
+        logger.error("❌ Индекс '%s' не существует!", INDEX_NAME)
         sys.exit(1)
-    print(f"✓ Индекс существует\n")
+    logger.info("✓ Индекс существует\n")
     
     # 2. Проверка количества документов
-    print("2. КОЛИЧЕСТВО ДОКУМЕНТОВ")
-    print("-" * 80)
+    logger.info("2. КОЛИЧЕСТВО ДОКУМЕНТОВ")
+    logger.info("-" * 80)
     count_response = client.count(index=INDEX_NAME)
     doc_count = count_response['count']
-    print(f"Документов в индексе: {doc_count}")
+    logger.info("Документов в индексе: %s", doc_count)
     if doc_count == 0:
-        print("❌ Индекс пуст! Нужно импортировать документы.")
+        logger.error("❌ Индекс пуст! Нужно импортировать документы.")
         sys.exit(1)
-    print()
+    logger.info("")
     
     # 3. Проверка mapping
-    print("3. СТРУКТУРА ИНДЕКСА (MAPPING)")
-    print("-" * 80)
+    logger.info("3. СТРУКТУРА ИНДЕКСА (MAPPING)")
+    logger.info("-" * 80)
     mapping = client.indices.get_mapping(index=INDEX_NAME)
     index_mapping = mapping.get(INDEX_NAME, {}).get('mappings', {}).get('properties', {})
     
-    vector_field = None
-    text_field = None
+    # Первые поля нужных типов (как в RAGSystemLangChain._get_vector_field_name)
+    vector_field = next((name for name, props in index_mapping.items()
+                         if props.get('type') == 'knn_vector'), None)
+    text_field = next((name for name, props in index_mapping.items()
+                       if props.get('type') == 'text'), None)
     
+    # Полный проход нужен только для вывода всех полей
     for field_name, field_props in index_mapping.items():
         field_type = field_props.get('type', 'unknown')
-        print(f"  {field_name}: {field_type}")
+        logger.info("  %s: %s", field_name, field_type)
         
         if field_type == 'knn_vector':
-            vector_field = field_name
             dim = field_props.get('dimension', 'не указана')
             method = field_props.get('method', {})
             space_type = method.get('space_type', 'не указан')
-            print(f"    - dimension: {dim}")
-            print(f"    - space_type: {space_type}")
-            print(f"    - method: {method}")
-        elif field_type == 'text':
-            text_field = field_name
+            logger.info("    - dimension: %s", dim)
+            logger.info("    - space_type: %s", space_type)
+            logger.info("    - method: %s", method)
     
     if not vector_field:
-        print("❌ Поле типа knn_vector не найдено!")
+        logger.error("❌ Поле типа knn_vector не найдено!")
         sys.exit(1)
     if not text_field:
-        print("❌ Поле типа text не найдено!")
+        logger.error("❌ Поле типа text не найдено!")
         sys.exit(1)
     
-    print(f"\n✓ Векторное поле: {vector_field}")
-    print(f"✓ Текстовое поле: {text_field}\n")
+    logger.info("\n✓ Векторное поле: %s", vector_field)
+    logger.info("✓ Текстовое поле: %s\n", text_field)
     
     # 4. Проверка первого документа
-    print("4. ПРОВЕРКА ПЕРВОГО ДОКУМЕНТА")
-    print("-" * 80)
+    logger.info("4. ПРОВЕРКА ПЕРВОГО ДОКУМЕНТА")
+    logger.info("-" * 80)
     response = client.search(
         index=INDEX_NAME,
         body={"size": 1, "query": {"match_all": {}}}
@@ -110,129 +237,138 @@ def main():
         first_hit = response['hits']['hits'][0]
         source = first_hit['_source']
         
-        print(f"ID: {first_hit['_id']}")
-        print(f"Поля в документе:")
+        logger.info("ID: %s", first_hit['_id'])
+        logger.info("Поля в документе:")
         for key in source.keys():
             if key == vector_field:
                 vec_len = len(source[key]) if isinstance(source[key], list) else 'N/A'
-                print(f"  - {key}: list длиной {vec_len}")
+                logger.info("  - %s: list длиной %s", key, vec_len)
             else:
                 value_preview = str(source[key])[:60] if source[key] else 'None'
-                print(f"  - {key}: {value_preview}...")
-    print()
+                logger.info("  - %s: %s...", key, value_preview)
+    logger.info("")
     
     # 5. Тестовый поиск
-    print("5. ТЕСТОВЫЙ ПОИСК")
-    print("-" * 80)
+    logger.info("5. ТЕСТОВЫЙ ПОИСК")
+    logger.info("-" * 80)
     
-    # Загружаем модель эмбеддингов
-    print(f"Загрузка модели: {EMBEDDING_MODEL}...")
-    embedding_model = SentenceTransformer(EMBEDDING_MODEL)
+    # Без прогрева первый KNN запрос включает загрузку графов и искажает замер
+    prepare_index_for_search(client)
     
-    # Генерируем тестовый эмбеддинг
+    # Генерируем тестовый эмбеддинг (модель загружается только при промахе кэша)
     test_query = "PWD давление"
-    print(f"Тестовый запрос: '{test_query}'")
-    query_embedding = embedding_model.encode(test_query).tolist()
-    print(f"Размерность эмбеддинга: {len(query_embedding)}\n")
+    logger.info("Тестовый запрос: '%s'", test_query)
+    query_embedding = encode_query(test_query).tolist()
+    logger.info("Размерность эмбеддинга: %s\n", len(query_embedding))
     
     # Тест 1: Формат с knn внутри query
-    print("Тест 1: Формат с knn внутри query")
-    print("-" * 40)
-    try:
-        knn_query_v2 = {
-            "size": 5,
-            "query": {
-                "knn": {
-                    vector_field: {
-                        "vector": query_embedding,
-                        "k": 5
-                    }
+    knn_query_v2 = {
+        "size": 5,
+        "query": {
+            "knn": {
+                vector_field: {
+                    "vector": query_embedding,
+                    "k": 5
                 }
             }
         }
-        
-        response = client.search(index=INDEX_NAME, body=knn_query_v2)
-        hits_count = len(response['hits']['hits'])
-        print(f"✓ Запрос выполнен успешно")
-        print(f"  Найдено документов: {hits_count}")
-        
-        if hits_count > 0:
-            print(f"  Первый результат:")
-            first_hit = response['hits']['hits'][0]
-            print(f"    ID: {first_hit['_id']}")
-            print(f"    Score: {first_hit['_score']}")
-            text_preview = first_hit['_source'].get(text_field, '')[:100]
-            print(f"    Text: {text_preview}...")
-        else:
-            print("  ⚠️  НО: 0 результатов!")
-            print("  Проверяем детали ответа...")
-            print(f"  Total: {response['hits']['total']}")
-            print(f"  Max score: {response['hits']['max_score']}")
-    except Exception as e:
-        print(f"❌ Ошибка: {e}")
-    
-    print()
+    }
     
     # Тест 2: Формат с knn на верхнем уровне (если поддерживается)
-    print("Тест 2: Формат с knn на верхнем уровне")
-    print("-" * 40)
-    try:
-        knn_query_v1 = {
-            "size": 5,
+    knn_query_v1 = {
+        "size": 5,
+        "knn": {
+            vector_field: {
+                "vector": query_embedding,
+                "k": 5
+            }
+        }
+    }
+    
+    # Тест 3: Для cosinesimil может потребоваться нормализация вектора
+    # (деление на месте, без промежуточного массива; нулевой вектор не меняется)
+    query_vec = np.array(query_embedding, dtype=np.float32)
+    np.divide(query_vec, max(float(np.linalg.norm(query_vec)), 1e-12), out=query_vec)
+    normalized_embedding = query_vec.tolist()
+    
+    knn_query_normalized = {
+        "size": 5,
+        "query": {
             "knn": {
                 vector_field: {
-                    "vector": query_embedding,
+                    "vector": normalized_embedding,
                     "k": 5
                 }
             }
         }
+    }
+    
+    # Все три запроса отправляются одним msearch (один HTTP round-trip);
+    # ошибка отдельного запроса приходит в его элементе responses
+    msearch_body = [
+        {"index": INDEX_NAME}, knn_query_v2,
+        {"index": INDEX_NAME}, knn_query_v1,
+        {"index": INDEX_NAME}, knn_query_normalized,
+    ]
+    try:
+        responses = client.msearch(body=msearch_body)['responses']
+    except Exception as e:
+        logger.error("❌ Ошибка msearch: %s", e)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.exception("Traceback msearch")
+        responses = [{'error': str(e)}] * 3
+    
+    logger.info("Тест 1: Формат с knn внутри query")
+    logger.info("-" * 40)
+    response = responses[0]
+    if 'error' in response:
+        logger.error("❌ Ошибка: %s", response['error'])
+    else:
+        hits_count = len(response['hits']['hits'])
+        logger.info("✓ Запрос выполнен успешно")
+        logger.info("  Найдено документов: %s", hits_count)
         
-        response = client.search(index=INDEX_NAME, body=knn_query_v1)
+        if hits_count > 0:
+            logger.info("  Первый результат:")
+            first_hit = response['hits']['hits'][0]
+            logger.info("    ID: %s", first_hit['_id'])
+            logger.info("    Score: %s", first_hit['_score'])
+            text_preview = first_hit['_source'].get(text_field, '')[:100]
+            logger.info("    Text: %s...", text_preview)
+        else:
+            logger.warning("  ⚠️  НО: 0 результатов!")
+            logger.info("  Проверяем детали ответа...")
+            logger.info("  Total: %s", response['hits']['total'])
+            logger.info("  Max score: %s", response['hits']['max_score'])
+    
+    logger.info("")
+    
+    logger.info("Тест 2: Формат с knn на верхнем уровне")
+    logger.info("-" * 40)
+    response = responses[1]
+    if 'error' in response:
+        logger.warning("⚠️  Не поддерживается: %s", response['error'])
+    else:
         hits_count = len(response['hits']['hits'])
-        print(f"✓ Запрос выполнен успешно")
-        print(f"  Найдено документов: {hits_count}")
-    except Exception as e:
-        print(f"⚠️  Не поддерживается: {e}")
+        logger.info("✓ Запрос выполнен успешно")
+        logger.info("  Найдено документов: %s", hits_count)
     
-    print()
+    logger.info("")
     
-    # Тест 3: Поиск с фильтром по space_type
-    print("Тест 3: Проверка space_type в запросе")
-    print("-" * 40)
-    try:
-        # Для cosinesimil может потребоваться нормализация вектора
-        import numpy as np
-        query_vec = np.array(query_embedding)
-        # Нормализуем для cosine similarity
-        norm = np.linalg.norm(query_vec)
-        if norm > 0:
-            normalized_embedding = (query_vec / norm).tolist()
-        else:
-            normalized_embedding = query_embedding
-        
-        knn_query_normalized = {
-            "size": 5,
-            "query": {
-                "knn": {
-                    vector_field: {
-                        "vector": normalized_embedding,
-                        "k": 5
-                    }
-                }
-            }
-        }
-        
-        response = client.search(index=INDEX_NAME, body=knn_query_normalized)
+    logger.info("Тест 3: Проверка space_type в запросе")
+    logger.info("-" * 40)
+    response = responses[2]
+    if 'error' in response:
+        logger.warning("⚠️  Ошибка: %s", response['error'])
+    else:
         hits_count = len(response['hits']['hits'])
-        print(f"✓ Запрос с нормализованным вектором выполнен")
-        print(f"  Найдено документов: {hits_count}")
-    except Exception as e:
-        print(f"⚠️  Ошибка: {e}")
+        logger.info("✓ Запрос с нормализованным вектором выполнен")
+        logger.info("  Найдено документов: %s", hits_count)
     
-    print()
-    print("="*80)
-    print("ДИАГНОСТИКА ЗАВЕРШЕНА")
-    print("="*80)
+    logger.info("")
+    logger.info("="*80)
+    logger.info("ДИАГНОСТИКА ЗАВЕРШЕНА")
+    logger.info("="*80)
 
 if __name__ == "__main__":
     main()
@@ -7,17 +7,26 @@
     python export_opensearch.py
 """
 
-import json
 import sys
 import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import orjson
 from opensearchpy import OpenSearch
-from typing import List, Dict, Any
+from opensearchpy.exceptions import SerializationError
+from opensearchpy.helpers import scan
+from opensearchpy.serializer import JSONSerializer
+from typing import List, Dict, Any, Optional
 
 # Конфигурация локального OpenSearch
 OPENSEARCH_HOST = os.environ.get('OPENSEARCH_HOST', 'localhost')
 OPENSEARCH_PORT = int(os.environ.get('OPENSEARCH_PORT', 9200))
 OPENSEARCH_USERNAME = os.environ.get('OPENSEARCH_USERNAME', 'admin')
 OPENSEARCH_PASSWORD = os.environ.get('OPENSEARCH_PASSWORD', 'Rodion1killer')
+# Размер пула соединений urllib3 (по умолчанию в opensearch-py - 10)
+OPENSEARCH_POOL_MAXSIZE = int(os.environ.get('OPENSEARCH_POOL_MAXSIZE', 32))
 
 # Индексы для экспорта
 INDICES_TO_EXPORT = ['feature_descriptions', 'rag_layers']
@@ -25,6 +34,75 @@ INDICES_TO_EXPORT = ['feature_descriptions', 'rag_layers']
 # Директория для экспорта
 EXPORT_DIR = 'opensearch_export'
 
+# Размер страницы scroll и максимальное количество параллельных срезов scroll
+EXPORT_SCROLL_SIZE = 1000
+EXPORT_MAX_SLICES = 8
+# Сколько страниц scroll может ждать записи (ограничивает память при медленном диске)
+EXPORT_QUEUE_SIZE = 4
+
+# Поля _source, не выгружаемые в файл (через запятую, например EXPORT_EXCLUDE=embedding):
+# вектор 1024 float занимает большую часть документа, а при миграции его можно
+# пересчитать; по умолчанию выгружается весь _source
+EXPORT_EXCLUDE = [field.strip() for field in os.environ.get('EXPORT_EXCLUDE', '').split(',') if field.strip()]
+
+# Маркер завершения среза scroll в очереди страниц
+_SLICE_DONE = object()
+
+
+class OrjsonSerializer(JSONSerializer):
+    """Сериализатор opensearch-py на orjson: быстрее разбирает страницы scroll."""
+
+    def loads(self, s):
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError as e:
+            raise SerializationError(s, e)
+
+    def dumps(self, data):
+        if isinstance(data, str):
+            return data
+        try:
+            # Типы, которые orjson не знает, обрабатывает JSONSerializer.default
+            return orjson.dumps(data, default=self.default,
+                                option=orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+        except TypeError as e:
+            raise SerializationError(data, e)
+
+
+# Один клиент (и пул соединений) на процесс: все вызовы используют общие соединения
+_CLIENT: Optional[OpenSearch] = None
+
+
+def get_opensearch_client() -> OpenSearch:
+    """Возвращает общий клиент OpenSearch (создается при первом вызове)."""
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = OpenSearch(
+            hosts=[{'host': OPENSEARCH_HOST, 'port': OPENSEARCH_PORT}],
+            http_auth=(OPENSEARCH_USERNAME, OPENSEARCH_PASSWORD),
+            use_ssl=True,
+            verify_certs=False,
+            timeout=60,
+            pool_maxsize=OPENSEARCH_POOL_MAXSIZE,
+            max_retries=3,
+            retry_on_timeout=True,
+            # gzip тел запросов и ответов: JSON с векторами float хорошо сжимается
+            http_compress=True,
+            serializer=OrjsonSerializer()
+        )
+    return _CLIENT
+
+
+def _reset_client() -> None:
+    """Инициализатор процесса-воркера: клиент (и его сокеты) не наследуется от родителя."""
+    global _CLIENT
+    _CLIENT = None
+
+
+def export_index_standalone(index_name: str, export_dir: str) -> bool:
+    """Экспорт индекса в отдельном процессе со своим клиентом OpenSearch."""
+    return export_index(get_opensearch_client(), index_name, export_dir)
+
 
 def export_index(client: OpenSearch, index_name: str, export_dir: str) -> bool:
     """
@@ -58,84 +136,97 @@ def export_index(client: OpenSearch, index_name: str, export_dir: str) -> bool:
         settings_response = client.indices.get_settings(index=index_name)
         settings = settings_response.get(index_name, {}).get('settings', {})
         
-        # Получаем все документы через scroll API
-        print(f"📦 Получение документов...")
-        all_docs = []
-        scroll_size = 1000
-        
-        # Начальный запрос
-        response = client.search(
-            index=index_name,
-            body={"query": {"match_all": {}}},
-            scroll='5m',
-            size=scroll_size
-        )
-        
-        scroll_id = response.get('_scroll_id')
-        hits = response['hits']['hits']
-        total_hits = response['hits']['total']
-        
-        # Обработка total (может быть int или dict с value)
-        if isinstance(total_hits, dict):
-            total_count = total_hits.get('value', 0)
-        else:
-            total_count = total_hits
+        # Документы пишутся в файл по мере получения страниц scroll API,
+        # а не накапливаются в памяти: формат файла тот же, что ожидает
+        # import_opensearch.py (mappings, settings, documents, total_documents)
+        filename = os.path.join(export_dir, f'{index_name}_export.json')
+        print(f"📦 Получение документов с записью в файл: {filename}")
         
+        total_count = client.count(index=index_name)['count']
         print(f"   Всего документов: {total_count}")
+        if EXPORT_EXCLUDE:
+            print(f"   Исключенные поля _source: {', '.join(EXPORT_EXCLUDE)}")
         
-        # Обработка первой партии
-        for hit in hits:
-            all_docs.append({
-                '_id': hit['_id'],
-                '_source': hit['_source']
-            })
+        # Срезы scroll (по одному на шард) читаются параллельно
+        num_shards = int(settings.get('index', {}).get('number_of_shards', 1))
+        num_slices = max(1, min(EXPORT_MAX_SLICES, num_shards))
         
-        processed = len(hits)
-        print(f"   Загружено: {processed}/{total_count}")
+        # Потоки scroll (производители) кладут страницы в ограниченную очередь,
+        # текущий поток сериализует и пишет их: загрузка следующей страницы
+        # идет параллельно с записью предыдущей
+        pages = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        stop = threading.Event()
+        processed = 0
         
-        # Продолжаем scroll пока есть результаты
-        while len(hits) > 0:
-            response = client.scroll(
-                scroll_id=scroll_id,
-                scroll='5m'
-            )
+        # orjson сразу выдает UTF-8 bytes, поэтому файл пишется в бинарном режиме
+        with open(filename, 'wb') as f:
+            f.write(b'{\n')
+            f.write(b'  "index_name": ' + orjson.dumps(index_name) + b',\n')
+            f.write(b'  "mappings": ' + orjson.dumps(mapping) + b',\n')
+            f.write(b'  "settings": ' + orjson.dumps(settings) + b',\n')
+            f.write(b'  "excluded_fields": ' + orjson.dumps(EXPORT_EXCLUDE) + b',\n')
+            f.write(b'  "documents": [')
             
-            scroll_id = response.get('_scroll_id')
-            hits = response['hits']['hits']
+            def write_hits(hits):
+                nonlocal processed
+                chunk = b',\n    '.join(
+                    orjson.dumps({'_id': hit['_id'], '_source': hit['_source']},
+                                 option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+                    for hit in hits
+                )
+                f.write(b',\n    ' if processed else b'\n    ')
+                f.write(chunk)
+                processed += len(hits)
+                print(f"   Загружено: {processed}/{total_count}")
             
-            for hit in hits:
-                all_docs.append({
-                    '_id': hit['_id'],
-                    '_source': hit['_source']
-                })
+            def export_slice(slice_id):
+                query = {"query": {"match_all": {}}}
+                if EXPORT_EXCLUDE:
+                    query["_source"] = {"excludes": EXPORT_EXCLUDE}
+                if num_slices > 1:
+                    query["slice"] = {"id": slice_id, "max": num_slices}
+                try:
+                    # scan сам продолжает scroll и очищает его контекст
+                    batch = []
+                    for hit in scan(client, index=index_name, query=query, scroll='5m',
+                                    size=EXPORT_SCROLL_SIZE, preserve_order=False):
+                        if stop.is_set():
+                            return
+                        batch.append(hit)
+                        if len(batch) >= EXPORT_SCROLL_SIZE:
+                            pages.put(batch)
+                            batch = []
+                    if batch:
+                        pages.put(batch)
+                finally:
+                    pages.put(_SLICE_DONE)
             
-            processed += len(hits)
-            if processed % 1000 == 0:
-                print(f"   Загружено: {processed}/{total_count}")
-        
-        # Очистка scroll контекста
-        if scroll_id:
-            try:
-                client.clear_scroll(scroll_id=scroll_id)
-            except:
-                pass
-        
-        print(f"✓ Загружено документов: {len(all_docs)}")
-        
-        # Сохраняем данные в файл
-        export_data = {
-            'index_name': index_name,
-            'mappings': mapping,
-            'settings': settings,
-            'documents': all_docs,
-            'total_documents': len(all_docs)
-        }
-        
-        filename = os.path.join(export_dir, f'{index_name}_export.json')
-        print(f"💾 Сохранение в файл: {filename}")
+            if num_slices > 1:
+                print(f"   Параллельных срезов scroll: {num_slices}")
+            with ThreadPoolExecutor(max_workers=num_slices) as executor:
+                futures = [executor.submit(export_slice, i) for i in range(num_slices)]
+                remaining = num_slices
+                try:
+                    while remaining:
+                        batch = pages.get()
+                        if batch is _SLICE_DONE:
+                            remaining -= 1
+                        else:
+                            write_hits(batch)
+                except BaseException:
+                    # Освобождаем очередь, чтобы производители не зависли на put
+                    stop.set()
+                    while remaining:
+                        if pages.get() is _SLICE_DONE:
+                            remaining -= 1
+                    raise
+                # result() пробрасывает исключения из потоков scroll
+                for future in futures:
+                    future.result()
+            
+            f.write(b'\n  ],\n  "total_documents": %d\n}\n' % processed)
         
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(export_data, f, ensure_ascii=False, indent=2)
+        print(f"✓ Загружено документов: {processed}")
         
         file_size = os.path.getsize(filename) / (1024 * 1024)  # MB
         print(f"✓ Файл сохранен: {file_size:.2f} MB")
@@ -165,13 +256,7 @@ def main():
     print(f"   SSL: {'True'}")
     
     try:
-        client = OpenSearch(
-            hosts=[{'host': OPENSEARCH_HOST, 'port': OPENSEARCH_PORT}],
-            http_auth=(OPENSEARCH_USERNAME, OPENSEARCH_PASSWORD),
-            use_ssl=True,
-            verify_certs=False,
-            timeout=60
-        )
+        client = get_opensearch_client()
         
         # Проверка подключения
         if not client.ping():
@@ -184,11 +269,14 @@ def main():
         print(f"❌ Ошибка подключения: {e}")
         sys.exit(1)
     
-    # Экспорт каждого индекса
-    results = {}
-    for index_name in INDICES_TO_EXPORT:
-        success = export_index(client, index_name, EXPORT_DIR)
-        results[index_name] = success
+    # Индексы независимы: каждый экспортируется в своем процессе
+    # (сериализация JSON занимает CPU и в потоках упирается в GIL)
+    max_workers = min(len(INDICES_TO_EXPORT), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_reset_client) as executor:
+        results = dict(zip(
+            INDICES_TO_EXPORT,
+            executor.map(partial(export_index_standalone, export_dir=EXPORT_DIR), INDICES_TO_EXPORT)
+        ))
     
     # Итоговая статистика
     print(f"\n{'='*60}")
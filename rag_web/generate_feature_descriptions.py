@@ -9,15 +9,19 @@
     - Установленный gigachat: pip install gigachat>=0.1.0
     - Установленный pandas: pip install pandas>=2.0.0
     - Установленный sentence-transformers: pip install sentence-transformers>=2.2.0
+    - Установленный orjson: pip install orjson>=3.9.0
     - Для Excel файла: pip install openpyxl (опционально)
-    - Переменная окружения GIGACHAT_CREDENTIALS или учетные данные в коде
+    - Переменная окружения GIGACHAT_CREDENTIALS
 
 Особенности:
-    - Автоматическое сохранение промежуточных результатов каждые 10 признаков
+    - Автоматическое сохранение промежуточных результатов каждые 32 признака
+      (дозапись в feature_descriptions_export.json.partial.jsonl)
     - Возможность возобновления обработки с определенного индекса (параметр start_from)
-    - Задержка между запросами для избежания rate limiting
+    - Параллельные запросы к GigaChat с ограничением частоты (избежание rate limiting)
     - Обработка ошибок и повторные попытки
-    - Генерация эмбеддингов для каждого описания
+    - Пакетная генерация эмбеддингов описаний
+    - Кэш описаний и эмбеддингов (descriptions_cache.sqlite): повторный запуск
+      не обращается к GigaChat за уже описанными признаками
 
 Выходные файлы:
     - opensearch_export/feature_descriptions_export.json - JSON для импорта в OpenSearch
@@ -25,16 +29,22 @@
     - opensearch_export/feature_descriptions.xlsx - Excel файл (опционально, если установлен openpyxl)
 """
 
-import json
+import csv
+import hashlib
+import orjson
 import pandas as pd
 import logging
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 from gigachat import GigaChat
 from sentence_transformers import SentenceTransformer
 import time
 import os
 import argparse
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import torch
 
 # Настройка логирования
 logging.basicConfig(
@@ -43,15 +53,46 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Учетные данные GigaChat
-GIGACHAT_CREDENTIALS = os.environ.get(
-    'GIGACHAT_CREDENTIALS',
-    "MDE5OWUyNTAtNGNhZS03ZDdjLTg2ZmMtZjM5NDE0ZGFhNjUzOmYzMTk3ZWUyLTBlNTYtNDUzNy04ZWViLTUyZWU4ZjAyZGMzZA=="
-)
+# Учетные данные GigaChat читаются из окружения (в коде не хранятся)
+GIGACHAT_CREDENTIALS = os.environ.get('GIGACHAT_CREDENTIALS', '')
+if not GIGACHAT_CREDENTIALS:
+    logger.warning("GIGACHAT_CREDENTIALS не задан в переменных окружения")
+
+# Модель GigaChat для генерации описаний
+GIGACHAT_MODEL = 'GigaChat-2-Pro'
 
 # Модель для генерации эмбеддингов
 EMBEDDING_MODEL_NAME = "ai-forever/sbert_large_nlu_ru"
 
+# Размер батча encode: описания векторизуются пачками, а не по одному.
+# Промежуточное сохранение выполняется после каждой пачки: encode сортирует
+# тексты пачки по длине, и чем больше пачка, тем меньше уходит на padding
+EMBEDDING_BATCH_SIZE = 32
+
+# Опции orjson для документов: векторы numpy float32 сериализуются напрямую
+# (без списка Python float) в кратчайшем виде для float32
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+# Суффикс файла промежуточных результатов (JSON Lines, один документ на строку):
+# каждое сохранение дописывает только новые документы, а не весь список
+CHECKPOINT_SUFFIX = '.partial.jsonl'
+
+# Колонки CSV/Excel с описаниями признаков
+CSV_COLUMNS = ['Название признака', 'Тип данных', 'Описание']
+
+# Кэш описаний (SQLite в директории результатов): ключ - хэш признака, типа,
+# текста промпта и модели GigaChat, поэтому повторный запуск не обращается
+# к GigaChat за уже описанными признаками, а правка промпта их обновляет
+DESCRIPTION_CACHE_FILE = 'descriptions_cache.sqlite'
+
+# Префикс описания, которое не удалось сгенерировать: такие описания не кэшируются,
+# не векторизуются и не попадают в экспорт (список - в FAILED_FEATURES_FILE)
+DESCRIPTION_ERROR_PREFIX = 'Ошибка генерации: '
+FAILED_FEATURES_FILE = 'failed_features.json'
+
+# Количество одновременных запросов к GigaChat (частоту ограничивает --delay)
+DEFAULT_GIGACHAT_WORKERS = 8
+
 # Промпт для генерации описания признака
 FEATURE_DESCRIPTION_PROMPT = """Ты - эксперт по геологическим признакам и нефтегазовой геологии Каспийского моря.
 
@@ -70,6 +111,27 @@ FEATURE_DESCRIPTION_PROMPT = """Ты - эксперт по геологичес
 Верни только описание без дополнительных комментариев."""
 
 
+class RequestRateLimiter:
+    """
+    Ограничение частоты запросов для нескольких потоков: запросы стартуют
+    не чаще одного раза в min_interval секунд (равномерно, без всплесков).
+    """
+    
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+    
+    def wait(self):
+        """Ожидание своего слота; ожидание выполняется вне блокировки."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
 def load_features_from_json(json_path: str) -> Dict[str, Dict]:
     """
     Загружает признаки из JSON файла.
@@ -82,36 +144,37 @@ def load_features_from_json(json_path: str) -> Dict[str, Dict]:
     """
     logger.info(f"Загрузка признаков из {json_path}...")
     
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    # Файл экспорта содержит все документы rag_layers: orjson разбирает его быстрее json
+    with open(json_path, 'rb') as f:
+        data = orjson.loads(f.read())
     
-    mappings = data.get('mappings', {})
-    properties = mappings.get('properties', {})
+    properties = data.get('mappings', {}).get('properties', {})
     
-    features = {}
-    for feature_name, feature_info in properties.items():
-        # Определяем тип данных
-        feature_type = feature_info.get('type', 'unknown')
-        if 'fields' in feature_info:
-            # Если есть keyword поле, это текстовое поле
-            feature_type = f"{feature_type} (keyword)"
-        
-        features[feature_name] = {
-            'type': feature_type,
-            'full_info': feature_info
+    # Тип данных; если есть keyword поле, это текстовое поле
+    features = {
+        feature_name: {
+            'type': feature_info.get('type', 'unknown') + (' (keyword)' if 'fields' in feature_info else '')
         }
+        for feature_name, feature_info in properties.items()
+    }
     
     logger.info(f"Загружено {len(features)} признаков")
     return features
 
 
-def generate_description_with_gigachat(feature_name: str, feature_type: str, max_retries: int = 3) -> str:
+def generate_description_with_gigachat(
+    feature_name: str,
+    feature_type: str,
+    giga: GigaChat,
+    max_retries: int = 3
+) -> str:
     """
     Генерирует описание признака через GigaChat.
     
     Args:
         feature_name: Название признака
         feature_type: Тип данных признака
+        giga: Клиент GigaChat (общий для всех признаков)
         max_retries: Максимальное количество попыток
         
     Returns:
@@ -124,43 +187,114 @@ def generate_description_with_gigachat(feature_name: str, feature_type: str, max
     
     for attempt in range(max_retries):
         try:
-            with GigaChat(
-                credentials=GIGACHAT_CREDENTIALS,
-                verify_ssl_certs=False,
-                scope='GIGACHAT_API_B2B',
-                model='GigaChat-2-Pro'
-            ) as giga:
-                response = giga.chat(prompt)
-                description = response.choices[0].message.content.strip()
-                logger.info(f"✓ Описание для '{feature_name}' сгенерировано")
-                return description
-                
+            response = giga.chat(prompt)
+            description = response.choices[0].message.content.strip()
+            logger.info(f"✓ Описание для '{feature_name}' сгенерировано")
+            return description
+            
         except Exception as e:
             logger.warning(f"Попытка {attempt + 1}/{max_retries} для '{feature_name}' не удалась: {e}")
             if attempt < max_retries - 1:
                 time.sleep(2 ** attempt)  # Экспоненциальная задержка
             else:
                 logger.error(f"Не удалось сгенерировать описание для '{feature_name}' после {max_retries} попыток")
-                return f"Ошибка генерации: {str(e)}"
+                return f"{DESCRIPTION_ERROR_PREFIX}{str(e)}"
+
+
+def description_cache_key(feature_name: str, feature_type: str) -> bytes:
+    """Ключ кэша описания: признак, тип, текст промпта и модель GigaChat."""
+    return hashlib.blake2b(
+        f"{feature_name}\0{feature_type}\0{GIGACHAT_MODEL}\0{FEATURE_DESCRIPTION_PROMPT}".encode('utf-8'),
+        digest_size=16
+    ).digest()
+
+
+def open_description_cache(cache_path: str) -> Tuple[sqlite3.Connection, Dict[bytes, Tuple[str, Optional[np.ndarray]]]]:
+    """
+    Открывает кэш описаний и загружает его в память.
+    
+    Args:
+        cache_path: Путь к файлу SQLite
+        
+    Returns:
+        Соединение и словарь {ключ: (описание, эмбеддинг или None)};
+        эмбеддинг другой модели считается отсутствующим
+    """
+    conn = sqlite3.connect(cache_path)
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS descriptions ('
+        'key BLOB PRIMARY KEY, description TEXT NOT NULL, embedding BLOB, embedding_model TEXT)'
+    )
+    cache = {}
+    for key, description, embedding, embedding_model in conn.execute(
+        'SELECT key, description, embedding, embedding_model FROM descriptions'
+    ):
+        vector = None
+        if embedding is not None and embedding_model == EMBEDDING_MODEL_NAME:
+            vector = np.frombuffer(embedding, dtype=np.float32)
+        cache[key] = (description, vector)
+    return conn, cache
 
 
-def generate_embedding(text: str, embedding_model: SentenceTransformer) -> List[float]:
+def generate_embeddings(texts: List[str], embedding_model: SentenceTransformer) -> Optional[np.ndarray]:
     """
-    Генерирует эмбеддинг для текста.
+    Генерирует эмбеддинги для списка текстов одним вызовом encode.
     
     Args:
-        text: Текст для векторизации
+        texts: Тексты для векторизации
         embedding_model: Модель для генерации эмбеддингов
         
     Returns:
-        Список чисел (вектор эмбеддинга)
+        Матрица float32 (строка на текст) или None при ошибке
     """
     try:
-        embedding = embedding_model.encode(text, convert_to_numpy=True, show_progress_bar=False)
-        return embedding.tolist()
+        embeddings = embedding_model.encode(
+            texts,
+            batch_size=EMBEDDING_BATCH_SIZE,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        return np.asarray(embeddings, dtype=np.float32)
     except Exception as e:
-        logger.error(f"Ошибка генерации эмбеддинга: {e}")
-        return []
+        logger.error(f"Ошибка генерации эмбеддингов: {e}")
+        return None
+
+
+def load_checkpoint(checkpoint_path: str) -> List[Dict[str, Any]]:
+    """
+    Загружает документы из файла промежуточных результатов (JSON Lines).
+    Оборванная последняя строка (прерывание во время записи) пропускается.
+    
+    Args:
+        checkpoint_path: Путь к файлу .partial.jsonl
+        
+    Returns:
+        Список документов
+    """
+    documents = []
+    with open(checkpoint_path, 'rb') as f:
+        for line in f:
+            try:
+                documents.append(orjson.loads(line))
+            except orjson.JSONDecodeError:
+                logger.warning(f"Пропущена поврежденная строка в {checkpoint_path}")
+    return documents
+
+
+def atomic_write(path: str, chunks) -> None:
+    """
+    Записывает файл через временный файл и os.replace: прерванная запись
+    (Ctrl+C, падение процесса) не портит существующий файл.
+    
+    Args:
+        path: Путь к файлу
+        chunks: Итерируемые фрагменты bytes
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
 
 
 def create_opensearch_mapping() -> Dict[str, Any]:
@@ -172,6 +306,14 @@ def create_opensearch_mapping() -> Dict[str, Any]:
     """
     return {
         "properties": {
+            # Название и тип признака - отдельные поля (в метаданных документа
+            # при поиске), текст - только описание, без повтора названия
+            "feature_name": {
+                "type": "keyword"
+            },
+            "feature_type": {
+                "type": "keyword"
+            },
             "text": {
                 "type": "text",
                 "fields": {
@@ -202,7 +344,9 @@ def process_all_features(
     delay_between_requests: float = 1.0,
     start_from: int = 0,
     save_csv: bool = True,
-    save_excel: bool = False
+    save_excel: bool = False,
+    max_workers: int = DEFAULT_GIGACHAT_WORKERS,
+    use_cache: bool = True
 ):
     """
     Обрабатывает все признаки и генерирует описания с эмбеддингами.
@@ -212,150 +356,259 @@ def process_all_features(
         output_json: Путь к выходному JSON файлу для OpenSearch
         output_csv: Путь к выходному CSV файлу (опционально)
         output_excel: Путь к выходному Excel файлу (опционально)
-        delay_between_requests: Задержка между запросами (секунды)
+        delay_between_requests: Минимальный интервал между началами запросов (секунды)
         start_from: Начать обработку с указанного индекса (для возобновления)
         save_csv: Сохранять ли CSV файл
         save_excel: Сохранять ли Excel файл
+        max_workers: Количество одновременных запросов к GigaChat
+        use_cache: Брать описания и эмбеддинги из кэша (иначе только обновлять кэш)
     """
-    # Инициализация модели эмбеддингов
-    logger.info(f"Загрузка модели эмбеддингов: {EMBEDDING_MODEL_NAME}...")
+    # Инициализация модели эмбеддингов: при наличии GPU - на нем в FP16,
+    # иначе на CPU в FP32 (FP16 на CPU медленнее)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    logger.info(f"Загрузка модели эмбеддингов: {EMBEDDING_MODEL_NAME} ({device})...")
     try:
-        embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=device)
+        if device == 'cuda':
+            embedding_model.half()
         logger.info("✓ Модель эмбеддингов загружена")
     except Exception as e:
         logger.error(f"Ошибка загрузки модели эмбеддингов: {e}")
         raise
     
-    # Загружаем существующие результаты, если файл существует
-    documents = []
-    csv_results = []
+    # Один клиент GigaChat на весь прогон: TLS сессия и токен доступа
+    # переиспользуются между признаками, а не создаются заново для каждого
+    giga = GigaChat(
+        credentials=GIGACHAT_CREDENTIALS,
+        verify_ssl_certs=False,
+        scope='GIGACHAT_API_B2B',
+        model=GIGACHAT_MODEL
+    )
+    # Описания запрашиваются параллельно (клиент GigaChat потокобезопасен),
+    # частота запросов ограничивается общим лимитером
+    limiter = RequestRateLimiter(delay_between_requests)
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gigachat')
     
-    if start_from > 0 and os.path.exists(output_json):
-        try:
-            with open(output_json, 'r', encoding='utf-8') as f:
-                existing_data = json.load(f)
-                documents = existing_data.get('documents', [])
-                logger.info(f"Загружено {len(documents)} существующих документов из {output_json}")
-        except Exception as e:
-            logger.warning(f"Не удалось загрузить существующие результаты: {e}")
-            documents = []
+    # Кэш описаний: чтение из словаря в памяти (потокобезопасно), запись - в текущем потоке
+    cache_path = os.path.join(os.path.dirname(os.path.abspath(output_json)), DESCRIPTION_CACHE_FILE)
+    cache_conn, cache = open_description_cache(cache_path)
+    if not use_cache:
+        cache = {}
+    logger.info(f"Описаний в кэше {cache_path}: {len(cache)}")
     
-    if start_from > 0 and save_csv and os.path.exists(output_csv):
-        try:
-            existing_df = pd.read_csv(output_csv, encoding='utf-8-sig')
-            csv_results = existing_df.to_dict('records')
-            logger.info(f"Загружено {len(csv_results)} существующих результатов из {output_csv}")
-        except Exception as e:
-            logger.warning(f"Не удалось загрузить существующие CSV результаты: {e}")
-            csv_results = []
+    def describe(item):
+        """Возвращает (ключ кэша, описание, эмбеддинг из кэша или None)."""
+        feature_name, feature_info = item
+        key = description_cache_key(feature_name, feature_info['type'])
+        cached = cache.get(key)
+        if cached is not None:
+            return (key,) + cached
+        limiter.wait()
+        return key, generate_description_with_gigachat(feature_name, feature_info['type'], giga), None
     
-    total_features = len(features)
-    logger.info(f"Начинаю обработку {total_features} признаков (начиная с индекса {start_from})...")
+    checkpoint_path = output_json + CHECKPOINT_SUFFIX
+    checkpoint_file = None
+    csv_file = None
     
-    feature_list = list(features.items())
-    
-    for idx, (feature_name, feature_info) in enumerate(feature_list):
-        if idx < start_from:
-            continue
-            
-        logger.info(f"[{idx + 1}/{total_features}] Обработка признака: '{feature_name}'")
+    try:
+        # Загружаем существующие результаты, если файл существует
+        # (CSV не загружается: новые строки дописываются в конец файла)
+        documents = []
+        excel_rows = []
         
-        feature_type = feature_info['type']
+        if start_from > 0 and os.path.exists(checkpoint_path):
+            try:
+                documents = load_checkpoint(checkpoint_path)
+                logger.info(f"Загружено {len(documents)} существующих документов из {checkpoint_path}")
+            except Exception as e:
+                logger.warning(f"Не удалось загрузить промежуточные результаты: {e}")
+                documents = []
+        elif start_from > 0 and os.path.exists(output_json):
+            try:
+                with open(output_json, 'rb') as f:
+                    existing_data = orjson.loads(f.read())
+                    documents = existing_data.get('documents', [])
+                    logger.info(f"Загружено {len(documents)} существующих документов из {output_json}")
+            except Exception as e:
+                logger.warning(f"Не удалось загрузить существующие результаты: {e}")
+                documents = []
         
-        # Генерация описания через GigaChat
-        description = generate_description_with_gigachat(feature_name, feature_type)
+        if save_csv:
+            # При возобновлении строки дописываются, заголовок - только в новый файл
+            csv_file = open(output_csv, 'a' if start_from > 0 else 'w', newline='', encoding='utf-8-sig')
+            csv_writer = csv.writer(csv_file)
+            if csv_file.tell() == 0:
+                csv_writer.writerow(CSV_COLUMNS)
         
-        # Формируем полный текст для эмбеддинга (как в feature_descriptions)
-        full_text = f"Признак: {feature_name}\nОписание: {description}"
+        # Файл промежуточных результатов начинается с уже загруженных документов,
+        # дальше в него только дописываются новые
+        atomic_write(
+            checkpoint_path,
+            (orjson.dumps(document, option=ORJSON_OPTIONS) + b'\n' for document in documents)
+        )
+        checkpoint_file = open(checkpoint_path, 'ab')
         
-        # Генерация эмбеддинга
-        logger.info(f"  Генерация эмбеддинга для '{feature_name}'...")
-        embedding = generate_embedding(description, embedding_model)  # Используем только описание для эмбеддинга
+        total_features = len(features)
+        logger.info(f"Начинаю обработку {total_features} признаков (начиная с индекса {start_from})...")
         
-        # Создаем документ для OpenSearch
-        document = {
-            "_id": str(idx),
-            "_source": {
-                "text": full_text,
-                "embedding": embedding
-            }
-        }
-        documents.append(document)
+        feature_list = list(features.items())
+        
+        # Документы текущей пачки: при накоплении EMBEDDING_BATCH_SIZE (и в конце)
+        # недостающие эмбеддинги вычисляются одним вызовом, новые описания
+        # сохраняются в кэш, документы дописываются в файл промежуточных результатов
+        pending_documents = []
+        pending_to_embed = []  # (документ, описание, ключ кэша) без эмбеддинга из кэша
+        pending_csv_rows = []
+        
+        def flush_embeddings():
+            # Строки CSV пишутся вместе с документами, чтобы файлы не расходились
+            if csv_file is not None and pending_csv_rows:
+                csv_writer.writerows(pending_csv_rows)
+                csv_file.flush()
+            pending_csv_rows.clear()
+            if not pending_documents:
+                return
+            if pending_to_embed:
+                logger.info(f"  Генерация эмбеддингов для {len(pending_to_embed)} описаний...")
+                embeddings = generate_embeddings(
+                    [description for _, description, _ in pending_to_embed], embedding_model
+                )
+                cache_rows = []
+                for row, (document, description, key) in enumerate(pending_to_embed):
+                    # Строка матрицы хранится как есть; при ошибке остается пустой вектор
+                    embedding = embeddings[row] if embeddings is not None else None
+                    if embedding is not None:
+                        document["_source"]["embedding"] = embedding
+                    cache_rows.append((
+                        key,
+                        description,
+                        embedding.tobytes() if embedding is not None else None,
+                        EMBEDDING_MODEL_NAME
+                    ))
+                cache_conn.executemany('INSERT OR REPLACE INTO descriptions VALUES (?, ?, ?, ?)', cache_rows)
+                cache_conn.commit()
+            for document in pending_documents:
+                checkpoint_file.write(orjson.dumps(document, option=ORJSON_OPTIONS) + b'\n')
+            checkpoint_file.flush()
+            pending_documents.clear()
+            pending_to_embed.clear()
         
-        # Для CSV/Excel
-        if save_csv or save_excel:
-            csv_results.append({
-                'Название признака': feature_name,
-                'Тип данных': feature_type,
-                'Описание': description
-            })
+        # map возвращает описания в исходном порядке признаков, поэтому
+        # промежуточные сохранения и --start-from работают как раньше
+        remaining = feature_list[start_from:]
+        descriptions = executor.map(describe, remaining)
         
-        # Сохраняем промежуточные результаты каждые 10 признаков
-        if (idx + 1) % 10 == 0:
-            # Сохраняем JSON
-            export_data = {
-                "index_name": "feature_descriptions",
-                "mappings": create_opensearch_mapping(),
-                "settings": {},
-                "documents": documents,
-                "total_documents": len(documents)
+        for idx, ((feature_name, feature_info), (key, description, cached_embedding)) in enumerate(
+            zip(remaining, descriptions), start=start_from
+        ):
+            logger.info(f"[{idx + 1}/{total_features}] Обработка признака: '{feature_name}'")
+            
+            feature_type = feature_info['type']
+            
+            # Создаем документ для OpenSearch (эмбеддинг берется из кэша или добавляется пачкой)
+            document = {
+                "_id": str(idx),
+                "_source": {
+                    "feature_name": feature_name,
+                    "feature_type": feature_type,
+                    "text": description,
+                    "embedding": cached_embedding if cached_embedding is not None else []
+                }
             }
-            with open(output_json, 'w', encoding='utf-8') as f:
-                json.dump(export_data, f, ensure_ascii=False, indent=2)
-            logger.info(f"Промежуточное сохранение JSON: обработано {len(documents)} признаков")
+            documents.append(document)
+            pending_documents.append(document)
+            if description.startswith(DESCRIPTION_ERROR_PREFIX):
+                # Текст ошибки не векторизуется; признак помечается для повторной генерации
+                document["status"] = "failed"
+            elif cached_embedding is None:
+                # Используем только описание для эмбеддинга
+                pending_to_embed.append((document, description, key))
             
-            # Сохраняем CSV если нужно
+            # Для CSV/Excel
+            row = [feature_name, feature_type, description]
             if save_csv:
-                df = pd.DataFrame(csv_results)
-                df.to_csv(output_csv, index=False, encoding='utf-8-sig')
-                logger.info(f"Промежуточное сохранение CSV: обработано {len(csv_results)} признаков")
+                pending_csv_rows.append(row)
+            if save_excel and not save_csv:
+                excel_rows.append(row)
+            
+            # Сохраняем промежуточные результаты после каждой пачки эмбеддингов
+            if len(pending_documents) >= EMBEDDING_BATCH_SIZE:
+                flush_embeddings()
+                logger.info(f"Промежуточное сохранение {checkpoint_path}: обработано {len(documents)} признаков")
         
-        # Задержка между запросами
-        if idx < total_features - 1:
-            time.sleep(delay_between_requests)
-    
-    # Финальное сохранение JSON
-    logger.info(f"Сохранение результатов в {output_json}...")
-    export_data = {
-        "index_name": "feature_descriptions",
-        "mappings": create_opensearch_mapping(),
-        "settings": {},
-        "documents": documents,
-        "total_documents": len(documents)
-    }
-    with open(output_json, 'w', encoding='utf-8') as f:
-        json.dump(export_data, f, ensure_ascii=False, indent=2)
-    logger.info(f"✓ JSON файл сохранен: {output_json}")
-    logger.info(f"  Всего документов: {len(documents)}")
-    
-    # Сохранение CSV (если нужно)
-    if save_csv:
-        df = pd.DataFrame(csv_results)
-        logger.info(f"Сохранение результатов в {output_csv}...")
-        df.to_csv(output_csv, index=False, encoding='utf-8-sig')
-        logger.info(f"✓ CSV файл сохранен: {output_csv}")
-    
-    # Сохранение в Excel (если нужно и установлен openpyxl)
-    if save_excel:
-        try:
-            import openpyxl
-            logger.info(f"Сохранение результатов в {output_excel}...")
-            df = pd.DataFrame(csv_results)
-            with pd.ExcelWriter(output_excel, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='Описания признаков')
-                
-                # Автоматическая настройка ширины колонок
-                worksheet = writer.sheets['Описания признаков']
-                worksheet.column_dimensions['A'].width = 30  # Название признака
-                worksheet.column_dimensions['B'].width = 20  # Тип данных
-                worksheet.column_dimensions['C'].width = 80  # Описание
-                
-            logger.info(f"✓ Excel файл сохранен: {output_excel}")
-        except ImportError:
-            logger.warning("openpyxl не установлен. Excel файл не будет создан.")
-            logger.info("Для создания Excel файла установите: pip install openpyxl")
-    
-    logger.info(f"Всего обработано: {len(documents)} признаков")
+        # Финальное сохранение JSON (один раз и без отступов: векторы
+        # с indent=2 занимают в несколько раз больше места)
+        flush_embeddings()
+        
+        # Признаки без описания не попадают в индекс, а сохраняются отдельно
+        # (повторный запуск сгенерирует только их: остальные описания в кэше)
+        failed = [document for document in documents if document.get("status") == "failed"]
+        if failed:
+            documents = [document for document in documents if document.get("status") != "failed"]
+            failed_path = os.path.join(os.path.dirname(os.path.abspath(output_json)), FAILED_FEATURES_FILE)
+            atomic_write(failed_path, [orjson.dumps([{
+                "_id": document["_id"],
+                "feature_name": document["_source"].get("feature_name"),
+                "feature_type": document["_source"].get("feature_type"),
+                "error": document["_source"]["text"]
+            } for document in failed], option=orjson.OPT_INDENT_2)])
+            logger.warning(f"Не удалось описать {len(failed)} признаков, список: {failed_path}")
+        
+        logger.info(f"Сохранение результатов в {output_json}...")
+        export_data = {
+            "index_name": "feature_descriptions",
+            "mappings": create_opensearch_mapping(),
+            "settings": {},
+            "documents": documents,
+            "total_documents": len(documents)
+        }
+        atomic_write(output_json, [orjson.dumps(export_data, option=ORJSON_OPTIONS)])
+        logger.info(f"✓ JSON файл сохранен: {output_json}")
+        logger.info(f"  Всего документов: {len(documents)}")
+        
+        # Итоговый файл записан - промежуточные результаты больше не нужны
+        checkpoint_file.close()
+        os.remove(checkpoint_path)
+        
+        # CSV уже дописан по мере обработки
+        if save_csv:
+            csv_file.close()
+            logger.info(f"✓ CSV файл сохранен: {output_csv}")
+        
+        # Сохранение в Excel (если нужно и установлен openpyxl)
+        if save_excel:
+            try:
+                import openpyxl
+                logger.info(f"Сохранение результатов в {output_excel}...")
+                # Все строки (включая предыдущие запуски) есть в CSV, иначе - только текущие
+                if save_csv:
+                    df = pd.read_csv(output_csv, encoding='utf-8-sig')
+                else:
+                    df = pd.DataFrame(excel_rows, columns=CSV_COLUMNS)
+                with pd.ExcelWriter(output_excel, engine='openpyxl') as writer:
+                    df.to_excel(writer, index=False, sheet_name='Описания признаков')
+                    
+                    # Автоматическая настройка ширины колонок
+                    worksheet = writer.sheets['Описания признаков']
+                    worksheet.column_dimensions['A'].width = 30  # Название признака
+                    worksheet.column_dimensions['B'].width = 20  # Тип данных
+                    worksheet.column_dimensions['C'].width = 80  # Описание
+                    
+                logger.info(f"✓ Excel файл сохранен: {output_excel}")
+            except ImportError:
+                logger.warning("openpyxl не установлен. Excel файл не будет создан.")
+                logger.info("Для создания Excel файла установите: pip install openpyxl")
+        
+        logger.info(f"Всего обработано: {len(documents)} признаков")
+    finally:
+        # Незапущенные запросы отменяются (например, при Ctrl+C), выполняющиеся - дожидаются
+        executor.shutdown(wait=True, cancel_futures=True)
+        giga.close()
+        cache_conn.close()
+        if checkpoint_file is not None:
+            checkpoint_file.close()
+        if csv_file is not None:
+            csv_file.close()
 
 
 def main():
@@ -375,6 +628,17 @@ def main():
         default=1.0,
         help='Задержка между запросами в секундах (по умолчанию: 1.0)'
     )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=DEFAULT_GIGACHAT_WORKERS,
+        help=f'Количество одновременных запросов к GigaChat (по умолчанию: {DEFAULT_GIGACHAT_WORKERS})'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Не брать описания из кэша, сгенерировать заново (кэш обновляется)'
+    )
     parser.add_argument(
         '--json-path',
         type=str,
@@ -434,6 +698,7 @@ def main():
     logger.info(f"Всего признаков для обработки: {len(features)}")
     logger.info(f"Начинаю с индекса: {args.start_from}")
     logger.info(f"Задержка между запросами: {args.delay} сек")
+    logger.info(f"Параллельных запросов: {args.workers}")
     logger.info(f"Сохранять CSV: {args.save_csv}")
     logger.info(f"Сохранять Excel: {args.save_excel}")
     
@@ -447,14 +712,16 @@ def main():
             delay_between_requests=args.delay,
             start_from=args.start_from,
             save_csv=args.save_csv,
-            save_excel=args.save_excel
+            save_excel=args.save_excel,
+            max_workers=args.workers,
+            use_cache=not args.no_cache
         )
         logger.info("✓ Обработка завершена успешно!")
         logger.info(f"✓ JSON файл для OpenSearch: {output_json}")
         
     except KeyboardInterrupt:
         logger.warning("Обработка прервана пользователем")
-        logger.info(f"Промежуточные результаты сохранены в {output_json}")
+        logger.info(f"Промежуточные результаты сохранены в {output_json}{CHECKPOINT_SUFFIX}")
         logger.info(f"Для возобновления используйте: --start-from <номер_последнего_обработанного_признака>")
     except Exception as e:
         logger.error(f"Ошибка при обработке: {e}", exc_info=True)
@@ -94,6 +94,11 @@ def import_index(client: OpenSearch, index_name: str, export_dir: str, overwrite
         
         print(f"   Документов в файле: {total_docs}")
         
+        # Экспорт с EXPORT_EXCLUDE не содержит части полей (например, векторов)
+        excluded_fields = export_data.get('excluded_fields', [])
+        if excluded_fields:
+            print(f"⚠️  В экспорте отсутствуют поля: {', '.join(excluded_fields)} - их нужно пересчитать после импорта")
+        
         # Проверка существования индекса
         if client.indices.exists(index=index_name):
             if overwrite:
@@ -372,7 +377,9 @@ def main():
             http_auth=auth,
             use_ssl=OPENSEARCH_USE_SSL,
             verify_certs=OPENSEARCH_VERIFY_CERTS,
-            timeout=60
+            timeout=60,
+            # gzip тел запросов и ответов: JSON с векторами float хорошо сжимается
+            http_compress=True
         )
         
         # Проверка подключения
@@ -11,23 +11,35 @@ RAG система через LangChain для поиска геологичес
 7. Подводим итоги через GigaChat (роль: преподаватель)
 """
 
+import ast
+import json
 import logging
+import re
+import string
+import threading
+import time
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Optional, Tuple, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Optional, Tuple, Any, Union, Callable
 from langchain_core.documents import Document
 from opensearchpy import OpenSearch
 from gigachat import GigaChat
+from gigachat.exceptions import AuthenticationError
 from sentence_transformers import SentenceTransformer
 import duckdb
 from prompts import (
     FEATURE_DESCRIPTION_PROMPT,
-    FEATURE_MATCH_PROMPT,
+    FEATURE_MATCH_SYSTEM_PROMPT,
+    FEATURE_MATCH_USER_PROMPT,
+    FEATURE_MATCH_BATCH_SYSTEM_PROMPT,
+    FEATURE_MATCH_BATCH_USER_PROMPT,
+    FEATURE_MATCH_BATCH_ITEM,
     SQL_GENERATION_PROMPT,
     SQL_FIX_PROMPT,
     SQL_FIX_PROMPT_V2,
     FINAL_SUMMARY_PROMPT
 )
-GIGACHAT_CREDENTIALS = "MDE5OWUyNTAtNGNhZS03ZDdjLTg2ZmMtZjM5NDE0ZGFhNjUzOmYzMTk3ZWUyLTBlNTYtNDUzNy04ZWViLTUyZWU4ZjAyZGMzZA=="
 # Импорт модуля статистики токенов
 try:
     import sys
@@ -37,18 +49,29 @@ try:
     if os.path.exists(rag_api_path):
         sys.path.insert(0, os.path.dirname(rag_api_path))
         from rag_api.token_stats import record_from_response, save_stats_to_file
+        from rag_api.semantic_cache import SemanticCache
+        from rag_api.fast_agg import summarize_numeric_by_group
+        from rag_api.embed_cache import encode_cached
     else:
         # Если модуль недоступен, создаем заглушки
         def record_from_response(model, response):
             pass
         def save_stats_to_file():
             pass
+        SemanticCache = None
+        summarize_numeric_by_group = None
+        def encode_cached(model, text):
+            return model.encode(text)
 except ImportError:
     # Если импорт не удался, создаем заглушки
     def record_from_response(model, response):
         pass
     def save_stats_to_file():
         pass
+    SemanticCache = None
+    summarize_numeric_by_group = None
+    def encode_cached(model, text):
+        return model.encode(text)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -56,6 +79,265 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Учетные данные GigaChat читаются из окружения (в коде не хранятся)
+GIGACHAT_CREDENTIALS = os.environ.get('GIGACHAT_CREDENTIALS', '')
+if not GIGACHAT_CREDENTIALS:
+    logger.warning("GIGACHAT_CREDENTIALS не задан в переменных окружения")
+
+# Паттерны для разбора ошибок DuckDB (компилируются один раз при импорте)
+_CANDIDATE_BINDINGS_RE = re.compile(r'Candidate bindings:\s*([^\n]+)')
+_QUOTED_NAME_RE = re.compile(r'"([^"]+)"')
+
+# JSON массив в ответе пакетной проверки признаков (ответ может быть обернут в markdown)
+_JSON_ARRAY_RE = re.compile(r'\[[^\[\]]*\]')
+
+# Служебные колонки, которые не являются геологическими признаками
+_SERVICE_COLUMNS = {'_id', 'lon', 'lat', 'layer_name', 'matched_feature'}
+
+# Значения координат, которые считаются отсутствующими
+_MISSING_COORDINATE_STRINGS = ['', 'nan', 'None']
+
+# Типы пространства векторов OpenSearch, для которых вектор запроса нормализуется
+_UNIT_VECTOR_SPACE_TYPES = frozenset(('cosinesimil', 'cosinesimilarity', 'innerproduct'))
+
+# Колонки, из которых составляется подпись точки на карте
+_COORDINATE_INFO_COLUMNS = ('layer_name', 'Регион', 'Свита', 'Пласт', 'matched_feature')
+
+_literal_eval = ast.literal_eval
+
+# Максимальное количество строк результатов, передаваемых в промпт
+PROMPT_ROW_BUDGET = 50
+
+# Начиная с этого количества строк в промпт добавляется сводка по всем записям
+PROMPT_SUMMARY_MIN_ROWS = 100
+
+# Как часто (в секундах) проверять, не изменились ли индексы OpenSearch,
+# чтобы сбросить семантический кэш
+INDEX_VERSION_CHECK_INTERVAL = 60
+
+# Количество параллельных проверок признаков для одного запроса
+# (используются, если пакетная проверка не удалась)
+FEATURE_CHECK_WORKERS = 8
+
+# Максимальное количество признаков в одном запросе пакетной проверки
+FEATURE_CHECK_BATCH_SIZE = 30
+
+# Отсечение кандидатов OpenSearch по оценке перед проверкой через GigaChat:
+# оценка переводится обратно в косинус (скалярное произведение), и остаются
+# документы со значением не ниже SCORE_CUTOFF_RATIO от лучшего. Если после
+# отсечения осталось меньше SCORE_CUTOFF_MIN_KEPT, берутся SCORE_CUTOFF_FALLBACK_TOP лучших
+SCORE_CUTOFF_RATIO = 0.6
+SCORE_CUTOFF_MIN_KEPT = 3
+SCORE_CUTOFF_FALLBACK_TOP = 5
+
+# Ограничение одновременных запросов к GigaChat со всех потоков (лимиты API)
+GIGACHAT_MAX_CONCURRENCY = 8
+
+# Размер пула соединений к OpenSearch: клиент общий для всех потоков веб-сервера,
+# при пуле по умолчанию (10) лишние соединения закрываются и открываются заново
+OPENSEARCH_POOL_MAXSIZE = 32
+
+
+def _compile_template(template: str) -> Tuple[Tuple[str, Optional[str]], ...]:
+    """
+    Однократный разбор шаблона промпта на литералы и имена подстановок.
+    
+    Args:
+        template: Шаблон в формате str.format
+        
+    Returns:
+        Кортеж пар (литерал, имя поля или None)
+    """
+    return tuple(
+        (literal, field_name)
+        for literal, field_name, _, _ in string.Formatter().parse(template)
+    )
+
+
+def _render_template(parts: Tuple[Tuple[str, Optional[str]], ...], **values: str) -> str:
+    """
+    Подстановка значений в разобранный шаблон без повторного разбора.
+    
+    Args:
+        parts: Результат _compile_template
+        **values: Значения подстановок
+        
+    Returns:
+        Готовый промпт
+    """
+    chunks = []
+    for literal, field_name in parts:
+        chunks.append(literal)
+        if field_name is not None:
+            chunks.append(str(values[field_name]))
+    return ''.join(chunks)
+
+
+# План попыток генерации SQL: шаблон промпта для каждой попытки по порядку
+# (генерация, исправление ошибки, исправление с учетом всей истории ошибок).
+# Если попыток больше, чем шаблонов, используется последний
+_SQL_ATTEMPT_PROMPTS = (SQL_GENERATION_PROMPT, SQL_FIX_PROMPT, SQL_FIX_PROMPT_V2)
+
+# Шаблоны промптов, вызываемых на каждый запрос, разбираются один раз при импорте
+_FEATURE_DESCRIPTION_PARTS = _compile_template(FEATURE_DESCRIPTION_PROMPT)
+_FINAL_SUMMARY_PARTS = _compile_template(FINAL_SUMMARY_PROMPT)
+
+
+def _system_user_chat(system_prompt: str, user_prompt: str) -> Dict[str, Any]:
+    """
+    Запрос к GigaChat из системного сообщения (неизменная инструкция) и
+    сообщения пользователя (данные конкретного запроса).
+    
+    Args:
+        system_prompt: Инструкция, одинаковая для всех вызовов
+        user_prompt: Изменяемая часть запроса
+        
+    Returns:
+        Словарь запроса в формате Chat
+    """
+    return {
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+    }
+
+
+def _format_results_for_prompt(results_df: pd.DataFrame) -> str:
+    """
+    Компактное представление результатов для промпта GigaChat.
+    
+    Берется не более PROMPT_ROW_BUDGET строк (по убыванию _score, если он есть),
+    колонки, заполненные менее чем на 10%, отбрасываются, числа округляются
+    до 3 знаков. Вместо выровненного пробелами to_string используется CSV
+    с разделителем "|" - он дешевле в формировании и короче в токенах.
+    
+    Для больших результатов (от PROMPT_SUMMARY_MIN_ROWS строк) добавляется
+    сводка min/max/среднее числовых колонок по слоям, чтобы модель видела
+    все записи, а не только показанные строки.
+    
+    Args:
+        results_df: DataFrame с результатами
+        
+    Returns:
+        Текст с данными для промпта
+    """
+    total_rows = len(results_df)
+    if '_score' in results_df.columns:
+        prompt_df = results_df.nlargest(PROMPT_ROW_BUDGET, '_score')
+    else:
+        prompt_df = results_df.head(PROMPT_ROW_BUDGET)
+    
+    prompt_df = prompt_df.dropna(axis=1, thresh=max(1, int(0.1 * len(prompt_df))))
+    numeric_columns = prompt_df.select_dtypes(include='number').columns
+    if len(numeric_columns) > 0:
+        prompt_df = prompt_df.round({col: 3 for col in numeric_columns})
+    
+    data = prompt_df.to_csv(index=False, sep='|', lineterminator='\n')
+    if total_rows > PROMPT_ROW_BUDGET:
+        data = f"Найдено {total_rows} записей. Показаны первые {PROMPT_ROW_BUDGET}:\n\n{data}"
+    
+    if total_rows >= PROMPT_SUMMARY_MIN_ROWS and summarize_numeric_by_group is not None:
+        group_column = next(
+            (col for col in ('layer_name', 'matched_feature') if col in results_df.columns),
+            None
+        )
+        if group_column is not None:
+            summary_df = summarize_numeric_by_group(
+                results_df, group_column, exclude=_SERVICE_COLUMNS | {'_score'}
+            )
+            if not summary_df.empty:
+                summary = summary_df.round(3).to_csv(index=False, sep='|', lineterminator='\n')
+                data += f"\nСводка по всем {total_rows} записям (по {group_column}):\n{summary}"
+    return data
+
+
+def _parse_array_element(value: str, take_last: bool, default: str) -> str:
+    """Разбор строки-массива через ast.literal_eval (медленный запасной путь)."""
+    try:
+        array = _literal_eval(value)
+    except Exception:
+        return default
+    if isinstance(array, list) and len(array) > 0:
+        return str(array[-1] if take_last else array[0])
+    return default
+
+
+def _extract_coordinate_strings(values: pd.Series, take_last: bool) -> pd.Series:
+    """
+    Векторизованное извлечение координаты из колонки lon/lat.
+    
+    Значения вида "[49.1, 50.2]" сводятся к одному элементу: первому для долготы,
+    последнему для широты. ast.literal_eval используется только для элементов,
+    которые не удалось разобрать как число.
+    
+    Args:
+        values: Колонка с координатами
+        take_last: Брать последний элемент массива (для широты)
+        
+    Returns:
+        Series строковых координат (NaN для отсутствующих значений)
+    """
+    result = values.astype(str).str.strip()
+    is_array = result.str.startswith('[')
+    
+    if is_array.any():
+        raw = result[is_array]
+        parts = raw.str.strip('[]').str.split(',')
+        picked = (parts.str[-1] if take_last else parts.str[0]).str.strip()
+        
+        not_numeric = pd.to_numeric(picked, errors='coerce').isna()
+        if not_numeric.any():
+            picked[not_numeric] = [
+                _parse_array_element(value, take_last, default)
+                for value, default in zip(raw[not_numeric].tolist(), picked[not_numeric].tolist())
+            ]
+        result[is_array] = picked
+    
+    return result.where(values.notna())
+
+
+def _is_list_column(values: pd.Series) -> bool:
+    """Проверка, хранятся ли в колонке уже разобранные массивы (list/tuple/ndarray)."""
+    first_valid = values.first_valid_index()
+    return first_valid is not None and isinstance(values[first_valid], (list, tuple, np.ndarray))
+
+
+def _pick_list_element(value: Any, take_last: bool) -> float:
+    """Первый (или последний) элемент массива координат как float, NaN при ошибке."""
+    if isinstance(value, (list, tuple, np.ndarray)):
+        if len(value) == 0:
+            return np.nan
+        value = value[-1] if take_last else value[0]
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _flatten_list_coordinates(results_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Приведение колонок lon/lat с массивами к числовым колонкам.
+    
+    Если OpenSearch вернул координаты массивами, элементы берутся напрямую
+    (долгота - первый элемент, широта - последний), без преобразования
+    в строку и обратного разбора через ast.literal_eval.
+    
+    Args:
+        results_df: DataFrame с колонками lon и lat
+        
+    Returns:
+        DataFrame с числовыми lon/lat (исходный, если массивов нет)
+    """
+    if 'lon' not in results_df.columns or 'lat' not in results_df.columns:
+        return results_df
+    if not (_is_list_column(results_df['lon']) or _is_list_column(results_df['lat'])):
+        return results_df
+    return results_df.assign(
+        lon=[_pick_list_element(value, False) for value in results_df['lon'].tolist()],
+        lat=[_pick_list_element(value, True) for value in results_df['lat'].tolist()]
+    )
+
 
 class RAGSystemLangChain:
     """
@@ -72,7 +354,9 @@ class RAGSystemLangChain:
         opensearch_index_descriptions: str = "feature_descriptions",
         opensearch_index_layers: str = "rag_layers",
         embedding_model_name: str = "ai-forever/sbert_large_nlu_ru",
-        credentials: str = GIGACHAT_CREDENTIALS
+        credentials: str = GIGACHAT_CREDENTIALS,
+        use_semantic_cache: bool = True,
+        semantic_cache_ttl: float = 3600
     ):
         """
         Инициализация RAG системы.
@@ -87,8 +371,19 @@ class RAGSystemLangChain:
             opensearch_index_layers: Имя индекса с геологическими данными (rag_layers)
             embedding_model_name: Название модели для эмбеддингов
             credentials: Учетные данные GigaChat
+            use_semantic_cache: Кэшировать ответы для семантически близких запросов
+            semantic_cache_ttl: Время жизни записи семантического кэша в секундах
         """
         self.credentials = credentials
+        # Состояние последней ошибки SQL хранится отдельно для каждого потока,
+        # так как SQL запросы для разных признаков выполняются параллельно
+        self._sql_state = threading.local()
+        
+        # Долгоживущий клиент GigaChat: OAuth токен и HTTPS соединение
+        # переиспользуются между вызовами вместо открытия сессии на каждый запрос
+        self._giga_lock = threading.Lock()
+        self._giga_semaphore = threading.BoundedSemaphore(GIGACHAT_MAX_CONCURRENCY)
+        self._giga = self._create_giga_client()
         self.opensearch_index_descriptions = opensearch_index_descriptions
         self.opensearch_index_layers = opensearch_index_layers
         
@@ -104,8 +399,11 @@ class RAGSystemLangChain:
             timeout=60,  # Увеличиваем таймаут
             max_retries=5,  # Больше попыток
             retry_on_timeout=True,
-            ssl_show_warn=False  # Отключаем предупреждения SSL
+            ssl_show_warn=False,  # Отключаем предупреждения SSL
+            pool_maxsize=OPENSEARCH_POOL_MAXSIZE
         )
+        # Поля mapping по индексам (один запрос get_mapping на индекс)
+        self._index_properties: Dict[str, Dict[str, Any]] = {}
         
         # Проверка подключения с повторными попытками
         max_ping_attempts = 3
@@ -144,7 +442,11 @@ class RAGSystemLangChain:
             self.text_field_name = "text"
             logger.warning("Используются значения по умолчанию для полей векторов и текста")
         
-        # Инициализация модели эмбеддингов (используем SentenceTransformer напрямую)
+        # Тип пространства векторов индекса описаний (определяется один раз при первом поиске)
+        self._vector_space_type: Optional[str] = None
+        
+        # Инициализация модели эмбеддингов (используем SentenceTransformer напрямую).
+        # Модель загружается один раз и переиспользуется всеми поисками и семантическим кэшем
         logger.info(f"Загрузка модели эмбеддингов: {embedding_model_name}")
         self.embedding_model = SentenceTransformer(embedding_model_name)
         
@@ -161,8 +463,152 @@ class RAGSystemLangChain:
             logger.warning("Пропускаем загрузку документов из OpenSearch - подключение не установлено")
             self.df = pd.DataFrame()  # Пустой DataFrame
         
+        self._build_feature_name_matcher()
+        
+        # Семантический кэш ответов (использует уже загруженную модель эмбеддингов)
+        if use_semantic_cache and SemanticCache is not None:
+            self._cache = SemanticCache(self.embedding_model, ttl_seconds=semantic_cache_ttl)
+        else:
+            self._cache = None
+        self._index_version: Optional[str] = None
+        self._index_version_checked = 0.0
+        
         logger.info("RAG система инициализирована")
     
+    def _create_giga_client(self) -> GigaChat:
+        """Создание клиента GigaChat."""
+        return GigaChat(
+            credentials=self.credentials,
+            verify_ssl_certs=False,
+            scope='GIGACHAT_API_B2B',
+            model='GigaChat:light',
+            timeout=120  # Увеличенный timeout для SSL handshake
+        )
+    
+    def _chat(self, prompt: Union[str, Dict[str, Any]]):
+        """
+        Запрос к GigaChat через общий клиент.
+        При ошибке авторизации (истекший токен) клиент пересоздается один раз.
+        Число одновременных запросов ограничено GIGACHAT_MAX_CONCURRENCY.
+        
+        Args:
+            prompt: Текст запроса или словарь с сообщениями (см. _system_user_chat)
+            
+        Returns:
+            Ответ GigaChat
+        """
+        with self._giga_semaphore:
+            giga = self._giga
+            try:
+                return giga.chat(prompt)
+            except AuthenticationError:
+                logger.warning("Ошибка авторизации GigaChat, пересоздаем клиент")
+                with self._giga_lock:
+                    # Другой поток мог уже пересоздать клиент
+                    if self._giga is giga:
+                        self._giga = self._create_giga_client()
+                        try:
+                            giga.close()
+                        except Exception:
+                            pass
+                return self._giga.chat(prompt)
+    
+    def close(self):
+        """Закрытие клиента GigaChat."""
+        giga = getattr(self, '_giga', None)
+        if giga is not None:
+            try:
+                giga.close()
+            except Exception:
+                pass
+            self._giga = None
+    
+    def __del__(self):
+        self.close()
+    
+    @property
+    def semantic_cache(self):
+        """Семантический кэш ответов (None, если отключен)."""
+        return self._cache
+    
+    def _get_index_version(self) -> Optional[str]:
+        """
+        Версия данных в индексах OpenSearch (uuid и количество документов).
+        
+        Returns:
+            Строка версии или None, если получить статистику не удалось
+        """
+        indices = [self.opensearch_index_layers, self.opensearch_index_descriptions]
+        try:
+            stats = self.opensearch_client.indices.stats(index=",".join(indices), metric="docs")
+        except Exception as e:
+            logger.warning(f"Не удалось получить статистику индексов: {e}")
+            return None
+        
+        parts = []
+        for index_name in indices:
+            index_stats = stats.get('indices', {}).get(index_name, {})
+            doc_count = index_stats.get('primaries', {}).get('docs', {}).get('count')
+            parts.append(f"{index_name}:{index_stats.get('uuid')}:{doc_count}")
+        return "|".join(parts)
+    
+    def check_index_version(self) -> Optional[str]:
+        """
+        Сброс семантического кэша, если индексы OpenSearch изменились
+        (пересозданы или в них добавлены документы). Проверка выполняется
+        не чаще раза в INDEX_VERSION_CHECK_INTERVAL секунд.
+        
+        Returns:
+            Последняя известная версия индексов (для ключей внешних кэшей)
+            или None, если получить ее не удалось
+        """
+        now = time.time()
+        if now - self._index_version_checked < INDEX_VERSION_CHECK_INTERVAL:
+            return self._index_version
+        self._index_version_checked = now
+        
+        version = self._get_index_version()
+        if version is None:
+            return self._index_version
+        self._index_version = version
+        if self._cache is not None and self._cache.set_version(version):
+            logger.info(f"Индексы OpenSearch изменились ({version}), семантический кэш сброшен")
+        return version
+    
+    @property
+    def last_sql_error(self):
+        """Последняя ошибка выполнения SQL в текущем потоке."""
+        return self._sql_state.last_sql_error
+    
+    @last_sql_error.setter
+    def last_sql_error(self, value):
+        self._sql_state.last_sql_error = value
+    
+    @property
+    def last_candidate_bindings(self) -> List[str]:
+        """Доступные колонки из последней ошибки SQL в текущем потоке."""
+        return self._sql_state.last_candidate_bindings
+    
+    @last_candidate_bindings.setter
+    def last_candidate_bindings(self, value: List[str]):
+        self._sql_state.last_candidate_bindings = value
+    
+    def _get_index_properties(self, index_name: str) -> Dict[str, Any]:
+        """
+        Поля (properties) mapping индекса. Mapping запрашивается один раз
+        и используется для определения и векторного, и текстового поля.
+        
+        Args:
+            index_name: Имя индекса
+            
+        Returns:
+            Словарь полей mapping
+        """
+        if index_name not in self._index_properties:
+            mapping = self.opensearch_client.indices.get_mapping(index=index_name)
+            self._index_properties[index_name] = mapping.get(index_name, {}).get('mappings', {}).get('properties', {})
+        return self._index_properties[index_name]
+    
     def _get_vector_field_name(self, index_name: str) -> str:
         """
         Определение имени поля для векторов в индексе.
@@ -174,15 +620,14 @@ class RAGSystemLangChain:
             Имя поля для векторов
         """
         try:
-            # Получаем mapping индекса
-            mapping = self.opensearch_client.indices.get_mapping(index=index_name)
-            index_mapping = mapping.get(index_name, {}).get('mappings', {}).get('properties', {})
+            index_mapping = self._get_index_properties(index_name)
             
             # Ищем поле типа knn_vector
-            for field_name, field_props in index_mapping.items():
-                if field_props.get('type') == 'knn_vector':
-                    logger.info(f"Найдено поле для векторов: {field_name}")
-                    return field_name
+            field_name = next((name for name, props in index_mapping.items()
+                               if props.get('type') == 'knn_vector'), None)
+            if field_name:
+                logger.info(f"Найдено поле для векторов: {field_name}")
+                return field_name
             
             # Если не найдено, пробуем стандартные имена
             for default_name in ['embedding', 'vector', 'vector_field', 'embedding_field']:
@@ -207,15 +652,14 @@ class RAGSystemLangChain:
             Имя поля для текста
         """
         try:
-            # Получаем mapping индекса
-            mapping = self.opensearch_client.indices.get_mapping(index=index_name)
-            index_mapping = mapping.get(index_name, {}).get('mappings', {}).get('properties', {})
+            index_mapping = self._get_index_properties(index_name)
             
             # Ищем поле типа text
-            for field_name, field_props in index_mapping.items():
-                if field_props.get('type') == 'text':
-                    logger.info(f"Найдено текстовое поле: {field_name}")
-                    return field_name
+            field_name = next((name for name, props in index_mapping.items()
+                               if props.get('type') == 'text'), None)
+            if field_name:
+                logger.info(f"Найдено текстовое поле: {field_name}")
+                return field_name
             
             # Если не найдено, используем стандартное имя
             logger.warning("Текстовое поле не найдено, используем 'text' по умолчанию")
@@ -311,9 +755,65 @@ class RAGSystemLangChain:
             logger.error(f"Ошибка загрузки документов из OpenSearch: {e}")
             raise
     
+    def reload_documents(self):
+        """
+        Перезагрузка документов из индекса rag_layers.
+        Сбрасывает семантический кэш, так как ответы могли устареть.
+        """
+        self.df = self._load_all_documents_from_opensearch()
+        self._build_feature_name_matcher()
+        if self._cache is not None:
+            self._cache.clear()
+        logger.info(f"Документы перезагружены: {len(self.df)} строк")
+    
+    def _build_feature_name_matcher(self):
+        """
+        Построение регулярного выражения для поиска названий признаков (колонок df) в запросе.
+        Название признака берется без единиц измерения: "Сорг,%" -> "сорг".
+        """
+        self._feature_names_by_key = {}
+        for col in self.df.columns:
+            if col in _SERVICE_COLUMNS:
+                continue
+            key = str(col).split(',')[0].strip().lower()
+            if len(key) >= 3:
+                self._feature_names_by_key.setdefault(key, []).append(col)
+        
+        if self._feature_names_by_key:
+            # Длинные названия первыми, чтобы они имели приоритет над своими префиксами
+            alternatives = sorted(self._feature_names_by_key, key=len, reverse=True)
+            self._feature_name_re = re.compile(
+                r'(?<!\w)(?:' + '|'.join(map(re.escape, alternatives)) + r')(?!\w)',
+                re.IGNORECASE
+            )
+        else:
+            self._feature_name_re = None
+    
+    def _match_known_features(self, user_query: str) -> List[str]:
+        """
+        Поиск известных признаков, явно упомянутых в запросе.
+        
+        Args:
+            user_query: Запрос пользователя
+            
+        Returns:
+            Список колонок df, названия которых встречаются в запросе
+        """
+        if self._feature_name_re is None:
+            return []
+        
+        matched = []
+        for match in self._feature_name_re.finditer(user_query):
+            for col in self._feature_names_by_key.get(match.group(0).lower(), []):
+                if col not in matched:
+                    matched.append(col)
+        return matched
+    
     def generate_feature_description(self, user_query: str) -> str:
         """
         Генерация описания признака или общего описания запроса через GigaChat.
+        Если запрос явно называет известные признаки, описание формируется
+        локально без обращения к GigaChat.
         
         Args:
             user_query: Запрос пользователя
@@ -323,25 +823,92 @@ class RAGSystemLangChain:
         """
         logger.info(f"Генерация описания для запроса: {user_query}")
         
-        prompt = FEATURE_DESCRIPTION_PROMPT.format(user_query=user_query)
+        # Быстрый путь: признак назван в запросе явно
+        known_features = self._match_known_features(user_query)
+        if known_features:
+            description = "\n".join(f"Признак: {name}" for name in known_features)
+            description += f"\nЗапрос: {user_query}"
+            logger.info(f"Описание сформировано локально по признакам: {known_features}")
+            return description
+        
+        prompt = _render_template(_FEATURE_DESCRIPTION_PARTS, user_query=user_query)
         
         try:
-            with GigaChat(
-                credentials=self.credentials,
-                verify_ssl_certs=False,
-                scope='GIGACHAT_API_B2B',
-                model='GigaChat:light'
-            ) as giga:
-                response = giga.chat(prompt)
-                record_from_response('GigaChat:light', response)
-                description = response.choices[0].message.content.strip()
-                logger.info(f"Сгенерировано описание: {description[:100]}...")
-                return description
+            response = self._chat(prompt)
+            record_from_response('GigaChat:light', response)
+            description = response.choices[0].message.content.strip()
+            logger.info(f"Сгенерировано описание: {description[:100]}...")
+            return description
         except Exception as e:
             logger.error(f"Ошибка генерации описания: {e}")
             # Возвращаем исходный запрос как описание
             return user_query
     
+    def _get_vector_space_type(self) -> Optional[str]:
+        """
+        Тип пространства векторов (space_type) индекса описаний.
+        
+        Mapping запрашивается один раз, а не при каждом поиске.
+        
+        Returns:
+            space_type индекса или None, если определить не удалось
+        """
+        if self._vector_space_type is None:
+            mapping = self.opensearch_client.indices.get_mapping(index=self.opensearch_index_descriptions)
+            index_mapping = mapping.get(self.opensearch_index_descriptions, {}).get('mappings', {}).get('properties', {})
+            vector_props = index_mapping.get(self.vector_field_name, {})
+            method = vector_props.get('method', {})
+            self._vector_space_type = method.get('space_type', 'l2')
+        return self._vector_space_type
+    
+    def _prepare_query_vector(self, query_embedding: np.ndarray) -> List[float]:
+        """
+        Подготовка эмбеддинга запроса для KNN поиска.
+        
+        Args:
+            query_embedding: Эмбеддинг запроса
+            
+        Returns:
+            Вектор в виде списка (нормализованный для cosine similarity)
+        """
+        try:
+            space_type = self._get_vector_space_type()
+        except Exception as norm_error:
+            logger.warning(f"Не удалось проверить space_type, используем вектор как есть: {norm_error}")
+            return query_embedding.tolist()
+        
+        if space_type in _UNIT_VECTOR_SPACE_TYPES:
+            # Нормализуем вектор для cosine similarity (для innerproduct индекс
+            # хранит нормализованные векторы, и скалярное произведение равно косинусу)
+            norm = np.linalg.norm(query_embedding)
+            if norm > 0:
+                return (query_embedding / norm).tolist()
+        return query_embedding.tolist()
+    
+    def _hits_to_documents(self, hits: List[Dict]) -> List[Document]:
+        """
+        Преобразование результатов OpenSearch в Document объекты.
+        
+        Args:
+            hits: Список hits из ответа OpenSearch
+            
+        Returns:
+            Список документов
+        """
+        documents = []
+        for hit in hits:
+            source = hit['_source']
+            text = source.get(self.text_field_name, '')
+            
+            # Извлекаем метаданные (все поля кроме текста и эмбеддинга)
+            metadata = {k: v for k, v in source.items() 
+                       if k != self.text_field_name and k != self.vector_field_name}
+            metadata['_id'] = hit['_id']
+            metadata['_score'] = hit['_score']
+            
+            documents.append(Document(page_content=text, metadata=metadata))
+        return documents
+    
     def search_in_opensearch(self, query: str, top_k: int = 10) -> List[Document]:
         """
         Поиск в OpenSearch по косинусному расстоянию (прямой KNN поиск без LangChain).
@@ -356,34 +923,13 @@ class RAGSystemLangChain:
         logger.info(f"Поиск в OpenSearch: '{query[:50]}...' (топ-{top_k})")
         
         try:
-            # Генерируем эмбеддинг для запроса
-            import numpy as np
-            query_embedding = self.embedding_model.encode(query)
+            # Генерируем эмбеддинг для запроса (повторяющиеся тексты берутся из кэша)
+            query_embedding = encode_cached(self.embedding_model, query)
             embedding_dim = len(query_embedding)
             logger.info(f"Сгенерирован эмбеддинг размерности: {embedding_dim}")
             
             # Для cosine similarity нормализуем вектор
-            # Проверяем space_type из mapping индекса
-            try:
-                mapping = self.opensearch_client.indices.get_mapping(index=self.opensearch_index_descriptions)
-                index_mapping = mapping.get(self.opensearch_index_descriptions, {}).get('mappings', {}).get('properties', {})
-                vector_props = index_mapping.get(self.vector_field_name, {})
-                method = vector_props.get('method', {})
-                space_type = method.get('space_type', 'l2')
-                
-                if space_type == 'cosinesimil' or space_type == 'cosinesimilarity':
-                    # Нормализуем вектор для cosine similarity
-                    norm = np.linalg.norm(query_embedding)
-                    if norm > 0:
-                        query_embedding = (query_embedding / norm).tolist()
-                        logger.info("Вектор нормализован для cosine similarity")
-                    else:
-                        query_embedding = query_embedding.tolist()
-                else:
-                    query_embedding = query_embedding.tolist()
-            except Exception as norm_error:
-                logger.warning(f"Не удалось проверить space_type, используем вектор как есть: {norm_error}")
-                query_embedding = query_embedding.tolist()
+            query_embedding = self._prepare_query_vector(query_embedding)
             
             # Формируем KNN запрос для OpenSearch
             # В OpenSearch 2.x может использоваться формат с knn на верхнем уровне
@@ -465,19 +1011,7 @@ class RAGSystemLangChain:
                 logger.warning(f"   - Совпадает ли размерность вектора ({embedding_dim}) с размерностью в индексе")
             
             # Преобразуем результаты в Document объекты
-            documents = []
-            for hit in response['hits']['hits']:
-                source = hit['_source']
-                text = source.get(self.text_field_name, '')
-                
-                # Извлекаем метаданные (все поля кроме текста и эмбеддинга)
-                metadata = {k: v for k, v in source.items() 
-                           if k != self.text_field_name and k != self.vector_field_name}
-                metadata['_id'] = hit['_id']
-                metadata['_score'] = hit['_score']
-                
-                doc = Document(page_content=text, metadata=metadata)
-                documents.append(doc)
+            documents = self._hits_to_documents(response['hits']['hits'])
             
             logger.info(f"Найдено {len(documents)} документов")
             return documents
@@ -485,6 +1019,118 @@ class RAGSystemLangChain:
             logger.error(f"Ошибка поиска в OpenSearch: {e}")
             return []
     
+    def search_in_opensearch_batch(self, queries: List[str], top_k: int = 10) -> List[List[Document]]:
+        """
+        Пакетный поиск в OpenSearch для нескольких запросов.
+        
+        Все запросы векторизуются одним вызовом модели и отправляются
+        одним multi-search запросом вместо отдельного search на каждый.
+        
+        Args:
+            queries: Список текстовых запросов
+            top_k: Количество результатов на запрос
+            
+        Returns:
+            Списки найденных документов в порядке запросов
+        """
+        if not queries:
+            return []
+        if len(queries) == 1:
+            return [self.search_in_opensearch(queries[0], top_k=top_k)]
+        
+        logger.info(f"Пакетный поиск в OpenSearch: {len(queries)} запросов (топ-{top_k})")
+        
+        try:
+            embeddings = self.embedding_model.encode(queries, batch_size=len(queries))
+            
+            body = []
+            for query_embedding in embeddings:
+                body.append({'index': self.opensearch_index_descriptions})
+                body.append({
+                    "size": top_k,
+                    "query": {
+                        "knn": {
+                            self.vector_field_name: {
+                                "vector": self._prepare_query_vector(query_embedding),
+                                "k": top_k
+                            }
+                        }
+                    }
+                })
+            
+            response = self.opensearch_client.msearch(body=body)
+            
+            results = []
+            for query, item in zip(queries, response['responses']):
+                if 'error' in item:
+                    logger.warning(f"Ошибка пакетного поиска для '{query[:50]}...': {item['error']}")
+                    results.append(self.search_in_opensearch(query, top_k=top_k))
+                else:
+                    results.append(self._hits_to_documents(item['hits']['hits']))
+            
+            logger.info(f"Найдено документов по запросам: {[len(docs) for docs in results]}")
+            return results
+        except Exception as e:
+            logger.warning(f"Пакетный поиск не выполнен ({e}), выполняем запросы по одному")
+            return [self.search_in_opensearch(query, top_k=top_k) for query in queries]
+    
+    def _scores_to_similarity(self, scores: np.ndarray) -> np.ndarray:
+        """
+        Перевод оценок k-NN OpenSearch обратно в близость векторов.
+        
+        Для cosinesimil оценка равна 1 / (2 - cos) и всегда лежит в (1/3, 1],
+        поэтому доля от лучшей оценки почти ничего не отсекает. Для
+        innerproduct оценка равна ip + 1 при ip >= 0 и 1 / (1 - ip) иначе.
+        Оценки остальных пространств возвращаются как есть.
+        
+        Args:
+            scores: Оценки _score документов
+            
+        Returns:
+            Косинус (скалярное произведение) или исходные оценки
+        """
+        try:
+            space_type = self._get_vector_space_type()
+        except Exception as e:
+            logger.warning(f"Не удалось проверить space_type, используем оценки как есть: {e}")
+            return scores
+        
+        positive = scores > 0
+        if space_type in ('cosinesimil', 'cosinesimilarity'):
+            return np.where(positive, 2.0 - 1.0 / np.where(positive, scores, 1.0), -1.0)
+        if space_type == 'innerproduct':
+            return np.where(scores >= 1.0, scores - 1.0, 1.0 - 1.0 / np.where(positive, scores, 1.0))
+        return scores
+    
+    def filter_by_score(self, documents: List[Document]) -> List[Document]:
+        """
+        Отсечение документов с низкой оценкой векторного поиска, чтобы не
+        тратить токены GigaChat на проверку заведомо нерелевантных признаков.
+        
+        Args:
+            documents: Документы из search_in_opensearch (оценка в metadata['_score'])
+            
+        Returns:
+            Документы с достаточной оценкой в исходном порядке
+        """
+        if len(documents) <= SCORE_CUTOFF_MIN_KEPT:
+            return documents
+        scores = self._scores_to_similarity(
+            np.array([doc.metadata.get('_score') or 0.0 for doc in documents], dtype=float)
+        )
+        if scores.max() <= 0:
+            return documents
+        
+        keep = scores >= scores.max() * SCORE_CUTOFF_RATIO
+        if keep.sum() < SCORE_CUTOFF_MIN_KEPT:
+            keep = np.zeros(len(documents), dtype=bool)
+            keep[np.argsort(-scores, kind='stable')[:SCORE_CUTOFF_FALLBACK_TOP]] = True
+        
+        if keep.all():
+            return documents
+        logger.info(f"Отсечено по оценке OpenSearch {len(documents) - int(keep.sum())} из {len(documents)} документов")
+        return [doc for doc, kept in zip(documents, keep.tolist()) if kept]
+    
     def check_feature_match(self, user_query: str, feature_name: str, feature_description: str) -> bool:
         """
         Проверка, соответствует ли признак запросу пользователя.
@@ -499,10 +1145,14 @@ class RAGSystemLangChain:
         """
         logger.info(f"Проверка соответствия признака '{feature_name}' запросу пользователя")
         
-        prompt = FEATURE_MATCH_PROMPT.format(
-            user_query=user_query,
-            feature_name=feature_name,
-            feature_description=feature_description
+        # Инструкция вынесена в системное сообщение: ее префикс одинаков для всех признаков
+        prompt = _system_user_chat(
+            FEATURE_MATCH_SYSTEM_PROMPT,
+            FEATURE_MATCH_USER_PROMPT.format(
+                user_query=user_query,
+                feature_name=feature_name,
+                feature_description=feature_description
+            )
         )
         
         max_retries = 3
@@ -510,25 +1160,17 @@ class RAGSystemLangChain:
         
         for attempt in range(max_retries):
             try:
-                with GigaChat(
-                    credentials=self.credentials,
-                    verify_ssl_certs=False,
-                    scope='GIGACHAT_API_B2B',
-                    model='GigaChat:light',
-                    timeout=120,  # Увеличенный timeout для SSL handshake
-                    retry_on_timeout=True
-                ) as giga:
-                    response = giga.chat(prompt)
-                    record_from_response('GigaChat:light', response)
-                    answer = response.choices[0].message.content.strip().upper()
-                    
-                    # Проверяем ответ
-                    if "ДА" in answer or "YES" in answer:
-                        logger.info(f"Признак '{feature_name}' соответствует запросу")
-                        return True
-                    else:
-                        logger.info(f"Признак '{feature_name}' не соответствует запросу")
-                        return False
+                response = self._chat(prompt)
+                record_from_response('GigaChat:light', response)
+                answer = response.choices[0].message.content.strip().upper()
+                
+                # Проверяем ответ
+                if "ДА" in answer or "YES" in answer:
+                    logger.info(f"Признак '{feature_name}' соответствует запросу")
+                    return True
+                else:
+                    logger.info(f"Признак '{feature_name}' не соответствует запросу")
+                    return False
             except Exception as e:
                 error_msg = str(e)
                 logger.warning(f"Ошибка проверки соответствия признака (попытка {attempt + 1}/{max_retries}): {error_msg}")
@@ -549,6 +1191,66 @@ class RAGSystemLangChain:
         logger.error(f"Не удалось проверить признак '{feature_name}' после {max_retries} попыток")
         return False
     
+    def check_feature_match_batch(
+        self,
+        user_query: str,
+        features: List[Tuple[str, str]]
+    ) -> Optional[List[bool]]:
+        """
+        Проверка соответствия нескольких признаков запросу одним запросом к GigaChat.
+        
+        Args:
+            user_query: Исходный запрос пользователя
+            features: Список пар (название признака, описание признака)
+            
+        Returns:
+            Список результатов в порядке features или None, если ответ
+            не удалось получить или разобрать
+        """
+        logger.info(f"Пакетная проверка соответствия {len(features)} признаков запросу пользователя")
+        
+        items = '\n'.join(
+            FEATURE_MATCH_BATCH_ITEM.format(
+                number=number,
+                feature_name=feature_name,
+                feature_description=feature_description
+            )
+            for number, (feature_name, feature_description) in enumerate(features, 1)
+        )
+        prompt = _system_user_chat(
+            FEATURE_MATCH_BATCH_SYSTEM_PROMPT,
+            FEATURE_MATCH_BATCH_USER_PROMPT.format(
+                user_query=user_query,
+                count=len(features),
+                features=items
+            )
+        )
+        
+        try:
+            response = self._chat(prompt)
+            record_from_response('GigaChat:light', response)
+            answer = response.choices[0].message.content.strip()
+        except Exception as e:
+            logger.warning(f"Ошибка пакетной проверки признаков: {e}")
+            return None
+        
+        match = _JSON_ARRAY_RE.search(answer)
+        try:
+            values = json.loads(match.group(0)) if match else None
+        except ValueError:
+            values = None
+        if (
+            not isinstance(values, list)
+            or len(values) != len(features)
+            or not all(value in (0, 1) for value in values)
+        ):
+            logger.warning(f"Некорректный ответ пакетной проверки признаков: {answer[:200]}")
+            return None
+        
+        matches = [bool(value) for value in values]
+        logger.info(f"Пакетная проверка: соответствуют запросу {sum(matches)} из {len(features)} признаков")
+        return matches
+    
     def get_columns_info(self) -> str:
         """Получение информации о колонках для промпта."""
         columns_info = []
@@ -578,133 +1280,269 @@ class RAGSystemLangChain:
         Returns:
             SQL запрос или None в случае ошибки
         """
+        return self._generate_and_run_sql(user_query, feature_name, feature_description, max_attempts)[0]
+    
+    def _generate_and_run_sql(
+        self,
+        user_query: str,
+        feature_name: str,
+        feature_description: str,
+        max_attempts: int = 3
+    ) -> Tuple[Optional[str], Optional[pd.DataFrame]]:
+        """
+        Генерация SQL запроса с проверкой выполнением (см. generate_sql_query).
+        
+        Returns:
+            Tuple[SQL запрос, результат его проверочного выполнения]
+            или (None, None) в случае ошибки
+        """
         logger.info(f"Генерация SQL запроса для признака '{feature_name}' (максимум {max_attempts} попыток)")
         
-        columns_info = self.get_columns_info()
-        sql_query = None
-        attempt = 0
+        # Контекст подстановок общий для всех шаблонов плана:
+        # str.format игнорирует ключи, которых нет в конкретном шаблоне
+        context = {
+            'user_query': user_query,
+            'feature_name': feature_name,
+            'feature_description': feature_description,
+            'columns_info': self.get_columns_info(),
+            'sql_query': "",
+            'error_message': "",
+            'error_history': "",
+            'candidate_bindings': ""
+        }
         error_history = []  # История всех ошибок для третьей попытки
         all_candidate_bindings = []  # Все candidate bindings из всех ошибок
         
-        while attempt < max_attempts:
-            attempt += 1
+        for attempt in range(1, max_attempts + 1):
             logger.info(f"Попытка {attempt}/{max_attempts} генерации SQL запроса")
+            template = _SQL_ATTEMPT_PROMPTS[min(attempt, len(_SQL_ATTEMPT_PROMPTS)) - 1]
             
             try:
-                if attempt == 1:
-                    # Первая попытка - обычная генерация
-                    prompt = SQL_GENERATION_PROMPT.format(
-                        user_query=user_query,
-                        feature_name=feature_name,
-                        feature_description=feature_description,
-                        columns_info=columns_info
-                    )
-                elif attempt == 2:
-                    # Вторая попытка - исправление ошибки
-                    error_msg = str(self.last_sql_error) if hasattr(self, 'last_sql_error') else "Неизвестная ошибка"
-                    candidate_bindings = getattr(self, 'last_candidate_bindings', [])
-                    # Используем уникальные candidate bindings
-                    unique_bindings = list(set(candidate_bindings))
-                    candidate_bindings_text = "\n".join([f"- `{col}`" for col in unique_bindings]) if unique_bindings else "Не указаны"
-                    prompt = SQL_FIX_PROMPT.format(
-                        user_query=user_query,
-                        feature_name=feature_name,
-                        feature_description=feature_description,
-                        columns_info=columns_info,
-                        sql_query=sql_query or "",
-                        error_message=error_msg,
-                        candidate_bindings=candidate_bindings_text
-                    )
-                else:
-                    # Третья попытка - глубокое исправление с учетом всей истории ошибок
-                    error_msg = str(self.last_sql_error) if hasattr(self, 'last_sql_error') else "Неизвестная ошибка"
-                    error_history_text = "\n".join(error_history) if error_history else "История ошибок отсутствует"
-                    # Используем все candidate bindings из всех ошибок
-                    if all_candidate_bindings:
-                        unique_bindings = list(set(all_candidate_bindings))
-                    else:
-                        unique_bindings = list(set(getattr(self, 'last_candidate_bindings', [])))
-                    candidate_bindings_text = "\n".join([f"- `{col}`" for col in unique_bindings]) if unique_bindings else "Не указаны"
-                    prompt = SQL_FIX_PROMPT_V2.format(
-                        user_query=user_query,
-                        feature_name=feature_name,
-                        feature_description=feature_description,
-                        columns_info=columns_info,
-                        sql_query=sql_query or "",
-                        error_message=error_msg,
-                        error_history=error_history_text,
-                        candidate_bindings=candidate_bindings_text
-                    )
-                
-                with GigaChat(
-                    credentials=self.credentials,
-                    verify_ssl_certs=False,
-                    scope='GIGACHAT_API_B2B',
-                    model='GigaChat:light'
-                ) as giga:
-                    response = giga.chat(prompt)
-                    record_from_response('GigaChat:light', response)
-                    sql_query = response.choices[0].message.content.strip()
-                    
-                    # Очистка SQL запроса от markdown форматирования, если есть
-                    if sql_query.startswith("```sql"):
-                        sql_query = sql_query[6:]
-                    if sql_query.startswith("```"):
-                        sql_query = sql_query[3:]
-                    if sql_query.endswith("```"):
-                        sql_query = sql_query[:-3]
-                    sql_query = sql_query.strip()
-                    
-                    logger.info(f"Сгенерирован SQL запрос (попытка {attempt}): {sql_query[:100]}...")
-                    
-                    # Пробуем выполнить запрос для проверки
-                    try:
-                        test_result = self.execute_sql_query(sql_query, test_mode=True)
-                        
-                        if test_result is not None:
-                            # Запрос выполнился успешно
-                            logger.info(f"SQL запрос успешно проверен на попытке {attempt}")
-                            return sql_query
-                        else:
-                            # Запрос выполнился с ошибкой, продолжаем попытки
-                            if attempt < max_attempts:
-                                error_msg = str(self.last_sql_error) if hasattr(self, 'last_sql_error') else "Неизвестная ошибка"
-                                error_history.append(f"Попытка {attempt}: {error_msg}")
-                                # Сохраняем candidate bindings из текущей ошибки, если они есть
-                                if hasattr(self, 'last_candidate_bindings') and self.last_candidate_bindings:
-                                    all_candidate_bindings.extend(self.last_candidate_bindings)
-                                    error_history.append(f"Доступные колонки: {', '.join(self.last_candidate_bindings)}")
-                                logger.warning(f"SQL запрос выполнился с ошибкой: {error_msg[:200]}... Пробуем исправить (попытка {attempt}/{max_attempts})")
-                                continue
-                            else:
-                                logger.error(f"Не удалось сгенерировать корректный SQL запрос после {max_attempts} попыток")
-                                return None
-                    except Exception as test_error:
-                        # Ошибка при тестировании запроса
-                        self.last_sql_error = test_error
-                        if attempt < max_attempts:
-                            error_msg = str(test_error)
-                            error_history.append(f"Попытка {attempt}: {error_msg}")
-                            # Извлекаем candidate bindings из ошибки
-                            candidate_bindings = self._extract_candidate_bindings(error_msg)
-                            if candidate_bindings:
-                                self.last_candidate_bindings = candidate_bindings
-                                all_candidate_bindings.extend(candidate_bindings)
-                                error_history.append(f"Доступные колонки: {', '.join(candidate_bindings)}")
-                                logger.info(f"Найдены доступные колонки в ошибке: {candidate_bindings}")
-                            logger.warning(f"Ошибка при тестировании SQL запроса: {test_error}. Пробуем исправить (попытка {attempt}/{max_attempts})")
-                            continue
-                        else:
-                            logger.error(f"Не удалось сгенерировать корректный SQL запрос после {max_attempts} попыток")
-                            return None
-                            
+                response = self._chat(template.format(**context))
+                record_from_response('GigaChat:light', response)
+                sql_query = response.choices[0].message.content.strip()
             except Exception as e:
                 logger.error(f"Ошибка генерации SQL запроса на попытке {attempt}: {e}")
-                if attempt >= max_attempts:
-                    return None
                 continue
+            
+            # Очистка SQL запроса от markdown форматирования, если есть
+            if sql_query.startswith("```sql"):
+                sql_query = sql_query[6:]
+            if sql_query.startswith("```"):
+                sql_query = sql_query[3:]
+            if sql_query.endswith("```"):
+                sql_query = sql_query[:-3]
+            sql_query = sql_query.strip()
+            
+            logger.info(f"Сгенерирован SQL запрос (попытка {attempt}): {sql_query[:100]}...")
+            
+            # Пробуем выполнить запрос для проверки (ошибка предыдущей попытки сбрасывается)
+            self.last_sql_error = None
+            self.last_candidate_bindings = []
+            try:
+                test_result = self.execute_sql_query(sql_query, test_mode=True)
+            except Exception as test_error:
+                test_result = None
+                self.last_sql_error = test_error
+                candidate_bindings = self._extract_candidate_bindings(str(test_error))
+                if candidate_bindings:
+                    self.last_candidate_bindings = candidate_bindings
+            
+            if test_result is not None:
+                logger.info(f"SQL запрос успешно проверен на попытке {attempt}")
+                return sql_query, test_result
+            
+            # Запрос выполнился с ошибкой: готовим контекст для следующей попытки
+            error_msg = str(self.last_sql_error) if self.last_sql_error is not None else "Неизвестная ошибка"
+            error_history.append(f"Попытка {attempt}: {error_msg}")
+            if self.last_candidate_bindings:
+                all_candidate_bindings.extend(self.last_candidate_bindings)
+                error_history.append(f"Доступные колонки: {', '.join(self.last_candidate_bindings)}")
+            
+            unique_bindings = list(dict.fromkeys(all_candidate_bindings))
+            context['sql_query'] = sql_query
+            context['error_message'] = error_msg
+            context['error_history'] = "\n".join(error_history)
+            context['candidate_bindings'] = (
+                "\n".join(f"- `{col}`" for col in unique_bindings) if unique_bindings else "Не указаны"
+            )
+            
+            if attempt < max_attempts:
+                logger.warning(f"SQL запрос выполнился с ошибкой: {error_msg[:200]}... Пробуем исправить (попытка {attempt}/{max_attempts})")
         
-        return sql_query
+        logger.error(f"Не удалось сгенерировать корректный SQL запрос после {max_attempts} попыток")
+        return None, None
+    
+    @staticmethod
+    def _feature_info_from_doc(doc) -> Optional[Tuple[str, str]]:
+        """
+        Извлечение названия и описания признака из документа OpenSearch.
+        
+        Args:
+            doc: Документ из индекса feature_descriptions
+            
+        Returns:
+            Tuple[название, описание] или None, если название не найдено
+        """
+        # В индексе feature_descriptions поле feature_name хранится в метаданных
+        feature_name = doc.metadata.get('feature_name', '')
+        
+        # Если нет в метаданных, пытаемся извлечь из других полей
+        if not feature_name:
+            feature_name = doc.metadata.get('name', '')
+        if not feature_name:
+            # Описание может начинаться с названия: берем короткую строку из первых трех
+            # (остаток описания не разбивается на строки)
+            text = doc.page_content or ""
+            for part in text.split('\n', 3)[:3]:
+                part = part.strip()
+                if part and len(part) < 100:  # Название обычно короткое
+                    feature_name = part
+                    break
+        
+        if not feature_name:
+            return None
+        
+        # Извлекаем описание
+        feature_desc = doc.page_content if doc.page_content else ""
+        if not feature_desc:
+            feature_desc = doc.metadata.get('description', '')
+        
+        # Ограничиваем длину описания для промпта
+        feature_desc = feature_desc[:1000] if feature_desc else ""
+        return feature_name, feature_desc
+    
+    def match_features(
+        self,
+        user_query: str,
+        search_results: List[Document],
+        on_checked: Optional[Callable[[int, int, str], None]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Проверка найденных признаков на соответствие запросу.
+        Признаки проверяются одним пакетным запросом к GigaChat (при ошибке
+        разбора ответа - параллельно по одному), порядок результата
+        совпадает с порядком search_results.
+        
+        Args:
+            user_query: Исходный запрос пользователя
+            search_results: Документы, найденные в OpenSearch
+            on_checked: Вызывается после каждой проверки с аргументами
+                (проверено, всего, название признака)
+            
+        Returns:
+            Список словарей с ключами feature_name, description, doc
+        """
+        candidates = []
+        for doc in search_results:
+            info = self._feature_info_from_doc(doc)
+            if info is None:
+                logger.warning(f"Не удалось извлечь feature_name из документа. Метаданные: {doc.metadata.keys()}")
+                continue
+            candidates.append((doc, info[0], info[1]))
+        
+        if not candidates:
+            return []
+        
+        matches = [False] * len(candidates)
+        # Все признаки оцениваются одним запросом к GigaChat (пакетами по
+        # FEATURE_CHECK_BATCH_SIZE); пакеты, ответ на которые не удалось
+        # разобрать, проверяются по одному признаку параллельно
+        unchecked = []
+        checked = 0
+        for start in range(0, len(candidates), FEATURE_CHECK_BATCH_SIZE):
+            batch = candidates[start:start + FEATURE_CHECK_BATCH_SIZE]
+            batch_matches = self.check_feature_match_batch(
+                user_query,
+                [(feature_name, feature_desc) for _, feature_name, feature_desc in batch]
+            )
+            if batch_matches is None:
+                unchecked.extend(range(start, start + len(batch)))
+                continue
+            matches[start:start + len(batch)] = batch_matches
+            if on_checked is not None:
+                for _, feature_name, _ in batch:
+                    checked += 1
+                    on_checked(checked, len(candidates), feature_name)
+        
+        if unchecked:
+            logger.info(f"Проверяем по одному {len(unchecked)} признаков")
+            with ThreadPoolExecutor(max_workers=min(FEATURE_CHECK_WORKERS, len(unchecked))) as executor:
+                futures = {
+                    executor.submit(self.check_feature_match, user_query, candidates[idx][1], candidates[idx][2]): idx
+                    for idx in unchecked
+                }
+                for future in as_completed(futures):
+                    idx = futures[future]
+                    try:
+                        matches[idx] = future.result()
+                    except Exception as e:
+                        logger.error(f"Ошибка проверки признака '{candidates[idx][1]}': {e}")
+                    checked += 1
+                    if on_checked is not None:
+                        on_checked(checked, len(candidates), candidates[idx][1])
+        
+        return [
+            {'feature_name': feature_name, 'description': feature_desc, 'doc': doc}
+            for (doc, feature_name, feature_desc), matched in zip(candidates, matches)
+            if matched
+        ]
+    
+    def _run_sql_for_feature(
+        self,
+        user_query: str,
+        feature_name: str,
+        feature_description: str
+    ) -> Optional[pd.DataFrame]:
+        """
+        Генерация и выполнение SQL запроса для одного признака.
+        
+        Args:
+            user_query: Исходный запрос пользователя
+            feature_name: Название признака
+            feature_description: Описание признака
+            
+        Returns:
+            DataFrame с результатами или None, если SQL запрос не сгенерирован
+        """
+        # Результат проверочного выполнения и есть результат запроса:
+        # повторно SQL не выполняется
+        sql_query, result_df = self._generate_and_run_sql(user_query, feature_name, feature_description)
+        if not sql_query:
+            return None
+        return result_df
+    
+    @staticmethod
+    def combine_results(
+        frames: List[pd.DataFrame],
+        feature_names: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        """
+        Объединение результатов SQL запросов по признакам.
+        
+        Если переданы feature_names, колонка matched_feature заполняется один раз
+        после объединения (без изменения каждого DataFrame по отдельности).
+        
+        Args:
+            frames: Список DataFrame с результатами по каждому признаку
+            feature_names: Названия признаков в порядке frames
+            
+        Returns:
+            Объединенный DataFrame
+        """
+        if len(frames) == 1:
+            combined = frames[0]
+            if feature_names is not None:
+                combined = combined.assign(matched_feature=feature_names[0])
+            return combined
+        
+        combined = pd.concat(frames, ignore_index=True)
+        if feature_names is not None:
+            combined['matched_feature'] = np.repeat(
+                np.array(feature_names, dtype=object),
+                [len(frame) for frame in frames]
+            )
+        return combined
     
     def _extract_candidate_bindings(self, error_msg: str) -> List[str]:
         """
@@ -716,15 +1554,14 @@ class RAGSystemLangChain:
         Returns:
             Список доступных имен колонок из ошибки
         """
-        import re
         candidate_bindings = []
         
         # Ищем паттерн "Candidate bindings: ..."
-        match = re.search(r'Candidate bindings:\s*([^\n]+)', error_msg)
+        match = _CANDIDATE_BINDINGS_RE.search(error_msg)
         if match:
             bindings_str = match.group(1)
             # Извлекаем имена в кавычках
-            bindings = re.findall(r'"([^"]+)"', bindings_str)
+            bindings = _QUOTED_NAME_RE.findall(bindings_str)
             candidate_bindings.extend(bindings)
         
         return candidate_bindings
@@ -791,49 +1628,50 @@ class RAGSystemLangChain:
         
         # Подготовка данных для промпта
         if results_df.empty:
+            # Повторный запрос без данных: ответ уже был сгенерирован недавно
+            if self._cache is not None:
+                cached_answer = self._cache.get_empty(user_query)
+                if cached_answer is not None:
+                    logger.info("Ответ для запроса без данных найден в кэше")
+                    return cached_answer
+            
             retrieved_data = "Данные не найдены в базе."
             coordinates_section = ""
         else:
             # Ограничиваем размер данных для промпта
-            max_rows = 50
-            if len(results_df) > max_rows:
-                retrieved_data = f"Найдено {len(results_df)} записей. Показаны первые {max_rows}:\n\n"
-                retrieved_data += results_df.head(max_rows).to_string(index=False)
-            else:
-                retrieved_data = results_df.to_string(index=False)
+            retrieved_data = _format_results_for_prompt(results_df)
             
             # Извлечение координат из результатов
             coordinates_list = []
-            if 'lon' in results_df.columns and 'lat' in results_df.columns:
-                for idx, row in results_df.iterrows():
-                    lon = row.get('lon', None)
-                    lat = row.get('lat', None)
-                    
-                    if pd.notna(lon) and pd.notna(lat):
-                        lon_str = str(lon).strip()
-                        lat_str = str(lat).strip()
-                        
-                        # Обработка массивов координат
-                        if lon_str.startswith('['):
-                            try:
-                                import ast
-                                lon_array = ast.literal_eval(lon_str)
-                                if isinstance(lon_array, list) and len(lon_array) > 0:
-                                    lon_str = str(lon_array[0])
-                            except:
-                                lon_str = lon_str.strip('[]').split(',')[0].strip()
-                        
-                        if lat_str.startswith('['):
-                            try:
-                                import ast
-                                lat_array = ast.literal_eval(lat_str)
-                                if isinstance(lat_array, list) and len(lat_array) > 0:
-                                    lat_str = str(lat_array[-1]) if len(lat_array) > 1 else str(lat_array[0])
-                            except:
-                                lat_str = lat_str.strip('[]').split(',')[-1].strip()
-                        
-                        if lon_str and lat_str and lon_str not in ['nan', 'None'] and lat_str not in ['nan', 'None']:
-                            coordinates_list.append(f"Запись {idx + 1}: Долгота: {lon_str}, Широта: {lat_str}")
+            results_df = _flatten_list_coordinates(results_df)
+            if (
+                'lon' in results_df.columns and 'lat' in results_df.columns
+                and pd.api.types.is_numeric_dtype(results_df['lon'])
+                and pd.api.types.is_numeric_dtype(results_df['lat'])
+            ):
+                # Быстрый путь: числовые колонки не требуют разбора строк
+                coords = results_df[['lon', 'lat']].dropna()
+                coordinates_list = [
+                    f"Запись {idx + 1}: Долгота: {lon}, Широта: {lat}"
+                    for idx, lon, lat in zip(coords.index, coords['lon'].tolist(), coords['lat'].tolist())
+                ]
+            elif 'lon' in results_df.columns and 'lat' in results_df.columns:
+                lon_values = _extract_coordinate_strings(results_df['lon'], take_last=False)
+                lat_values = _extract_coordinate_strings(results_df['lat'], take_last=True)
+                
+                valid = (
+                    lon_values.notna() & lat_values.notna()
+                    & ~lon_values.isin(_MISSING_COORDINATE_STRINGS)
+                    & ~lat_values.isin(_MISSING_COORDINATE_STRINGS)
+                )
+                coordinates_list = [
+                    f"Запись {idx + 1}: Долгота: {lon_str}, Широта: {lat_str}"
+                    for idx, lon_str, lat_str in zip(
+                        results_df.index[valid.to_numpy()],
+                        lon_values[valid].tolist(),
+                        lat_values[valid].tolist()
+                    )
+                ]
             
             # Формируем секцию с координатами
             if coordinates_list:
@@ -841,31 +1679,29 @@ class RAGSystemLangChain:
             else:
                 coordinates_section = "\n\n⚠️ ВНИМАНИЕ: Координаты не найдены в данных."
         
-        prompt = FINAL_SUMMARY_PROMPT.format(
+        prompt = _render_template(
+            _FINAL_SUMMARY_PARTS,
             user_query=user_query,
             retrieved_data=retrieved_data,
             coordinates_section=coordinates_section
         )
         
         try:
-            with GigaChat(
-                credentials=self.credentials,
-                verify_ssl_certs=False,
-                scope='GIGACHAT_API_B2B',
-                model='GigaChat:light'
-            ) as giga:
-                response = giga.chat(prompt)
-                record_from_response('GigaChat:light', response)
-                summary = response.choices[0].message.content.strip()
-                
-                # Проверяем, что координаты включены в ответ
-                if coordinates_section and 'координат' not in summary.lower() and '📍' not in summary:
-                    logger.warning("Координаты не включены в ответ, добавляем принудительно")
-                    coords_text = "\n\n📍 КООРДИНАТЫ НАЙДЕННЫХ ЗАПИСЕЙ:\n" + "\n".join([line.replace("Запись ", "• ") for line in coordinates_list])
-                    summary += coords_text
-                
-                logger.info("Финальный ответ сгенерирован")
-                return summary
+            response = self._chat(prompt)
+            record_from_response('GigaChat:light', response)
+            summary = response.choices[0].message.content.strip()
+            
+            # Проверяем, что координаты включены в ответ
+            if coordinates_section and 'координат' not in summary.lower() and '📍' not in summary:
+                logger.warning("Координаты не включены в ответ, добавляем принудительно")
+                coords_text = "\n\n📍 КООРДИНАТЫ НАЙДЕННЫХ ЗАПИСЕЙ:\n" + "\n".join([line.replace("Запись ", "• ") for line in coordinates_list])
+                summary += coords_text
+            
+            if results_df.empty and self._cache is not None:
+                self._cache.put_empty(user_query, summary)
+            
+            logger.info("Финальный ответ сгенерирован")
+            return summary
         except Exception as e:
             logger.error(f"Ошибка генерации финального ответа: {e}")
             # Возвращаем базовый ответ с координатами
@@ -896,6 +1732,18 @@ class RAGSystemLangChain:
         logger.info(f"RAG ЗАПРОС: {user_query}")
         logger.info(f"{'='*80}\n")
         
+        # Проверка семантического кэша
+        if self._cache is not None:
+            self.check_index_version()
+            cached = self._cache.get(user_query)
+            if cached is not None:
+                logger.info("Ответ найден в семантическом кэше")
+                return cached
+            cached_answer = self._cache.get_empty(user_query)
+            if cached_answer is not None:
+                logger.info("Ответ для запроса без данных найден в кэше")
+                return pd.DataFrame(), cached_answer
+        
         # Шаг 1: Генерация описания признака или запроса
         logger.info("ШАГ 1: Генерация описания признака/запроса")
         feature_description = self.generate_feature_description(user_query)
@@ -908,49 +1756,11 @@ class RAGSystemLangChain:
             logger.warning("Не найдено результатов в OpenSearch")
             return pd.DataFrame(), "К сожалению, по вашему запросу не найдено релевантных признаков в базе."
         
+        search_results = self.filter_by_score(search_results)
+        
         # Шаг 3: Проверка каждого признака
         logger.info(f"ШАГ 3: Проверка {len(search_results)} признаков")
-        matched_features = []
-        
-        for doc in search_results:
-            # Извлекаем feature_name из метаданных
-            # В индексе feature_descriptions поле feature_name хранится в метаданных
-            feature_name = doc.metadata.get('feature_name', '')
-            
-            # Если нет в метаданных, пытаемся извлечь из других полей
-            if not feature_name:
-                # Пробуем другие возможные поля
-                feature_name = doc.metadata.get('name', '')
-                if not feature_name:
-                    # Пытаемся найти в page_content (описание может начинаться с названия)
-                    text = doc.page_content or ""
-                    # Ищем паттерн или берем первую строку
-                    parts = text.split('\n')
-                    for part in parts[:3]:  # Проверяем первые 3 строки
-                        part = part.strip()
-                        if part and len(part) < 100:  # Название обычно короткое
-                            feature_name = part
-                            break
-            
-            # Извлекаем описание
-            feature_desc = doc.page_content if doc.page_content else ""
-            if not feature_desc:
-                feature_desc = doc.metadata.get('description', '')
-            
-            # Ограничиваем длину описания для промпта
-            feature_desc = feature_desc[:1000] if feature_desc else ""
-            
-            if not feature_name:
-                logger.warning(f"Не удалось извлечь feature_name из документа. Метаданные: {doc.metadata.keys()}")
-                continue
-            
-            # Проверяем соответствие признака запросу
-            if self.check_feature_match(user_query, feature_name, feature_desc):
-                matched_features.append({
-                    'feature_name': feature_name,
-                    'description': feature_desc,
-                    'doc': doc
-                })
+        matched_features = self.match_features(user_query, search_results)
         
         if not matched_features:
             logger.warning("Не найдено признаков, соответствующих запросу")
@@ -959,29 +1769,42 @@ class RAGSystemLangChain:
         logger.info(f"Найдено {len(matched_features)} соответствующих признаков")
         
         # Шаг 4: Генерация и выполнение SQL запросов
+        # Запросы для разных признаков независимы и ограничены сетью (GigaChat),
+        # поэтому выполняем их параллельно
         logger.info("ШАГ 4: Генерация и выполнение SQL запросов")
         all_results = []
+        result_features = []
         
-        for feature_info in matched_features:
-            feature_name = feature_info['feature_name']
-            feature_desc = feature_info['description']
-            
-            # Генерируем SQL запрос
-            sql_query = self.generate_sql_query(user_query, feature_name, feature_desc)
+        with ThreadPoolExecutor(max_workers=min(4, len(matched_features))) as executor:
+            futures = [
+                (
+                    feature_info['feature_name'],
+                    executor.submit(
+                        self._run_sql_for_feature,
+                        user_query,
+                        feature_info['feature_name'],
+                        feature_info['description']
+                    )
+                )
+                for feature_info in matched_features
+            ]
             
-            if sql_query:
-                # Выполняем SQL запрос
-                result_df = self.execute_sql_query(sql_query)
+            for feature_name, future in futures:
+                try:
+                    result_df = future.result()
+                except Exception as e:
+                    logger.error(f"Ошибка SQL для признака '{feature_name}': {e}")
+                    continue
                 
-                if not result_df.empty:
-                    # Добавляем информацию о признаке
-                    result_df['matched_feature'] = feature_name
+                if result_df is not None and not result_df.empty:
+                    # Колонка matched_feature добавляется при объединении
                     all_results.append(result_df)
+                    result_features.append(feature_name)
                     logger.info(f"Для признака '{feature_name}' найдено {len(result_df)} записей")
         
         # Объединяем все результаты
         if all_results:
-            combined_results = pd.concat(all_results, ignore_index=True)
+            combined_results = self.combine_results(all_results, result_features)
             logger.info(f"Всего найдено {len(combined_results)} записей")
         else:
             combined_results = pd.DataFrame()
@@ -991,6 +1814,9 @@ class RAGSystemLangChain:
         logger.info("ШАГ 5: Генерация финального ответа преподавателя")
         final_answer = self.generate_final_summary(user_query, combined_results)
         
+        if self._cache is not None and not combined_results.empty:
+            self._cache.put(user_query, combined_results, final_answer)
+        
         return combined_results, final_answer
     
     def extract_coordinates(self, results_df: pd.DataFrame) -> List[Dict[str, Any]]:
@@ -1003,74 +1829,42 @@ class RAGSystemLangChain:
         Returns:
             Список словарей с координатами: [{"lon": float, "lat": float, "info": str}, ...]
         """
-        coordinates = []
+        if results_df.empty or 'lon' not in results_df.columns or 'lat' not in results_df.columns:
+            return []
         
-        if results_df.empty:
-            return coordinates
+        # Массивы координат приводятся к числам без разбора строк
+        results_df = _flatten_list_coordinates(results_df)
+        lon = results_df['lon']
+        lat = results_df['lat']
+        if not pd.api.types.is_numeric_dtype(lon):
+            lon = pd.to_numeric(_extract_coordinate_strings(lon, take_last=False), errors='coerce')
+        if not pd.api.types.is_numeric_dtype(lat):
+            lat = pd.to_numeric(_extract_coordinate_strings(lat, take_last=True), errors='coerce')
         
-        if 'lon' in results_df.columns and 'lat' in results_df.columns:
-            for idx, row in results_df.iterrows():
-                lon = row.get('lon', None)
-                lat = row.get('lat', None)
-                
-                if pd.notna(lon) and pd.notna(lat):
-                    lon_str = str(lon).strip()
-                    lat_str = str(lat).strip()
-                    
-                    # Обработка массивов координат
-                    if lon_str.startswith('['):
-                        try:
-                            import ast
-                            lon_array = ast.literal_eval(lon_str)
-                            if isinstance(lon_array, list) and len(lon_array) > 0:
-                                lon_val = float(lon_array[0])
-                            else:
-                                continue
-                        except:
-                            try:
-                                lon_val = float(lon_str.strip('[]').split(',')[0].strip())
-                            except:
-                                continue
-                    else:
-                        try:
-                            lon_val = float(lon_str)
-                        except:
-                            continue
-                    
-                    if lat_str.startswith('['):
-                        try:
-                            import ast
-                            lat_array = ast.literal_eval(lat_str)
-                            if isinstance(lat_array, list) and len(lat_array) > 0:
-                                lat_val = float(lat_array[-1] if len(lat_array) > 1 else lat_array[0])
-                            else:
-                                continue
-                        except:
-                            try:
-                                lat_val = float(lat_str.strip('[]').split(',')[-1].strip())
-                            except:
-                                continue
-                    else:
-                        try:
-                            lat_val = float(lat_str)
-                        except:
-                            continue
-                    
-                    # Валидация координат
-                    if -180 <= lon_val <= 180 and -90 <= lat_val <= 90:
-                        # Собираем дополнительную информацию о записи
-                        info_parts = []
-                        for col in ['layer_name', 'Регион', 'Свита', 'Пласт', 'matched_feature']:
-                            if col in row and pd.notna(row[col]):
-                                info_parts.append(f"{col}: {row[col]}")
-                        
-                        info = ", ".join(info_parts) if info_parts else f"Запись {idx + 1}"
-                        
-                        coordinates.append({
-                            "lon": lon_val,
-                            "lat": lat_val,
-                            "info": info
-                        })
+        # Валидация координат одной маской по всем записям
+        valid = lon.between(-180, 180) & lat.between(-90, 90)
+        if not valid.any():
+            return []
+        
+        # Дополнительная информация о записи
+        valid_df = results_df[valid]
+        info_columns = [
+            (col, valid_df[col].tolist())
+            for col in _COORDINATE_INFO_COLUMNS
+            if col in valid_df.columns
+        ]
+        coordinates = []
+        for pos, (idx, lon_val, lat_val) in enumerate(zip(valid_df.index, lon[valid].tolist(), lat[valid].tolist())):
+            info_parts = [
+                f"{col}: {values[pos]}"
+                for col, values in info_columns
+                if pd.notna(values[pos])
+            ]
+            coordinates.append({
+                "lon": lon_val,
+                "lat": lat_val,
+                "info": ", ".join(info_parts) if info_parts else f"Запись {idx + 1}"
+            })
         
         return coordinates
 